@@ -169,7 +169,10 @@ def main(argv=None):
     # Open input catalogue
     if params['verbose']:
         print(f'Reading catalogue {params["input_cat"]}...')
-    dat = fits.getdata(params['input_cat'])
+    dat = wl_cat.read_columns(
+        params['input_cat'],
+        columns=[params['key_ra'], params['key_dec']],
+    )
     ra = dat[params['key_ra']]
     dec = dat[params['key_dec']]
 
@@ -198,8 +201,10 @@ def main(argv=None):
             + f' {n_in_footprint/len(ra):.2%} objects in footprint'
         )
 
-    # Restrict data to footprint
-    dat_in_footprint = dat[idx_np]
+    # Restrict all columns to footprint. Columns are kept in file byte
+    # order, to only copy rows in the footprint
+    dat_all = wl_cat.read_columns(params['input_cat'], native=False)
+    dat_in_footprint = {key: dat_all[key][idx_np] for key in dat_all}
 
     # Write data in footprint to disk
     t = Table(dat_in_footprint)
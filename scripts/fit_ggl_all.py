@@ -330,7 +330,8 @@ def plot_data_only(ng, n_split_arr, weight, shapes, physical):
 def g_t_model(params, x_data, extra):
     """G_T_Model.
 
-    Tangential shear model
+    Tangential shear model, see :func:`unions_wl.theory.g_t_model`. The
+    model is emulated if extra contains an 'emulator'.
 
     Parameters
     ----------
@@ -347,44 +348,7 @@ def g_t_model(params, x_data, extra):
         y-values of the model (tangential shear)
 
     """
-    cosmo = extra['cosmo']
-
-    z_centers = {}
-    nz = {}
-    for sample in ('source', 'lens'):
-        z_centers[sample] = extra[f'z_centers_{sample}']
-        nz[sample] = extra[f'nz_{sample}']
-
-    # Set up model for 3D galaxy-matter power spectrum
-    pk_gm_info = {}
-    if 'bias_1' in params:
-        pk_gm_info['model_type'] = 'linear_bias'
-        pk_gm_info['bias_1'] = params['bias_1']
-    else:
-        pk_gm_info['model_type'] = 'HOD'
-        pk_gm_info['log10_Mmin'] = params['log10_Mmin']
-
-    if not extra['physical']:
-        y_model, _, _ = theory.gamma_t_theo(
-            x_data,
-            cosmo,
-            (z_centers['lens'], nz['lens']),
-            (z_centers['source'], nz['source']),
-            pk_gm_info,
-            integr_method='FFTlog',
-        )
-    else:
-        y_model = theory.gamma_t_theo_phys(
-            x_data,
-            cosmo,
-            (z_centers['lens'], nz['lens']),
-            (z_centers['source'], nz['source']),
-            pk_gm_info,
-            integr_method='FFTlog',
-            Delta_Sigma=False,
-        )
-
-    return y_model
+    return theory.g_t_model(params, x_data, extra)
 
 
 def loss(params, x_data, y_data, err, extra):
@@ -448,6 +412,7 @@ def set_args_minimizer(
                         'z_centers_source': z_centers['source'][sh][blind],
                         'nz_source': nz['source'][sh][blind],
                         'physical': physical,
+                        'ell': 'auto',
                     }
 
                     # get scales
@@ -468,9 +433,9 @@ def set_args_minimizer(
                     if not physical:
                         # transform from arcmin to deg 
                         x_w = x_w / 60
-                    else:
-                        # Error computation not yet implemented
-                        print('MKDEBUG no error bars yet!')
+                    elif not np.any(err > 0):
+                        # No error bars in input (e.g. no patch jackknife)
+                        print('No error bars in input, use y/5')
                         err = y / 5
                     gt = y[w]
                     dgt = err[w]
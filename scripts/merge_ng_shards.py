@@ -0,0 +1,29 @@
+#!/usr/bin/env python
+
+"""merge_ng_shards.py
+
+Command-line script to merge partial outputs of sharded
+GGL (ng-correlation) runs, see compute_ng_binned_samples.py --shard.
+
+:Authors: Martin Kilbinger
+
+"""
+
+import sys
+
+
+from unions_wl.run import run_merge_ng_shards
+
+def main(argv=None):
+    """Main
+
+    Main program
+
+    """
+    run_merge_ng_shards(*argv)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
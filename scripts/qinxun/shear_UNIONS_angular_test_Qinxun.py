@@ -15,6 +15,7 @@ import treecorr as tc
 import os
 from numpy import logical_and as n_a
 import pandas as pd
+from unions_wl import catalogue as cat_wl
 import multiprocessing as mp
 import numpy.random as random
 import time
@@ -231,7 +232,7 @@ pool = mp.Pool(Npro)
 lens_name='modelC_group_Mh114.5+'
 lens_path='%s/%s.csv'%(lens_rou,lens_name)
 # lensdata=np.loadtxt(lens_path,unpack=True)
-lensdata=pd.read_csv(lens_path)
+lensdata=pd.DataFrame(cat_wl.read_columns(lens_path,['ra','dec','z']))
 # index=['ra','dec','z','logM','logM_err']
 # lensdata=pd.DataFrame(lensdata.T,columns=index)
 # idx=lensdata['z']>0.08
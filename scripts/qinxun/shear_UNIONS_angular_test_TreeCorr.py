@@ -13,6 +13,7 @@ from astropy.cosmology import Planck18 as cosmo
 import astropy.units as u
 import treecorr as tc
 import pandas as pd
+from unions_wl import catalogue as cat_wl
 import multiprocessing as mp
 import numpy.random as random
 import time
@@ -79,7 +80,7 @@ def write_res(res,path):
 #     output_path='/data/Qinxun/KiDSdata/Shear_signal/shear_%s'%(lens_name)
 #     write_res(res,output_path)
 # for i in range(2):
-sourcedata = fits.getdata(catalogue_path, 1)
+sourcedata = cat_wl.read_columns(catalogue_path, ['ra','dec','e1','e2','w'])
 
 # for i in range(3):
 cat = tc.Catalog(ra=sourcedata['ra'], dec=sourcedata['dec'], g1=sourcedata['e1'], g2=sourcedata['e2'],w=sourcedata['w'], ra_units='degrees', dec_units='degrees')
@@ -88,7 +89,7 @@ print('Finish loading source catalog')
 lens_name='modelC_group_Mh114.5+'
 lens_path='%s/%s.csv'%(lens_rou,lens_name)
 # lensdata=np.loadtxt(lens_path,unpack=True)
-lensdata=pd.read_csv(lens_path)
+lensdata=pd.DataFrame(cat_wl.read_columns(lens_path,['ra','dec']))
 # lensdata=np.loadtxt(lens_path,unpack=True)
 # index=['ra','dec','z','logM','logM_err']
 # lensdata=pd.DataFrame(lensdata.T,columns=index)
@@ -15,10 +15,13 @@ from sklearn.neighbors import KDTree
 import os
 from numpy import logical_and as n_a
 import pandas as pd
+from unions_wl import catalogue as cat_wl
+from unions_wl import distances
 import multiprocessing as mp
 import numpy.random as random
 import time
 h=cosmo.H0.value/100
+dist_table=distances.get_distance_table(cosmo) # Interpolated distances
 pi=np.pi
 
 catalogue_path = '/data/Qinxun/UNIONS_shape/Lensfit/lensfit_goldshape_2022v1.fits' # The path of shape catalog
@@ -45,7 +48,7 @@ r_ph=(r[1:]+r[:-1])/2
 # r=r[0:8]/h
 # r_ph=r_ph[0:7]/h
 
-sourcedata = fits.getdata(catalogue_path, 1)
+sourcedata = cat_wl.read_columns(catalogue_path, ['ra','dec','e1','e2','w'])
 # cat = tc.Catalog(ra=sourcedata['ra'], dec=sourcedata['dec'], g1=sourcedata['e1'], g2=sourcedata['e2'],w=sourcedata['w'], ra_units='degrees', dec_units='degrees')
 coor_source=np.array([sourcedata['ra'],sourcedata['dec']]).T
 sourcenum=len(sourcedata['ra'])
@@ -74,7 +77,7 @@ def download_KDTree(cor_len,tree,Rmax):
 
 def shear(gal_idx,gal_l,rp,maxlens):
     wt_l=gal_l['w']
-    d=cosmo.angular_diameter_distance(gal_l['z']).to(u.Mpc).value*h
+    d=dist_table.d_ang(gal_l['z'])*h
     # sep_ph_min=rp[0]
     sep_ph_max=rp[-1]
     Nbins=len(rp)-1
@@ -86,7 +89,7 @@ def shear(gal_idx,gal_l,rp,maxlens):
     idx=FalseArray.copy()
     idx[gals_s_idx]=True
     
-    gals_s=sourcedata[idx]
+    gals_s={key:sourcedata[key][idx] for key in sourcedata}
     if type(gals_s) == str:
         return 0
     # col_s = ['RA','DEC','e1','e2','wt']
@@ -116,7 +119,7 @@ def shear(gal_idx,gal_l,rp,maxlens):
             gm2[i] = 0
             wgt[i] = 0
         else:
-            galb_s = gals_s[idx]
+            galb_s = {key:gals_s[key][idx] for key in gals_s}
             wt =galb_s['w']
             ep=galb_s['e1']
             em=galb_s['e2']
@@ -238,7 +241,7 @@ pool = mp.Pool(Npro)
 # for i in range(2):
 
     # lensdata=np.loadtxt(lens_path,unpack=True)
-lensdata=pd.read_csv(lens_path)
+lensdata=pd.DataFrame(cat_wl.read_columns(lens_path,['ra','dec','z']))
 # lensdata=reform(lensdata)
 
 lensdata['w']=np.ones_like(lensdata['ra'])
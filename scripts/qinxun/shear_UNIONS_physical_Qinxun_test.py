@@ -15,10 +15,13 @@ import treecorr as tc
 import os
 from numpy import logical_and as n_a
 import pandas as pd
+from unions_wl import catalogue as cat_wl
+from unions_wl import distances
 import multiprocessing as mp
 import numpy.random as random
 import time
 h=cosmo.H0.value/100
+dist_table=distances.get_distance_table(cosmo) # Interpolated distances
 pi=np.pi
 
 catalogue_path = '/data/Qinxun/UNIONS_shape/Lensfit/UNIONS_lensfit/' # The path of shape catalog
@@ -88,7 +91,7 @@ def download(RA,DEC,Rmax):
 
 def shear(gal_idx,gal_l,rp,maxlens):
     wt_l=gal_l['w']
-    d=cosmo.angular_diameter_distance(gal_l['z']).to(u.Mpc).value*h
+    d=dist_table.d_ang(gal_l['z'])*h
     # sep_ph_min=rp[0]
     sep_ph_max=rp[-1]
     Nbins=len(rp)-1
@@ -248,7 +251,7 @@ pool = mp.Pool(Npro)
 # for i in range(2):
 
     # lensdata=np.loadtxt(lens_path,unpack=True)
-lensdata=pd.read_csv(lens_path)
+lensdata=pd.DataFrame(cat_wl.read_columns(lens_path,['ra','dec','z']))
 # lensdata=reform(lensdata)
 
 lensdata['w']=np.ones_like(lensdata['ra'])
@@ -11,8 +11,9 @@ import multiprocessing as mp
 import math
 from astropy.io import fits
 import pandas as pd
+from unions_wl import catalogue as cat_wl
 
-data = fits.getdata('/data/Qinxun/UNIONS_shape/ShapePipe/unions_shapepipe_2022_v1.0.fits', 1)
+data = cat_wl.read_columns('/data/Qinxun/UNIONS_shape/ShapePipe/unions_shapepipe_2022_v1.0.fits', ['RA','Dec','e1','e2','w'])
 f=open('/data/Qinxun/UNIONS_shape/ShapePipe/unions_shapepipe.dat','w+')
 for i in range(len(data['RA'])):
     print(data['RA'][i],data['Dec'][i],data['e1'][i],data['e2'][i],data['w'][i],file=f)
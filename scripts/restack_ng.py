@@ -0,0 +1,30 @@
+#!/usr/bin/env python
+
+"""restack_ng.py
+
+Command-line script to re-stack stored per-object
+GGL (ng-correlation) pair sums for new foreground samples and weights,
+see compute_ng_binned_samples.py --out_path_store.
+
+:Authors: Martin Kilbinger
+
+"""
+
+import sys
+
+
+from unions_wl.run import run_restack_ng
+
+def main(argv=None):
+    """Main
+
+    Main program
+
+    """
+    run_restack_ng(*argv)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
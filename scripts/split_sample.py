@@ -25,12 +25,12 @@ from astropy.io import fits
 
 from unions_wl import catalogue as cat_wl
 from unions_wl import defaults
+from unions_wl import distances
 
 from cs_util import logging
 from cs_util import calc
 from cs_util import plots
 from cs_util import cat as cat_csu
-from cs_util import cosmo as cosmo_csu
 
 
 def params_default():
@@ -349,10 +349,15 @@ def main(argv=None):
     # Open input catalogue and read into dictionary
     if params['verbose']:
         print(f'Reading catalogue {params["input_path"]}...')
-    dat_fits = fits.getdata(params["input_path"])
-    dat = {}
-    for key in dat_fits.dtype.names:
-        dat[key] = dat_fits[key]
+    dat = dict(cat_wl.read_columns(
+        params["input_path"],
+        columns=[
+            params['key_ra'],
+            params['key_dec'],
+            params['key_z'],
+            params['key_logM'],
+        ],
+    ))
 
     # To split into more equi-populated bins, compute cumulative
     # distribution function
@@ -479,52 +484,24 @@ def main(argv=None):
 
         cosmo = defaults.get_cosmo_default()
 
-        # Source redshift distribution and distances
+        # Source redshift distribution
         z_source, nz_source, _ = cat_csu.read_dndz(params['dndz_source_path'])
-        a_source = 1 / (1 + z_source)
-        d_ang_source = cosmo.angular_diameter_distance(a_source)
-
-        # Create spline interpolation function
-        nz_source_interp = interpolate.InterpolatedUnivariateSpline(z_source, nz_source)
-        d_ang_source_interp = interpolate.InterpolatedUnivariateSpline(z_source, d_ang_source)
-
-        # Rebin source to lower number to speed up Sigma_cr computation
-        n_z_source_rebin = 25
-        z_source_rebin = np.linspace(z_source[0], z_source[-1], n_z_source_rebin)
-        nz_source_rebin = nz_source_interp(z_source_rebin)
-        d_ang_source_rebin = d_ang_source_interp(z_source_rebin)
+        dist_table = distances.get_distance_table(
+            cosmo,
+            z_max=np.max(z_source),
+        )
 
         # Loop over lens selections
         for idx, mask in enumerate(mask_list):
 
-            n_z_lens = 25
-            z_lens = np.linspace(z_min, z_max, n_z_lens)
-            a_lens = 1 / (1 + z_lens)
-            d_ang_lens = cosmo.angular_diameter_distance(a_lens)
-            d_ang_lens_interp = interpolate.InterpolatedUnivariateSpline(z_lens, d_ang_lens)
-
-            sig_cr_w = np.ones_like(dat[params['key_z']][mask])
-
-            # Loop over lens objects
-            for idz, z in tqdm(
-                enumerate(dat[params['key_z']][mask]),
-                total=len(dat[params['key_z']][mask]),
-                disable=not params['verbose'],
-                desc=f'split {idx}/{params["n_split"]}',
-            ):
-                #a_lens = 1 / (1 + z)
-                #d_ang_lens = cosmo.angular_diameter_distance(a_lens)
-                d_ang_lens_spline = d_ang_lens_interp(z)
-                sig_crit_m1_eff = cosmo_csu.sigma_crit_m1_eff(
-                    z,
-                    z_source_rebin,
-                    nz_source_rebin,
-                    cosmo,
-                    d_lens=d_ang_lens_spline,
-                    d_source_arr=d_ang_source_rebin,
-                )
-
-                sig_cr_w[idz] = sig_crit_m1_eff.value ** 2
+            # Effective critical surface mass densities of all lens
+            # objects, interpolated from table
+            sig_crit_m1_eff = dist_table.sigma_crit_m1_eff(
+                dat[params['key_z']][mask],
+                z_source,
+                nz_source,
+            )
+            sig_cr_w = sig_crit_m1_eff ** 2
 
             # Apply weights
             dat[f'w_{idx}'][mask] = dat[f'w_{idx}'][mask] * sig_cr_w
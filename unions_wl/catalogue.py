@@ -7,10 +7,19 @@ catalogues.
 
 """
 
+import os
+import hashlib
+import json
+import shutil
+
+from collections.abc import Mapping
+
 import numpy as np
+import pandas as pd
 import healpy as hp
 
 from astropy.io import ascii
+from astropy.io import fits
 from astropy.table import Table
 
 import treecorr
@@ -146,6 +155,289 @@ def get_ngcorr_data(
     return ng
 
 
+class FitsColumns(Mapping):
+    """Fits Columns.
+
+    Read-only mapping of column names to columns of a FITS table.
+    The file is memory-mapped, and columns are zero-copy views into the
+    file. Columns that are not in native byte order are converted on
+    first access if ``native`` is True; only these columns are copied
+    into memory.
+
+    Parameters
+    ----------
+    path : str
+        input file path
+    columns : list, optional
+        column names to provide, default is ``None`` (all columns)
+    hdu : int, optional
+        HDU number, default is 1
+    native : bool, optional
+        convert columns to native byte order on first access if True
+        (default)
+
+    """
+
+    def __init__(self, path, columns=None, hdu=1, native=True):
+        self._hdu_list = fits.open(path, memmap=True)
+        self._fits_data = self._hdu_list[hdu].data
+
+        names = self._fits_data.dtype.names
+        if columns is None:
+            columns = list(names)
+        else:
+            for col in columns:
+                if col not in names:
+                    raise KeyError(f'Column {col} not found in {path}')
+        self._columns = list(columns)
+        self._native = native
+        self._cache = {}
+
+    def __getitem__(self, key):
+        if key not in self._columns:
+            raise KeyError(key)
+        if key not in self._cache:
+            values = self._fits_data.field(key)
+            if self._native and not values.dtype.isnative:
+                values = values.astype(values.dtype.newbyteorder('='))
+            self._cache[key] = values
+        return self._cache[key]
+
+    def __iter__(self):
+        return iter(self._columns)
+
+    def __len__(self):
+        return len(self._columns)
+
+    @property
+    def n_row(self):
+        """Return number of rows."""
+        return len(self._fits_data)
+
+    def close(self):
+        """Close.
+
+        Close input file. Column views that are not native copies become
+        invalid.
+
+        """
+        self._cache = {}
+        self._fits_data = None
+        self._hdu_list.close()
+
+
+def read_columns(path, columns=None, hdu=1, native=True, **kwargs):
+    """Read Columns.
+
+    Return columns of a catalogue. Only the requested columns are read.
+    FITS files are memory-mapped, see :class:`FitsColumns`; other files
+    are read as text table with pandas.
+
+    Parameters
+    ----------
+    path : str
+        input file path
+    columns : list, optional
+        column names, default is ``None`` (all columns)
+    hdu : int, optional
+        HDU number for FITS input, default is 1
+    native : bool, optional
+        convert FITS columns to native byte order on first access if
+        True (default)
+    kwargs : dict, optional
+        additional arguments for ``pandas.read_csv``
+
+    Returns
+    -------
+    Mapping
+        column data
+
+    """
+    if path.lower().endswith(('.fits', '.fit', '.fits.gz')):
+        return FitsColumns(path, columns=columns, hdu=hdu, native=native)
+
+    df = pd.read_csv(path, usecols=columns, **kwargs)
+    return {key: df[key].to_numpy() for key in df.columns}
+
+
+def get_typed_column(values, factor=1, dtype=np.float64):
+    """Get Typed Column.
+
+    Return column as contiguous array of given type, multiplied by
+    a factor. Type and byte-order conversion and multiplication are
+    carried out in one pass, creating at most one copy of the input.
+
+    Parameters
+    ----------
+    values : array_like
+        input column
+    factor : float, optional
+        multiplicative factor, e.g. sign, default is 1
+    dtype : type, optional
+        output type, default is ``numpy.float64``
+
+    Returns
+    -------
+    numpy.array
+        typed column
+
+    """
+    if factor == 1:
+        return np.ascontiguousarray(values, dtype=dtype)
+
+    return np.multiply(values, factor, dtype=dtype)
+
+
+def get_cache_key(path, **settings):
+    """Get Cache Key.
+
+    Return key identifying prepared data of an input file. The key
+    changes if the file is modified, or if any setting changes.
+
+    Parameters
+    ----------
+    path : str
+        input file path
+    settings : dict, optional
+        settings used to prepare the data, e.g. column names and signs;
+        values need to be JSON-serializable
+
+    Returns
+    -------
+    str
+        cache key
+
+    """
+    stat = os.stat(path)
+    info = {
+        'path': os.path.realpath(path),
+        'mtime_ns': stat.st_mtime_ns,
+        'size': stat.st_size,
+        'settings': settings,
+    }
+    info_str = json.dumps(info, sort_keys=True)
+
+    return hashlib.sha1(info_str.encode()).hexdigest()[:20]
+
+
+def write_cache(cache_dir, key, arrays):
+    """Write Cache.
+
+    Write prepared arrays to the cache. The cache entry is created
+    atomically, such that concurrent runs see either no or a complete
+    entry. If the entry exists, only arrays not yet cached are added,
+    each of them atomically.
+
+    Parameters
+    ----------
+    cache_dir : str
+        cache directory
+    key : str
+        cache key, see :func:`get_cache_key`
+    arrays : dict
+        arrays to store; ``None`` values are skipped
+
+    """
+    entry_dir = os.path.join(cache_dir, key)
+    tmp_suffix = f'.tmp{os.getpid()}'
+
+    if not os.path.isdir(entry_dir):
+        tmp_dir = f'{entry_dir}{tmp_suffix}'
+        os.makedirs(tmp_dir, exist_ok=True)
+        for name, values in arrays.items():
+            if values is not None:
+                np.save(os.path.join(tmp_dir, f'{name}.npy'), values)
+
+        try:
+            os.rename(tmp_dir, entry_dir)
+            return
+        except OSError:
+            # Entry created by another run in the meantime
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    for name, values in arrays.items():
+        path = os.path.join(entry_dir, f'{name}.npy')
+        if values is None or os.path.exists(path):
+            continue
+        with open(f'{path}{tmp_suffix}', 'wb') as f_out:
+            np.save(f_out, values)
+        os.replace(f'{path}{tmp_suffix}', path)
+
+
+def read_cache(cache_dir, key, names):
+    """Read Cache.
+
+    Read prepared arrays from the cache as memory maps.
+
+    Parameters
+    ----------
+    cache_dir : str
+        cache directory
+    key : str
+        cache key, see :func:`get_cache_key`
+    names : list
+        array names; arrays not in the cache are set to ``None``
+
+    Returns
+    -------
+    dict
+        arrays; ``None`` if no cache entry exists
+
+    """
+    entry_dir = os.path.join(cache_dir, key)
+    if not os.path.isdir(entry_dir):
+        return None
+
+    data = {}
+    for name in names:
+        path = os.path.join(entry_dir, f'{name}.npy')
+        if os.path.exists(path):
+            data[name] = np.load(path, mmap_mode='r')
+        else:
+            data[name] = None
+
+    return data
+
+
+def read_fits_chunks(path, columns, chunk_size, hdu=1):
+    """Read FITS Chunks.
+
+    Read columns of a FITS table in chunks of rows. The file is
+    memory-mapped, such that only the current chunk of the requested
+    columns is held in memory.
+
+    Parameters
+    ----------
+    path : str
+        input file path
+    columns : list
+        column names
+    chunk_size : int
+        number of rows per chunk
+    hdu : int, optional
+        HDU number, default is 1
+
+    Yields
+    ------
+    dict
+        columns of the current chunk, as native-endian arrays
+
+    """
+    if chunk_size < 1:
+        raise ValueError(f'Invalid chunk size {chunk_size}')
+
+    with fits.open(path, memmap=True) as hdu_list:
+        data = hdu_list[hdu].data
+        n_row = len(data)
+        for start in range(0, n_row, chunk_size):
+            stop = min(start + chunk_size, n_row)
+            chunk = {}
+            for col in columns:
+                values = data.field(col)[start:stop]
+                chunk[col] = values.astype(values.dtype.newbyteorder('='))
+            yield chunk
+
+
 def read_hp_mask(input_name, verbose=False):
 
     if verbose:                                                       
@@ -0,0 +1,314 @@
+"""CORRELATE_NG MODULE.
+
+:Description: This module provides a vectorized computation of
+    number-shear correlations for individual foreground objects.
+    Lens-source pairs are found with one spatial index (k-d tree) of
+    the background sample, and binned directly in per-lens
+    (physical or angular) radius.
+
+:Authors: Martin Kilbinger <martin.kilbinger@cea.fr>
+
+"""
+
+import numpy as np
+
+from scipy.spatial import cKDTree
+
+import treecorr
+
+from unions_wl.stack_ng import NGStack
+
+
+def radec_to_xyz(ra, dec, coord_units='degrees'):
+    """Radec To XYZ.
+
+    Transform spherical coordinates to unit vectors.
+
+    Parameters
+    ----------
+    ra : numpy.array
+        right ascension
+    dec : numpy.array
+        declination
+    coord_units : str, optional
+        units of ra and dec, default is 'degrees'
+
+    Returns
+    -------
+    numpy.array
+        cartesian coordinates on the unit sphere, shape (n, 3)
+
+    """
+    fac = treecorr.config.parse_unit(coord_units)
+    ra_rad = np.asarray(ra, dtype=float) * fac
+    dec_rad = np.asarray(dec, dtype=float) * fac
+
+    cos_dec = np.cos(dec_rad)
+    xyz = np.empty((len(ra_rad), 3))
+    xyz[:, 0] = cos_dec * np.cos(ra_rad)
+    xyz[:, 1] = cos_dec * np.sin(ra_rad)
+    xyz[:, 2] = np.sin(dec_rad)
+
+    return xyz
+
+
+def build_tree(ra, dec, coord_units='degrees'):
+    """Build Tree.
+
+    Build spatial index of (background) objects.
+
+    Parameters
+    ----------
+    ra : numpy.array
+        right ascension
+    dec : numpy.array
+        declination
+    coord_units : str, optional
+        units of ra and dec, default is 'degrees'
+
+    Returns
+    -------
+    scipy.spatial.cKDTree
+        k-d tree of unit vectors
+
+    """
+    xyz = radec_to_xyz(ra, dec, coord_units=coord_units)
+
+    return build_tree_xyz(xyz)
+
+
+def build_tree_xyz(xyz):
+    """Build Tree XYZ.
+
+    Build spatial index of (background) objects from unit vectors.
+
+    Parameters
+    ----------
+    xyz : numpy.array
+        cartesian coordinates on the unit sphere, shape (n, 3), see
+        :func:`radec_to_xyz`; can be memory-mapped
+
+    Returns
+    -------
+    scipy.spatial.cKDTree
+        k-d tree of unit vectors
+
+    """
+    # Do not keep a copy of the input coordinates
+    return cKDTree(xyz, copy_data=False, balanced_tree=False)
+
+
+def get_log_bins(scale_min, scale_max, n_bin):
+    """Get Log Bins.
+
+    Return logarithmic bin edges, as used by treecorr.
+
+    Parameters
+    ----------
+    scale_min : float
+        smallest scale
+    scale_max : float
+        largest scale
+    n_bin : int
+        number of bins
+
+    Returns
+    -------
+    numpy.array
+        bin edges, size n_bin + 1
+
+    """
+    return np.geomspace(scale_min, scale_max, n_bin + 1)
+
+
+def correlate_per_lens(
+    tree,
+    g1,
+    g2,
+    w_bg,
+    ra_fg,
+    dec_fg,
+    w_fg,
+    r_edges,
+    scale=None,
+    coord_units='degrees',
+    n_block=256,
+    max_pairs=2 ** 22,
+    n_cpu=1,
+    dtype=np.float64,
+):
+    """Correlate Per Lens.
+
+    Compute number-shear pair sums for each foreground object
+    individually. Pairs are binned in r = chord distance x scale,
+    where scale is for example the angular diameter distance of
+    the foreground object (physical scales), or unity (angular scales).
+
+    The shear projection follows treecorr's convention for spherical
+    coordinates, such that the sums are the same as the (raw, not
+    finalized) output of ``treecorr.NGCorrelation.process_cross``
+    with ``brute=True``.
+
+    Parameters
+    ----------
+    tree : scipy.spatial.cKDTree
+        k-d tree of background objects, see :func:`build_tree`
+    g1 : numpy.array
+        first shear component of background objects
+    g2 : numpy.array
+        second shear component of background objects
+    w_bg : numpy.array
+        background weights, ``None`` for unit weights
+    ra_fg : numpy.array
+        foreground right ascension
+    dec_fg : numpy.array
+        foreground declination
+    w_fg : numpy.array
+        foreground weights, ``None`` for unit weights
+    r_edges : numpy.array
+        logarithmic bin edges, in units of scale (radians if scale is
+        ``None``)
+    scale : numpy.array, optional
+        per-object scale factor, e.g. angular diameter distance;
+        default is ``None`` (unity)
+    coord_units : str, optional
+        units of ra and dec, default is 'degrees'
+    n_block : int, optional
+        maximum number of foreground objects processed at once, default
+        is 256
+    max_pairs : int, optional
+        maximum number of pairs processed at once, unless a single
+        object has more pairs; default is 2^22
+    n_cpu : int, optional
+        number of CPUs for the tree search, default is 1
+    dtype : type, optional
+        storage type of pair sums, default is ``numpy.float64``
+
+    Returns
+    -------
+    unions_wl.stack_ng.NGStack
+        per-object pair sums, each of shape (n_fg, n_bin)
+
+    """
+    xyz_fg = radec_to_xyz(ra_fg, dec_fg, coord_units=coord_units)
+    xyz_bg = tree.data
+
+    n_fg = len(xyz_fg)
+    n_bin = len(r_edges) - 1
+
+    if scale is None:
+        scale = np.ones(n_fg)
+    else:
+        scale = np.asarray(scale, dtype=float)
+
+    log_r_min = np.log(r_edges[0])
+    log_r_max = np.log(r_edges[-1])
+    bin_size = (log_r_max - log_r_min) / n_bin
+
+    # Search radius (chord distance) for each object
+    chord_max = r_edges[-1] / scale
+
+    sums = NGStack(n_bin, n_obj=n_fg, dtype=dtype)
+
+    # Number of pairs of each object
+    n_pairs = tree.query_ball_point(
+        xyz_fg,
+        chord_max,
+        return_length=True,
+        workers=n_cpu,
+    ).astype(np.intp)
+    n_pairs_cum = np.concatenate(([0], np.cumsum(n_pairs)))
+
+    # Blocks of objects with at most max_pairs pairs, and at least one
+    # object each
+    blocks = []
+    start = 0
+    while start < n_fg:
+        stop = np.searchsorted(
+            n_pairs_cum,
+            n_pairs_cum[start] + max_pairs,
+            side='right',
+        ) - 1
+        stop = min(max(stop, start + 1), start + n_block, n_fg)
+        blocks.append((start, stop))
+        start = stop
+
+    for start, stop in blocks:
+        n_this = stop - start
+        offsets = n_pairs_cum[start:stop + 1] - n_pairs_cum[start]
+        if offsets[-1] == 0:
+            continue
+
+        # Pair indices of this block, queried object by object into a
+        # preallocated array. Sorted indices make the summation order
+        # independent of the tree structure.
+        idx_bg = np.empty(offsets[-1], dtype=np.intp)
+        for idx in np.flatnonzero(n_pairs[start:stop]):
+            idx_bg[offsets[idx]:offsets[idx + 1]] = tree.query_ball_point(
+                xyz_fg[start + idx],
+                chord_max[start + idx],
+                return_sorted=True,
+            )
+        idx_fg = np.repeat(np.arange(n_this), n_pairs[start:stop])
+
+        p1 = xyz_fg[start:stop][idx_fg]
+        p2 = xyz_bg[idx_bg]
+        dsq = np.sum((p1 - p2) ** 2, axis=1)
+
+        # Bin index in log(r)
+        with np.errstate(divide='ignore'):
+            log_chord = 0.5 * np.log(dsq)
+        log_r = log_chord + np.log(scale[start:stop][idx_fg])
+        kdx = np.floor((log_r - log_r_min) / bin_size).astype(np.intp)
+        good = (log_r >= log_r_min) & (log_r < log_r_max)
+        good &= (kdx >= 0) & (kdx < n_bin)
+
+        idx_fg = idx_fg[good]
+        idx_bg = idx_bg[good]
+        kdx = kdx[good]
+        p1 = p1[good]
+        p2 = p2[good]
+        dsq = dsq[good]
+        log_chord = log_chord[good]
+
+        # Rotate shear to line connecting the two points, see
+        # treecorr ProjectHelper<Sphere>
+        cos_a = (p1[:, 2] - p2[:, 2]) + 0.5 * p2[:, 2] * dsq
+        sin_a = p1[:, 1] * p2[:, 0] - p1[:, 0] * p2[:, 1]
+        norm = cos_a ** 2 + sin_a ** 2
+        norm[norm == 0] = 1
+        cos_2a = (cos_a ** 2 - sin_a ** 2) / norm
+        sin_2a = 2 * sin_a * cos_a / norm
+
+        # Pair weights
+        w = np.ones(len(idx_bg))
+        if w_fg is not None:
+            w *= np.asarray(w_fg)[start:stop][idx_fg]
+        if w_bg is not None:
+            w *= w_bg[idx_bg]
+
+        my_g1 = g1[idx_bg]
+        my_g2 = g2[idx_bg]
+
+        # Tangential and cross components
+        g_t = my_g1 * cos_2a + my_g2 * sin_2a
+        g_x = my_g2 * cos_2a - my_g1 * sin_2a
+
+        # Accumulate on (object, bin) grid
+        idx_flat = idx_fg * n_bin + kdx
+        size = n_this * n_bin
+        for key, values in (
+            ('meanr', w * np.sqrt(dsq)),
+            ('meanlogr', w * log_chord),
+            ('xi', w * g_t),
+            ('xi_im', w * g_x),
+            ('weight', w),
+            ('npairs', None),
+        ):
+            sums[key][start:stop] = np.bincount(
+                idx_flat,
+                weights=values,
+                minlength=size,
+            ).reshape(n_this, n_bin)
+
+    return sums
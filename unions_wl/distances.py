@@ -0,0 +1,352 @@
+"""DISTANCES MODULE.
+
+:Description: This module provides cosmological distances and critical
+    surface mass densities, interpolated from tables which are computed
+    once per cosmology.
+
+:Authors: Martin Kilbinger <martin.kilbinger@cea.fr>
+
+"""
+
+import hashlib
+
+from collections import OrderedDict
+
+import numpy as np
+
+from astropy import constants
+from astropy import units
+from astropy.cosmology import FLRW
+
+import pyccl as ccl
+
+
+# Tables of recently used cosmologies, most recent last
+_tables = OrderedDict()
+
+# Maximum number of cached tables
+N_TABLE_MAX = 8
+
+# 4 pi G / c^2 in pc^2 / (M_sol Mpc), such that Sigma_crit^{-1} is in
+# pc^2 / M_sol for distances in Mpc
+_SIGMA_CRIT_M1_PREF = (
+    4 * np.pi * constants.G / constants.c ** 2 * units.Mpc
+).to(units.pc ** 2 / units.Msun).value
+
+
+def get_cosmo_key(cosmo):
+    """Get Cosmo Key.
+
+    Return key identifying a cosmology by its parameter values.
+
+    Parameters
+    ----------
+    cosmo : pyccl.Cosmology or astropy.cosmology.FLRW
+        cosmology
+
+    Returns
+    -------
+    str
+        key
+
+    """
+    if isinstance(cosmo, FLRW):
+        return repr(cosmo)
+
+    if hasattr(cosmo, 'to_dict'):
+        # pyccl >= 3
+        params = cosmo.to_dict()
+    else:
+        # Parameters and configuration, e.g. power-spectrum method
+        params = dict(cosmo._params_init_kwargs)
+        params.update(getattr(cosmo, '_config_init_kwargs', {}))
+
+    return repr(sorted((key, repr(params[key])) for key in params))
+
+
+class DistanceTable(object):
+    """Distance Table.
+
+    This class stores distances on a dense, regular redshift grid, for
+    fast linear interpolation without search. Effective critical surface
+    mass densities are tabulated for each source redshift distribution
+    on first use.
+
+    Parameters
+    ----------
+    cosmo : pyccl.Cosmology or astropy.cosmology.FLRW
+        cosmology
+    z_max : float, optional
+        maximum redshift, default is 5
+    dz : float, optional
+        redshift grid spacing, default is 0.0001; the relative
+        interpolation error is below 1e-6 for z > 0.01
+
+    """
+
+    def __init__(self, cosmo, z_max=5, dz=0.0001):
+        self._dz = dz
+        n_z = int(np.ceil(z_max / dz)) + 1
+        self._z = np.arange(n_z) * dz
+
+        if isinstance(cosmo, FLRW):
+            self._d_ang = cosmo.angular_diameter_distance(self._z).to(
+                'Mpc'
+            ).value
+            self._d_com = cosmo.comoving_distance(self._z).to('Mpc').value
+            omega_k = cosmo.Ok0
+            h = cosmo.h
+        else:
+            a = 1 / (1 + self._z)
+            self._d_ang = ccl.angular_diameter_distance(cosmo, a)
+            self._d_com = ccl.comoving_radial_distance(cosmo, a)
+            omega_k = cosmo['Omega_k']
+            h = cosmo['h']
+
+        # Curvature scale sqrt(|K|) in 1/Mpc
+        self._omega_k = omega_k
+        self._sqrt_k = (
+            np.sqrt(np.abs(omega_k)) * 100 * h
+            / constants.c.to('km/s').value
+        )
+
+        # Effective critical surface mass densities, for each source
+        # redshift distribution
+        self._sigma_crit_m1_eff = {}
+
+    @property
+    def z_max(self):
+        """Return maximum redshift."""
+        return self._z[-1]
+
+    def d_ang(self, z):
+        """D Ang.
+
+        Return angular diameter distance.
+
+        Parameters
+        ----------
+        z : float or numpy.array
+            redshift
+
+        Returns
+        -------
+        float or numpy.array
+            angular diameter distance [Mpc]
+
+        """
+        return self._interp(z, self._d_ang)
+
+    def d_com(self, z):
+        """D Com.
+
+        Return comoving (radial) distance.
+
+        Parameters
+        ----------
+        z : float or numpy.array
+            redshift
+
+        Returns
+        -------
+        float or numpy.array
+            comoving distance [Mpc]
+
+        """
+        return self._interp(z, self._d_com)
+
+    def d_ang_12(self, z_1, z_2):
+        """D Ang 12.
+
+        Return angular diameter distance between two redshifts.
+
+        Parameters
+        ----------
+        z_1 : float or numpy.array
+            smaller redshift
+        z_2 : float or numpy.array
+            larger redshift
+
+        Returns
+        -------
+        float or numpy.array
+            angular diameter distance of z_2 seen from z_1 [Mpc]
+
+        """
+        d_com_12 = self.d_com(z_2) - self.d_com(z_1)
+        if self._omega_k > 0:
+            d_com_12 = np.sinh(self._sqrt_k * d_com_12) / self._sqrt_k
+        elif self._omega_k < 0:
+            d_com_12 = np.sin(self._sqrt_k * d_com_12) / self._sqrt_k
+
+        return d_com_12 / (1 + np.asarray(z_2, dtype=float))
+
+    def sigma_crit_m1(self, z_lens, z_source):
+        """Sigma Crit M1.
+
+        Return inverse critical surface mass density, zero if the lens
+        is not in front of the source. Inputs are broadcast.
+
+        Parameters
+        ----------
+        z_lens : float or numpy.array
+            lens redshift
+        z_source : float or numpy.array
+            source redshift
+
+        Returns
+        -------
+        float or numpy.array
+            inverse critical surface mass density [pc^2 / M_sol]
+
+        """
+        z_lens = np.asarray(z_lens, dtype=float)
+        z_source = np.asarray(z_source, dtype=float)
+
+        d_lens = self.d_ang(z_lens)
+        d_source = self.d_ang(z_source)
+        d_lens_source = self.d_ang_12(z_lens, z_source)
+
+        sigma_cr_m1 = np.zeros(np.broadcast(z_lens, z_source).shape)
+        behind = np.broadcast_to(z_source > z_lens, sigma_cr_m1.shape)
+        np.divide(
+            _SIGMA_CRIT_M1_PREF * d_lens * d_lens_source,
+            d_source,
+            out=sigma_cr_m1,
+            where=behind,
+        )
+
+        return sigma_cr_m1
+
+    def sigma_crit_m1_eff(self, z_lens, z_source, nz_source, dz_lens=0.001):
+        """Sigma Crit M1 Eff.
+
+        Return effective inverse critical surface mass density, which
+        is the inverse critical surface mass density weighted by the
+        source redshift distribution, for sources behind the lens.
+        See Eq. (17) in :cite:`2004AJ....127.2544S`.
+
+        The sum of source weights times inverse critical densities is
+        continuous in lens redshift. It is tabulated on a lens redshift
+        grid once for each source redshift distribution, and interpolated.
+        The sum of weights of sources behind the lens is a step function,
+        and computed exactly.
+
+        Parameters
+        ----------
+        z_lens : float or numpy.array
+            lens redshift(s)
+        z_source : numpy.array
+            source redshifts
+        nz_source : numpy.array
+            number of sources at z_source
+        dz_lens : float, optional
+            lens redshift grid spacing of the kernel, default is 0.001
+
+        Returns
+        -------
+        float or numpy.array
+            effective inverse critical surface mass density
+            [pc^2 / M_sol]
+
+        """
+        z_lens = np.asarray(z_lens, dtype=float)
+        z_source = np.asarray(z_source, dtype=float)
+        nz_source = np.asarray(nz_source, dtype=float)
+
+        key = hashlib.sha1(
+            z_source.tobytes() + nz_source.tobytes() + repr(dz_lens).encode()
+        ).hexdigest()
+        if key not in self._sigma_crit_m1_eff:
+            z_grid = np.arange(0, np.max(z_source) + dz_lens, dz_lens)
+
+            # Weighted sum over sources; zero for sources not behind the
+            # lens
+            sum_sigma_cr_m1 = self.sigma_crit_m1(
+                z_grid[:, np.newaxis],
+                z_source[np.newaxis, :],
+            ) @ nz_source
+
+            # Sum of weights of sources behind each source redshift
+            order = np.argsort(z_source)
+            sum_w_behind = np.append(
+                np.cumsum(nz_source[order][::-1])[::-1],
+                0,
+            )
+
+            self._sigma_crit_m1_eff[key] = (
+                z_grid,
+                sum_sigma_cr_m1,
+                z_source[order],
+                sum_w_behind,
+            )
+
+        z_grid, sum_sigma_cr_m1, z_sorted, sum_w_behind = (
+            self._sigma_crit_m1_eff[key]
+        )
+
+        sum_w = sum_w_behind[np.searchsorted(z_sorted, z_lens, side='right')]
+        sigma_cr_m1_eff = np.zeros(z_lens.shape)
+        np.divide(
+            np.interp(z_lens, z_grid, sum_sigma_cr_m1, right=0),
+            sum_w,
+            out=sigma_cr_m1_eff,
+            where=sum_w > 0,
+        )
+
+        return sigma_cr_m1_eff[()]
+
+    def _interp(self, z, values):
+        """Interp.
+
+        Return table values linearly interpolated at z.
+
+        Raises
+        ------
+        ValueError
+            if a redshift is outside of the table
+
+        """
+        z = np.asarray(z, dtype=float)
+        if z.size > 0 and (np.min(z) < 0 or np.max(z) > self.z_max):
+            raise ValueError(f'Redshift outside of table [0, {self.z_max}]')
+
+        x = z / self._dz
+        idx = np.minimum(x.astype(np.intp), len(self._z) - 2)
+        frac = x - idx
+
+        return values[idx] * (1 - frac) + values[idx + 1] * frac
+
+
+def get_distance_table(cosmo, z_max=5):
+    """Get Distance Table.
+
+    Return distance table of a cosmology, from the cache if available.
+    The cache keeps the tables of the N_TABLE_MAX most recently used
+    cosmologies.
+
+    Parameters
+    ----------
+    cosmo : pyccl.Cosmology or astropy.cosmology.FLRW
+        cosmology
+    z_max : float, optional
+        minimum redshift range of the table, default is 5
+
+    Returns
+    -------
+    DistanceTable
+        distance table
+
+    """
+    key = get_cosmo_key(cosmo)
+
+    table = _tables.get(key)
+    if table is None or table.z_max < z_max:
+        # Round up maximum redshift to avoid frequent re-computation
+        table = DistanceTable(cosmo, z_max=max(5, np.ceil(z_max)))
+        _tables[key] = table
+        if len(_tables) > N_TABLE_MAX:
+            _tables.popitem(last=False)
+    _tables.move_to_end(key)
+
+    return table
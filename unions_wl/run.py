@@ -6,18 +6,44 @@ This module sets up runs of the unions_wl computations.
 
 """
 
+import os
+import glob
+import json
+import multiprocessing
+
+from datetime import datetime, timezone
+
 import numpy as np
 
-from astropy.io import fits
 from astropy import units
+from astropy.io import fits
 
 from tqdm import tqdm
 import treecorr
 
 from cs_util import logging
 
+import unions_wl
 from unions_wl import defaults
-from unions_wl.stack_ng import ng_essentials, ng_stack
+from unions_wl import catalogue
+from unions_wl import distances
+from unions_wl.stack_ng import (
+    ng_stack,
+    ng_restack,
+    NGStack,
+    NGStore,
+    get_patch_labels,
+    rebin_physical_sum,
+    write_ng,
+    write_ng_store,
+)
+from unions_wl import correlate_ng
+
+
+# Catalogues and configuration for the process pool of correlate_n_fg.
+# Set before the pool is created, such that forked workers share them
+# copy-on-write instead of receiving pickled copies.
+_pool_data = {}
 
 
 
@@ -94,6 +120,34 @@ class Compute_NG(object):
     background sample.
 
     """
+
+    # Parameters of the correlations, which need to be the same for all
+    # shards, and which are used for stacking
+    _shard_keys = ('scales', 'stack', 'theta_min', 'theta_max', 'n_theta')
+
+    # Parameters of the correlations, which need to be the same to resume
+    # from a checkpoint
+    _checkpoint_keys = _shard_keys + (
+        'key_ra_fg',
+        'key_dec_fg',
+        'key_ra_bg',
+        'key_dec_bg',
+        'key_w_fg',
+        'key_w_bg',
+        'key_e1',
+        'key_e2',
+        'sign_e1',
+        'sign_e2',
+        'key_z',
+        'dz_slice',
+        'single_precision',
+        'shard',
+        'shard_method',
+    )
+
+    # Number of angular bins per physical bin for redshift slices
+    _n_sub_slice = 4
+
     def __init__(self):
         # Set default parameters
         self.params_default()
@@ -149,6 +203,9 @@ class Compute_NG(object):
             'key_dec_bg': 'DEC',
             'key_w_fg': None,
             'key_w_bg': None,
+            'key_label_fg': None,
+            'key_id_fg': None,
+            'keys_store_fg': None,
             'key_e1': 'e1',
             'key_e2': 'e2',
             'sign_e1': +1,
@@ -159,9 +216,27 @@ class Compute_NG(object):
             'n_theta': 10,
             'scales' : 'angular',
             'stack': 'auto',
+            'dz_slice': 0,
             'out_path' : './ggl_unions_sdss_matched.txt',
             'out_path_jk' : None,
+            'n_patch': 0,
+            'patch_method': 'kmeans',
+            'patch_seed': 0,
+            'out_path_cov' : None,
+            'out_path_store' : None,
+            'out_path_batch' : None,
             'n_cpu': 1,
+            'n_proc': 1,
+            'chunk_size_bg': 0,
+            'cache_dir': None,
+            'single_precision': False,
+            'shard': None,
+            'shard_method': 'lens',
+            'out_path_shard': None,
+            'input_path_shards': None,
+            'input_path_store': None,
+            'checkpoint_path': None,
+            'checkpoint_interval': 1000,
             'verbose': False,
         }
 
@@ -170,19 +245,44 @@ class Compute_NG(object):
             'sign_e1': 'int',
             'sign_e2': 'int',
             'n_theta': 'int',
+            'dz_slice': 'float',
+            'n_patch': 'int',
+            'patch_seed': 'int',
             'n_cpu': 'int',
+            'n_proc': 'int',
+            'chunk_size_bg': 'int',
+            'single_precision': 'bool',
+            'checkpoint_interval': 'int',
         }
 
         # Parameters which can be specified as command line option
         self._help_strings = {
-            'input_path_fg': 'background catalogue input path, default={}',
+            'input_path_fg': (
+                'background catalogue input path; comma-separated list for'
+                + ' batch mode, default={}'
+            ),
             'input_path_bg': 'foreground catalogue input path, default={}',
             'key_ra_fg': 'foreground right ascension column name, default={}',
             'key_dec_fg': 'foreground declination column name, default={}',
             'key_ra_bg': 'background right ascension column name, default={}',
             'key_dec_bg': 'background declination column name, default={}',
-            'key_w_fg': 'foreground weight column name, default={}',
+            'key_w_fg': (
+                'foreground weight column name; when re-stacking, {{}} is'
+                + ' replaced by the sample number, default={}'
+            ),
             'key_w_bg': 'background weight column name, default={}',
+            'key_label_fg': (
+                'foreground sample label column name; samples are'
+                + ' correlated in batch mode, default={}'
+            ),
+            'key_id_fg': (
+                'foreground ID column name for per-object store, default'
+                + ' row index'
+            ),
+            'keys_store_fg': (
+                'additional foreground column names for per-object store,'
+                + ' comma-separated, default none'
+            ),
             'key_e1': 'first ellipticity component column name, default={}',
             'key_e2': 'second ellipticity component column name, default={}',
             'sign_e1': 'first ellipticity multiplier (sign), default={}',
@@ -198,10 +298,93 @@ class Compute_NG(object):
                 '2D coordinates (scales) are angular (arcmin) or physical'
                 + ' [Mpc], default={}'
             ),
-            'stack' : 'allowed are auto, cross, post, default={}',
-            'out_path' : 'output path, default={}',
+            'stack' : (
+                'allowed are auto, cross, post, vectorized; batch mode'
+                + ' requires post or vectorized, default={}'
+            ),
+            'dz_slice' : (
+                'redshift slice width for physical scales; fg objects in'
+                + ' a slice are correlated together, without jackknife'
+                + ' output; 0 for individual objects, default={}'
+            ),
+            'out_path' : (
+                'output path; in batch mode comma-separated list, or'
+                + ' path with {{}} replaced by sample name, or'
+                + ' <out_path>_<sample>.<ext>, default={}'
+            ),
             'out_path_jk' : 'output path, default=<out_path>_jk.<ext>',
+            'n_patch' : (
+                'number of sky patches of fg objects for jackknife'
+                + ' covariance, 0 for none, default={}'
+            ),
+            'patch_method' : (
+                'patch method, allowed are kmeans, healpix, default={}'
+            ),
+            'patch_seed' : (
+                'random seed of kmeans patches, default={}'
+            ),
+            'out_path_cov' : (
+                'covariance output path (FITS), default none: image'
+                + ' extension cov of FITS output, or <out_path>_cov.fits'
+            ),
+            'out_path_store' : (
+                'output path of compressed per-object pair sums (NPZ) for'
+                + ' re-stacking, default none'
+            ),
+            'out_path_batch' : (
+                'output path of one multi-extension FITS file with the'
+                + ' correlations of all samples in batch mode, instead of'
+                + ' one file per sample, default none'
+            ),
             'n_cpu' : 'number of CPUs for parallel processing, default={}',
+            'n_proc' : (
+                'number of processes for individual correlations of fg'
+                + ' objects, default={}'
+            ),
+            'chunk_size_bg' : (
+                'number of bg objects read and correlated at once, 0 to'
+                + ' read entire catalogue; vectorized stack only,'
+                + ' default={}'
+            ),
+            'cache_dir' : (
+                'directory to cache prepared bg catalogue, default none'
+            ),
+            'single_precision' : (
+                'store individual correlations of fg objects in single'
+                + ' precision'
+            ),
+            'shard' : (
+                'correlate shard i/N (i = 0 ... N-1) of the fg objects, and'
+                + ' write partial output for merging, default none'
+            ),
+            'shard_method' : (
+                'shard method, allowed are lens (contiguous blocks of fg'
+                + ' objects), sky (stripes in right ascension, with bg'
+                + ' objects restricted to stripe plus margin; vectorized'
+                + ' stack only), default={}'
+            ),
+            'out_path_shard' : (
+                'partial output path of shard,'
+                + ' default=<out_path>_shard<i>of<N>.npz'
+            ),
+            'input_path_shards' : (
+                'partial shard outputs to merge, comma-separated list or'
+                + ' glob pattern; no correlations are computed, default none'
+            ),
+            'input_path_store' : (
+                'per-object store (see --out_path_store) to re-stack for'
+                + ' the fg sample(s), matched by --key_id_fg; no'
+                + ' correlations are computed, default none'
+            ),
+            'checkpoint_path' : (
+                'checkpoint base path for individual correlations of fg'
+                + ' objects, not for vectorized stack or redshift slices;'
+                + ' an interrupted run resumes from the checkpoint,'
+                + ' default none'
+            ),
+            'checkpoint_interval' : (
+                'number of fg objects between checkpoints, default={}'
+            ),
         }
 
         # Options which have one-letter shortcuts
@@ -223,6 +406,106 @@ class Compute_NG(object):
             raise ValueError(
                 'Scales (option -s) need to be angular or physical'
             )
+        if self._params['stack'] not in (
+            'auto', 'cross', 'post', 'vectorized'
+        ):
+            raise ValueError(
+                'Stack needs to be auto, cross, post, or vectorized'
+            )
+        if self._params['patch_method'] not in ('kmeans', 'healpix'):
+            raise ValueError('Patch method needs to be kmeans or healpix')
+        if self._params['n_patch'] == 1 or self._params['n_patch'] < 0:
+            raise ValueError('Number of patches needs to be 0 or > 1')
+        if self._params['n_patch'] > 0 and self._params['stack'] == 'cross':
+            raise ValueError('Patch jackknife not possible for cross stack')
+        if self._params['n_proc'] < 1:
+            raise ValueError('Number of processes needs to be >= 1')
+        if self._params['chunk_size_bg'] < 0:
+            raise ValueError('Chunk size of bg sample needs to be >= 0')
+        if (
+            self.is_batch()
+            and not self._params.get('input_path_store')
+            and self._params['stack'] not in ('post', 'vectorized')
+        ):
+            raise ValueError(
+                'Batch mode requires stack to be post or vectorized'
+                + ' (--stack), since fg objects are correlated individually'
+            )
+        if self._params['chunk_size_bg'] > 0:
+            if self._params['stack'] != 'vectorized':
+                raise ValueError(
+                    'Reading bg sample in chunks requires vectorized stack'
+                )
+            if self._params['cache_dir']:
+                raise ValueError(
+                    'Cache of bg sample not possible if read in chunks'
+                )
+        if self._params['dz_slice'] < 0:
+            raise ValueError('Redshift slice width needs to be >= 0')
+        if self.is_slices():
+            if self._params['scales'] != 'physical':
+                raise ValueError('Redshift slices require physical scales')
+            if self._params['stack'] not in ('auto', 'post'):
+                raise ValueError('Redshift slices require stack auto or post')
+            if self._params['n_patch'] > 0:
+                raise ValueError(
+                    'Patch jackknife not possible for redshift slices'
+                )
+            if self.is_batch() or self.is_shard():
+                raise ValueError(
+                    'Redshift slices not possible in batch mode or shards'
+                )
+            if self._params['out_path_store']:
+                raise ValueError(
+                    'Per-object store not possible for redshift slices'
+                )
+        if self._params['checkpoint_interval'] < 1:
+            raise ValueError('Checkpoint interval needs to be >= 1')
+        if self._params['checkpoint_path']:
+            if self._params['stack'] == 'vectorized':
+                raise ValueError(
+                    'Checkpoint not possible for vectorized stack'
+                )
+            if self.is_slices():
+                raise ValueError('Checkpoint not possible for redshift slices')
+        if self._params['shard_method'] not in ('lens', 'sky'):
+            raise ValueError('Shard method needs to be lens or sky')
+        if self.is_shard():
+            self.get_shard()
+            if self.is_batch():
+                raise ValueError('Shards not possible in batch mode')
+            if self._params['stack'] not in ('auto', 'post', 'vectorized'):
+                raise ValueError(
+                    'Shards require stack to be auto, post, or vectorized'
+                )
+            if self._params['shard_method'] == 'sky':
+                if self._params['stack'] != 'vectorized':
+                    raise ValueError('Sky shards require vectorized stack')
+                if self._params['cache_dir']:
+                    raise ValueError(
+                        'Cache of bg sample not possible for sky shards'
+                    )
+        if self._params.get('out_path_batch'):
+            if not self.is_batch():
+                raise ValueError('Batch output file requires batch mode')
+            if not self._params['out_path_batch'].lower().endswith(
+                ('.fits', '.fit', '.fits.gz')
+            ):
+                raise ValueError('Batch output file needs to be FITS')
+        if self._params.get('out_path_cov'):
+            if treecorr.util.parse_file_type(
+                None,
+                self._params['out_path_cov'],
+                output=True,
+            ) != 'FITS':
+                raise ValueError('Covariance output file needs to be FITS')
+        if self._params.get('input_path_store'):
+            if self._params['input_path_shards']:
+                raise ValueError(
+                    'Re-stacking a store not possible when merging shards'
+                )
+            if self.is_shard():
+                raise ValueError('Re-stacking a store not possible in shards')
 
         # Set verbose to False if not given on input
         if "verbose" not in self._params:
@@ -235,15 +518,173 @@ class Compute_NG(object):
 
         """
         self._data = {}
+        self._fg_samples = None
         for sample in ('fg', 'bg'):
             input_path = self._params[f'input_path_{sample}']
+            if sample == 'bg' and self._params['chunk_size_bg'] > 0:
+                # Read bg sample in chunks during correlation
+                self._data[sample] = None
+                continue
+            if sample == 'fg' and self.is_batch():
+                self.read_fg_samples()
+                continue
             if self._params['verbose']:
                 print(f'Reading catalogue {input_path}')
-            self._data[sample] = fits.getdata(input_path)
+            # Keep columns in file byte order, converted when
+            # preparing the catalogues
+            self._data[sample] = catalogue.read_columns(
+                input_path,
+                columns=self.get_column_names(sample),
+                native=False,
+            )
 
         # Test run with only 0.4M source galaxies:
         #data['bg'] = data['bg'][400_000:600_000]
 
+    def is_batch(self):
+        """Is Batch.
+
+        Return whether more than one foreground sample is processed.
+
+        Returns
+        -------
+        bool
+            True for batch mode
+
+        """
+        return (
+            ',' in self._params['input_path_fg']
+            or self._params['key_label_fg'] is not None
+        )
+
+    def is_shard(self):
+        """Is Shard.
+
+        Return whether a shard of the foreground sample is processed.
+
+        Returns
+        -------
+        bool
+            True for shard run
+
+        """
+        return self._params.get('shard') is not None
+
+    def get_shard(self):
+        """Get Shard.
+
+        Return shard index and number of shards from the shard
+        parameter string 'i/N'.
+
+        Returns
+        -------
+        int
+            shard index i, between 0 and N - 1
+        int
+            number of shards N
+
+        Raises
+        ------
+        ValueError
+            if shard string is not valid
+
+        """
+        shard = self._params['shard']
+        try:
+            i_shard, n_shard = (int(val) for val in shard.split('/'))
+        except ValueError:
+            raise ValueError(f'Invalid shard {shard}, needs to be i/N')
+        if n_shard < 1 or i_shard < 0 or i_shard >= n_shard:
+            raise ValueError(
+                f'Invalid shard {shard}, needs 0 <= i < N'
+            )
+
+        return i_shard, n_shard
+
+    def is_slices(self):
+        """Is Slices.
+
+        Return whether foreground objects are correlated in redshift
+        slices.
+
+        Returns
+        -------
+        bool
+            True for redshift slices
+
+        """
+        return self._params.get('dz_slice', 0) > 0
+
+    def is_split_fg(self):
+        """Is Split FG.
+
+        Return whether foreground objects are correlated individually.
+
+        Returns
+        -------
+        bool
+            True if fg objects are correlated individually
+
+        """
+        return (
+            self._params['scales'] == 'physical'
+            or self._params['stack'] != 'auto'
+            or self.is_batch()
+            or self.is_shard()
+            or bool(self._params.get('out_path_store'))
+        )
+
+    def read_fg_samples(self):
+        """Read FG Samples.
+
+        Read foreground samples for batch mode, from a list of
+        catalogues or from one catalogue with sample label column.
+        All samples are concatenated to one foreground catalogue.
+
+        """
+        params = self._params
+
+        columns = self.get_column_names('fg')
+        if params['key_label_fg'] is not None:
+            columns.append(params['key_label_fg'])
+
+        data_list = []
+        names = []
+        for input_path in params['input_path_fg'].split(','):
+            if params['verbose']:
+                print(f'Reading catalogue {input_path}')
+            data_list.append(
+                catalogue.read_columns(input_path, columns=columns)
+            )
+            names.append(os.path.splitext(os.path.basename(input_path))[0])
+
+        self._data['fg'] = {
+            col: np.concatenate([dat[col] for dat in data_list])
+            for col in columns
+        }
+
+        # Indices of objects for each sample
+        self._fg_samples = {}
+        if params['key_label_fg'] is None:
+            start = 0
+            for name, dat in zip(names, data_list):
+                n_obj = len(dat[columns[0]])
+                self._fg_samples[name] = np.arange(start, start + n_obj)
+                start += n_obj
+        else:
+            labels, idx_inv = np.unique(
+                self._data['fg'][params['key_label_fg']],
+                return_inverse=True,
+            )
+            for jdx, label in enumerate(labels):
+                self._fg_samples[str(label)] = np.where(idx_inv == jdx)[0]
+
+        if params['verbose']:
+            print(
+                f"Batch mode: {len(self._fg_samples)} fg samples with"
+                + f" {len(self._data['fg'][columns[0]])} objects"
+            )
+
     def set_up_treecorr(self):
         """Set Up Trecorr.
 
@@ -251,8 +692,11 @@ class Compute_NG(object):
 
         """
 
-        self.set_up_treecorr_cats()
+        # Configuration first, which selects the shard objects
         self.set_up_treecorr_config()
+        if self.is_shard() and self._params['shard_method'] == 'sky':
+            self.select_shard_bg()
+        self.set_up_treecorr_cats()
 
     def set_up_treecorr_cats(self):
         """Set Up Treecorr Cats.
@@ -275,41 +719,41 @@ class Compute_NG(object):
                 + f' ({params["sign_e1"]:+d}, {params["sign_e2"]:+d})'
             )
 
-        # Set fg and bg sample data columns
-        # Shear components g1, g2: Set `None` for foreground
-        g1 = {
-            'fg': None,
-            'bg': self._data['bg'][params['key_e1']] * params['sign_e1']
-        }
-        g2 = {
-            'fg': None,
-            'bg': self._data['bg'][params['key_e2']] * params['sign_e2']
-        }
+        # Set fg and bg sample data columns; bg only if not read in
+        # chunks
+        g1 = {}
+        g2 = {}
         w = {}
+        self._tree = None
         for sample in ['fg', 'bg']:
-            n = len(self._data[sample][params[f'key_ra_{sample}']])
-
-            # Set weight
-            if params[f'key_w_{sample}'] is None:
-                w[sample] = [1] * n
-                if params['verbose']:
-                    print(f'Not using weights for {sample} sample')
+            if self._data[sample] is None:
+                continue
+            if sample == 'bg' and params['cache_dir']:
+                g1[sample], g2[sample], w[sample] = self.get_columns_cached(
+                    sample,
+                )
             else:
-                w[sample] = self._data[sample][params[f'key_w_{sample}']]
-                if params['verbose']:
-                    print(f'Using catalog weights for {sample} sample')
+                g1[sample], g2[sample], w[sample] = self.get_columns(
+                    sample,
+                    verbose=params['verbose'],
+                )
+
+        if params['stack'] == 'vectorized':
+            # No treecorr catalogues: build spatial index of background
+            # sample for vectorized per-object correlations
+            self.set_up_vectorized(g1, g2, w)
+            return
+
+        if self.is_slices():
+            # One fg catalogue for each redshift slice
+            self._cats['fg'] = self.create_treecorr_slice_catalogs(w)
+            del w['fg']
 
         # Create treecorr catalogues
-        for sample in ('fg', 'bg'):
+        for sample in w:
 
             # Split cat into single objects if fg and physical or not auto
-            if (
-                sample == 'fg' and
-                (params['scales'] == 'physical' or params['stack'] != 'auto')
-            ):
-                split = True
-            else:
-                split = False
+            split = sample == 'fg' and self.is_split_fg()
 
             self._cats[sample] = self.create_treecorr_catalogs(
                 sample,
@@ -325,6 +769,257 @@ class Compute_NG(object):
                 + f" catalogues..."
             )
 
+    def get_column_names(self, sample):
+        """Get Column Names.
+
+        Return names of input columns used for a sample.
+
+        Parameters
+        ----------
+        sample : str
+            sample string, 'fg' or 'bg'
+
+        Returns
+        -------
+        list
+            column names
+
+        """
+        params = self._params
+
+        columns = [params[f'key_ra_{sample}'], params[f'key_dec_{sample}']]
+        if sample == 'bg':
+            columns += [params['key_e1'], params['key_e2']]
+        elif params['scales'] == 'physical':
+            columns.append(params['key_z'])
+        if params[f'key_w_{sample}'] is not None:
+            columns.append(params[f'key_w_{sample}'])
+
+        # Columns for per-object store
+        if sample == 'fg' and params.get('out_path_store'):
+            keys = []
+            if params['key_id_fg'] is not None:
+                keys.append(params['key_id_fg'])
+            if params['keys_store_fg']:
+                keys += params['keys_store_fg'].split(',')
+            columns += [key for key in keys if key not in columns]
+
+        return columns
+
+    def get_columns(self, sample, verbose=False):
+        """Get Columns.
+
+        Return shear and weight columns of a sample.
+
+        Parameters
+        ----------
+        sample : str
+            sample string, 'fg' or 'bg'
+        verbose : bool, optional
+            verbose output if True; default is False
+
+        Returns
+        -------
+        numpy.array
+            first shear component, ``None`` for foreground
+        numpy.array
+            second shear component, ``None`` for foreground
+        numpy.array
+            weight, ``None`` for unit weights
+
+        """
+        params = self._params
+
+        # Shear components g1, g2: Set `None` for foreground. Sign is
+        # applied during type conversion, without extra copy
+        if sample == 'fg':
+            g1 = None
+            g2 = None
+        else:
+            g1 = catalogue.get_typed_column(
+                self._data[sample][params['key_e1']],
+                factor=params['sign_e1'],
+            )
+            g2 = catalogue.get_typed_column(
+                self._data[sample][params['key_e2']],
+                factor=params['sign_e2'],
+            )
+
+        # Set weight
+        if params[f'key_w_{sample}'] is None:
+            w = None
+            if verbose:
+                print(f'Not using weights for {sample} sample')
+        else:
+            w = catalogue.get_typed_column(
+                self._data[sample][params[f'key_w_{sample}']]
+            )
+            if verbose:
+                print(f'Using catalog weights for {sample} sample')
+
+        return g1, g2, w
+
+    def get_columns_cached(self, sample):
+        """Get Columns Cached.
+
+        Return shear and weight columns of a sample, from the cache in
+        directory cache_dir if available. Otherwise, the columns are
+        prepared with :meth:`get_columns` and written to the cache.
+        Cached columns are memory-mapped. The sample coordinates are
+        replaced by their cached versions. For the vectorized stack,
+        the unit vectors of the spatial index are cached as well, and
+        the index is built on their memory map.
+
+        Treecorr catalogues are created from the cached columns; their
+        fields (ball trees) are C++ objects and cannot be cached.
+
+        Parameters
+        ----------
+        sample : str
+            sample string
+
+        Returns
+        -------
+        numpy.array
+            first shear component
+        numpy.array
+            second shear component
+        numpy.array
+            weight, ``None`` for unit weights
+
+        """
+        params = self._params
+
+        key_ra = params[f'key_ra_{sample}']
+        key_dec = params[f'key_dec_{sample}']
+        cache_key = catalogue.get_cache_key(
+            params[f'input_path_{sample}'],
+            columns=self.get_column_names(sample),
+            sign_e1=params['sign_e1'],
+            sign_e2=params['sign_e2'],
+            coord_units=self._coord_units,
+        )
+        names = ['ra', 'dec', 'g1', 'g2', 'w', 'xyz']
+
+        data = catalogue.read_cache(params['cache_dir'], cache_key, names)
+        if data is not None:
+            if params['verbose']:
+                print(f'Using cached {sample} sample {cache_key}')
+        else:
+            if params['verbose']:
+                print(f'Writing {sample} sample to cache {cache_key}')
+            g1, g2, w = self.get_columns(sample, verbose=params['verbose'])
+            data = {
+                'ra': catalogue.get_typed_column(self._data[sample][key_ra]),
+                'dec': catalogue.get_typed_column(
+                    self._data[sample][key_dec]
+                ),
+                'g1': g1,
+                'g2': g2,
+                'w': w,
+            }
+            catalogue.write_cache(params['cache_dir'], cache_key, data)
+
+        # Spatial index, built on cached unit vectors
+        if params['stack'] == 'vectorized':
+            if data.get('xyz') is None:
+                data['xyz'] = correlate_ng.radec_to_xyz(
+                    data['ra'],
+                    data['dec'],
+                    coord_units=self._coord_units,
+                )
+                catalogue.write_cache(
+                    params['cache_dir'],
+                    cache_key,
+                    {'xyz': data['xyz']},
+                )
+            self._tree = correlate_ng.build_tree_xyz(data['xyz'])
+
+        self._data[sample] = {key_ra: data['ra'], key_dec: data['dec']}
+
+        return data['g1'], data['g2'], data['w']
+
+    def iter_bg(self):
+        """Iter BG.
+
+        Iterate over the background sample. If chunk_size_bg is zero,
+        the background sample is in memory and set up already;
+        otherwise it is read in chunks from the memory-mapped input
+        file, and the spatial index is set up for each chunk (vectorized
+        stack only).
+
+        Yields
+        ------
+        int
+            number of background objects in current chunk, ``None`` if
+            entire sample is in memory
+
+        """
+        params = self._params
+
+        if params['chunk_size_bg'] == 0:
+            yield None
+            return
+
+        for chunk in catalogue.read_fits_chunks(
+            params['input_path_bg'],
+            self.get_column_names('bg'),
+            params['chunk_size_bg'],
+        ):
+            if self.is_shard() and params['shard_method'] == 'sky':
+                mask = self.get_shard_bg_mask(
+                    chunk[params['key_ra_bg']],
+                    chunk[params['key_dec_bg']],
+                )
+                chunk = {key: chunk[key][mask] for key in chunk}
+            self._data['bg'] = chunk
+            g1, g2, w = self.get_columns('bg')
+            self._tree = correlate_ng.build_tree(
+                chunk[params['key_ra_bg']],
+                chunk[params['key_dec_bg']],
+                coord_units=self._coord_units,
+            )
+            self._g1['bg'] = g1
+            self._g2['bg'] = g2
+            self._w['bg'] = w
+
+            yield len(chunk[params['key_ra_bg']])
+
+        # Free memory of last chunk
+        self._data['bg'] = None
+        self._tree = None
+
+    def set_up_vectorized(self, g1, g2, w):
+        """Set Up Vectorized.
+
+        Set up spatial index and columns for vectorized correlations.
+
+        Parameters
+        ----------
+        g1 : dict
+            first shear component
+        g2 : dict
+            second shear component
+        w : dict
+            weight
+
+        """
+        params = self._params
+
+        if self._data['bg'] is not None and self._tree is None:
+            if params['verbose']:
+                print('Building spatial index of bg sample...')
+            self._tree = correlate_ng.build_tree(
+                self._data['bg'][params['key_ra_bg']],
+                self._data['bg'][params['key_dec_bg']],
+                coord_units=self._coord_units,
+            )
+        self._g1 = g1
+        self._g2 = g2
+        self._w = {}
+        for sample in w:
+            self._w[sample] = w[sample]
+
     def create_treecorr_catalogs(
         self,
     	sample,
@@ -390,14 +1085,120 @@ class Compute_NG(object):
                     dec=self._data[sample][key_dec][idx:idx+1],
                     g1=my_g1,
                     g2=my_g2,
-                    w=w[sample][idx:idx+1],
-                    ra_units=coord_units,
-                    dec_units=coord_units,
+                    w=None if w[sample] is None else w[sample][idx:idx+1],
+                    ra_units=self._coord_units,
+                    dec_units=self._coord_units,
                 )
                 cat.append(my_cat)
 
     	return cat
 
+    def set_up_slices(self):
+        """Set Up Slices.
+
+        Group foreground objects into redshift slices of width dz_slice,
+        and set up treecorr configurations for each slice. Angular bins
+        of a slice cover the physical scales for the angular diameter
+        distance range of the slice. They are a factor n_sub_slice finer
+        than the physical bins, and aligned with the physical bin edges
+        at the mean distance of the slice. All slices have the same
+        number of bins.
+
+        """
+        params = self._params
+
+        z_arr = catalogue.get_typed_column(self._data['fg'][params['key_z']])
+        idx_slice = np.floor(
+            (z_arr - np.min(z_arr)) / params['dz_slice']
+        ).astype(int)
+        _, idx_inv = np.unique(idx_slice, return_inverse=True)
+        self._slices = [
+            np.where(idx_inv == jdx)[0] for jdx in range(np.max(idx_inv) + 1)
+        ]
+
+        if params['key_w_fg'] is None:
+            w_fg = np.ones(len(z_arr))
+        else:
+            w_fg = catalogue.get_typed_column(
+                self._data['fg'][params['key_w_fg']]
+            )
+
+        # Log-width of angular bins
+        r_min = float(params['theta_min'])
+        r_max = float(params['theta_max'])
+        log_width = (
+            np.log(r_max / r_min) / (params['n_theta'] * self._n_sub_slice)
+        )
+
+        # Angular bin ranges, in units of the log-width relative to
+        # r_min / d_ang
+        self._d_ang_slice = np.zeros(len(self._slices))
+        k_min = np.zeros(len(self._slices), dtype=int)
+        k_max = np.zeros(len(self._slices), dtype=int)
+        for jdx, idx in enumerate(self._slices):
+            d_ang = self._d_ang_arr[idx]
+            d_ang_mean = np.average(d_ang, weights=w_fg[idx])
+            self._d_ang_slice[jdx] = d_ang_mean
+            k_min[jdx] = np.floor(
+                np.log(d_ang_mean / np.max(d_ang)) / log_width
+            )
+            k_max[jdx] = np.ceil(
+                np.log(r_max / r_min * d_ang_mean / np.min(d_ang))
+                / log_width
+            )
+        n_fine = np.max(k_max - k_min)
+
+        self._TreeCorrConfig_slices = []
+        for jdx in range(len(self._slices)):
+            th_min = r_min / self._d_ang_slice[jdx] * np.exp(
+                k_min[jdx] * log_width
+            )
+            config = self.create_treecorr_config(
+                rad_to_unit(th_min, self._sep_units),
+                rad_to_unit(th_min * np.exp(n_fine * log_width), self._sep_units),
+                params['n_cpu'],
+            )
+            config['nbins'] = n_fine
+            self._TreeCorrConfig_slices.append(config)
+
+        if params['verbose']:
+            print(
+                f'{len(self._slices)} redshift slices of width'
+                + f" {params['dz_slice']} with {n_fine} angular bins"
+            )
+
+    def create_treecorr_slice_catalogs(self, w):
+        """Create Treecorr Slice Catalogs.
+
+        Return treecorr catalogues of foreground redshift slices.
+
+        Parameters
+        ----------
+        w : dict
+            weight
+
+        Returns
+        -------
+        list
+            treecorr Catalog objects
+
+        """
+        params = self._params
+
+        self.set_up_slices()
+
+        cats = []
+        for idx in self._slices:
+            cats.append(treecorr.Catalog(
+                ra=self._data['fg'][params['key_ra_fg']][idx],
+                dec=self._data['fg'][params['key_dec_fg']][idx],
+                w=None if w['fg'] is None else w['fg'][idx],
+                ra_units=self._coord_units,
+                dec_units=self._coord_units,
+            ))
+
+        return cats
+
     def set_up_treecorr_config(self):
         """Set Up Trecorr Config.
 
@@ -407,9 +1208,15 @@ class Compute_NG(object):
         if self._params['scales'] == 'physical':
             self._cosmo = defaults.get_cosmo_default()
 
-            # Angular distances to all objects
-            a_arr = 1 / (1 + self._data['fg'][self._params['key_z']])
-            self._d_ang_arr = self._cosmo.angular_diameter_distance(a_arr)
+            # Angular distances to all objects, interpolated from table
+            z_arr = catalogue.get_typed_column(
+                self._data['fg'][self._params['key_z']]
+            )
+            table = distances.get_distance_table(
+                self._cosmo,
+                z_max=np.max(z_arr),
+            )
+            self._d_ang_arr = table.d_ang(z_arr)
 
             theta_min, theta_max = self.get_theta_min_max()
 
@@ -425,45 +1232,159 @@ class Compute_NG(object):
             self._params['n_cpu'],
         )
 
-    def get_theta_min_max(self):
-        """Get Theta Min MaX.
+        # Select shard after the scale range is set from all objects
+        if self.is_shard():
+            self.select_shard()
 
-        Return scale ranges.
+    def select_shard(self):
+        """Select Shard.
 
-        Returns
-        -------
-        float
-            minimum angular scale
-        float
-        	maximum angular scale
+        Select the foreground objects of this shard. For shard method
+        'lens', shard i contains the i-th of N contiguous blocks of
+        objects; for 'sky', the i-th of N stripes in right ascension
+        with equal number of objects.
 
-    	"""
-        r_min = self._params['theta_min']
+        """
+        params = self._params
+
+        i_shard, n_shard = self.get_shard()
+        ra = self._data['fg'][params['key_ra_fg']]
+        n_obj = len(ra)
+
+        if params['shard_method'] == 'lens':
+            idx = np.array_split(np.arange(n_obj), n_shard)[i_shard]
+        else:
+            order = np.argsort(ra, kind='stable')
+            idx = np.sort(np.array_split(order, n_shard)[i_shard])
+
+        if params['verbose']:
+            print(
+                f'Shard {i_shard}/{n_shard}: {len(idx)} of {n_obj} fg'
+                + ' objects'
+            )
+
+        self._shard_idx = idx
+        self._n_obj_all = n_obj
+        self._data['fg'] = {
+            key: self._data['fg'][key][idx] for key in self._data['fg']
+        }
+        if self._d_ang_arr is not None:
+            self._d_ang_arr = np.asarray(self._d_ang_arr)[idx]
+
+    def get_shard_bg_mask(self, ra, dec, n_block=1_048_576):
+        """Get Shard BG Mask.
+
+        Return mask of background objects within the maximum scale of
+        any foreground object in this shard.
+
+        Parameters
+        ----------
+        ra : numpy.array
+            background right ascension
+        dec : numpy.array
+            background declination
+        n_block : int, optional
+            number of background objects queried at once, default is
+            1_048_576
+
+        Returns
+        -------
+        numpy.array
+            boolean mask
+
+        """
+        params = self._params
+
+        if self._tree_shard is None:
+            self._tree_shard = correlate_ng.build_tree(
+                self._data['fg'][params['key_ra_fg']],
+                self._data['fg'][params['key_dec_fg']],
+                coord_units=self._coord_units,
+            )
+
+        # Margin is the maximum (angular) scale, in chord distance which
+        # is smaller than the arc; with 1% padding against round-off
+        margin = (
+            self._TreeCorrConfig['max_sep']
+            * treecorr.config.parse_unit(self._sep_units)
+            * 1.01
+        )
+
+        mask = np.zeros(len(ra), dtype=bool)
+        for start in range(0, len(ra), n_block):
+            stop = min(start + n_block, len(ra))
+            xyz = correlate_ng.radec_to_xyz(
+                ra[start:stop],
+                dec[start:stop],
+                coord_units=self._coord_units,
+            )
+            dist, _ = self._tree_shard.query(
+                xyz,
+                distance_upper_bound=margin,
+                workers=params['n_cpu'],
+            )
+            mask[start:stop] = np.isfinite(dist)
+
+        return mask
+
+    def select_shard_bg(self):
+        """Select Shard BG.
+
+        Select background objects within reach of the foreground objects
+        of this (sky) shard. For a background sample read in chunks, the
+        selection is done for each chunk.
+
+        """
+        params = self._params
+
+        self._tree_shard = None
+        if self._data['bg'] is None:
+            return
+
+        mask = self.get_shard_bg_mask(
+            self._data['bg'][params['key_ra_bg']],
+            self._data['bg'][params['key_dec_bg']],
+        )
+        if params['verbose']:
+            print(
+                f'Shard: {np.count_nonzero(mask)} of {len(mask)} bg objects'
+            )
+        self._data['bg'] = {
+            key: self._data['bg'][key][mask] for key in self._data['bg']
+        }
+
+    def get_theta_min_max(self):
+        """Get Theta Min MaX.
+
+        Return scale ranges.
+
+        Returns
+        -------
+        float
+            minimum angular scale
+        float
+        	maximum angular scale
+
+    	"""
+        r_min = self._params['theta_min']
         r_max = self._params['theta_max']
         d_ang_arr = self._d_ang_arr
 
         # Min and max angular distance at object redshift
-        d_ang_min = min(d_ang_arr)
-        d_ang_max = max(d_ang_arr)
-        d_ang_mean = np.mean(d_ang_arr)
-
-        # Transfer physical to angular scales
-
-        theta_min = 1e30
-        theta_max = -1
-        for d_ang in d_ang_arr:
-            th_min = float(r_min) / d_ang
-            if th_min < theta_min:
-                theta_min = th_min
-            th_max = float(r_max) / d_ang
-            if th_max > theta_max:
-                theta_max = th_max
+        d_ang_min = np.min(d_ang_arr)
+        d_ang_max = np.max(d_ang_arr)
+
+        # Transfer physical to angular scales; only the distance
+        # extrema matter
+        theta_min = float(r_min) / d_ang_max
+        theta_max = float(r_max) / d_ang_min
 
         if self._params["verbose"]:
+            d_ang_mean = np.mean(d_ang_arr)
             print(f'physical to angular scales, r = {r_min}  ... {r_max:} Mpc')
             print(
-                f'physical to angular scales, d_ang = {min(d_ang_arr):.2f}  ... '
-                + f'{max(d_ang_arr):.2f} (mean {d_ang_mean:.2f}) Mpc'
+                f'physical to angular scales, d_ang = {d_ang_min:.2f}  ... '
+                + f'{d_ang_max:.2f} (mean {d_ang_mean:.2f}) Mpc'
             )
             print(
                 f'physical to angular scales, theta = {theta_min:.2g}  ... '
@@ -489,14 +1410,26 @@ class Compute_NG(object):
 
         """
         self._ng = treecorr.NGCorrelation(self._TreeCorrConfig)
-        if len(self._cats['fg']) > 1:
-            # Correlate n_fg times (for each fg object) and stack
+        if self._params['stack'] == 'vectorized':
+            # Correlate all fg objects individually in one pass
+            self.correlate_vectorized()
+        elif self.is_slices():
+            # Correlate once for each redshift slice
+            self.correlate_slices()
+        elif self.is_split_fg():
+            # Correlate n_fg times (for each fg object)
             self.correlate_n_fg()
-            self.stack()
         else:
             # Correlate onec with all fg objects
             self.correlate_1()
             self._ng_jk = None
+            self._cov = None
+            return
+
+        # Stack; in batch mode, samples are stacked separately; shards
+        # are stacked after merging
+        if self._fg_samples is None and not self.is_shard():
+            self.stack()
 
     def correlate_n_fg(self):
         """Correlate N FG.
@@ -506,47 +1439,395 @@ class Compute_NG(object):
         """
         params = self._params
 
-        n_corr = 0
-        ng_prev = ng_essentials(params["n_theta"])
-        self._all_ng = []
+        # Raw pair sums of all individual correlations
+        self._ng_sums = NGStack(
+            params['n_theta'],
+            n_obj=len(self._cats['fg']),
+            dtype=self.get_dtype_per_lens(),
+        )
+
+        # Correlation of a single fg object, cleared before each call
+        ng_lens = treecorr.NGCorrelation(self._TreeCorrConfig)
+
+        # Loop index, restored from checkpoint if available
+        state = self.open_checkpoint()
+
+        if params['n_proc'] > 1:
+            # Run individual correlations in parallel processes
+            self.correlate_n_fg_pool(ng_lens, state)
+        else:
+            self.correlate_n_fg_serial(ng_lens, state)
+        self.write_checkpoint(state, len(self._ng_sums))
+
+        # Count correlations
+        n_corr = len(self._ng_sums)
+
+        if params['stack'] == 'cross':
+            if params['verbose']:
+                print('Cross (treecorr process_cross) stacking of fg objects')
+
+            # Sum of individual correlations
+            sums = self._ng_sums.sum()
+            for key in NGStack.keys:
+                getattr(ng_lens, key)[:] = sums[key]
+            self._ng = ng_lens
+
+            varg = treecorr.calculateVarG(self._cats['bg'])
+            self._ng.finalize(varg)
+
+        if n_corr == 0:
+            raise ValueError('No correlations computed')
+        print(f'Computed {n_corr} correlations')
+
+    def correlate_slices(self):
+        """Correlate Slices.
+
+        Carry out one correlation for each foreground redshift slice.
+
+        """
+        params = self._params
+
+        ng_slices = [
+            treecorr.NGCorrelation(config)
+            for config in self._TreeCorrConfig_slices
+        ]
+
+        for _ in self.iter_bg():
+            for cat_fg, ng_slice in tqdm(
+                zip(self._cats['fg'], ng_slices),
+                total=len(ng_slices),
+                disable=not params['verbose'],
+            ):
+                ng_slice.process_cross(
+                    cat_fg,
+                    self._cats['bg'][0],
+                    num_threads=params['n_cpu'],
+                )
+
+        # Raw pair sums of all slices, on angular scales of each slice
+        self._ng_sums = NGStack(ng_slices[0].nbins, n_obj=len(ng_slices))
+        for jdx, ng_slice in enumerate(ng_slices):
+            self._ng_sums.set_row(jdx, ng_slice)
+
+        if params['verbose']:
+            print(f'Computed {len(ng_slices)} correlations')
+
+    def correlate_n_fg_serial(self, ng_lens, state):
+        """Correlate N FG Serial.
+
+        Carry out n_fg correlations one after the other.
+
+        Parameters
+        ----------
+        ng_lens : treecorr.NGCorrelation
+            correlation of a single fg object
+        state : dict
+            loop state, see :meth:`open_checkpoint`
+
+        """
+        params = self._params
+
+        n_obj = len(self._cats['fg'])
 
         # More than one foreground catalogue: run individual correlations
-        for idx, cat_fg in tqdm(
-            enumerate(self._cats['fg']),
-            total=len(self._cats['fg']),
+        for idx in tqdm(
+            range(state['i_obj'], n_obj),
+            initial=state['i_obj'],
+            total=n_obj,
             disable=not params['verbose'],
         ):
-
-            # Save previous cumulative correlations (empty if first)
-            ng_prev.copy_from(self._ng)
+            cat_fg = self._cats['fg'][idx]
 
             # Perform correlation
-            self._ng.process_cross(
+            ng_lens.clear()
+            ng_lens.process_cross(
                 cat_fg,
                 self._cats['bg'][0],
                 num_threads=params['n_cpu']
             )
 
-            # Last correlation = difference betwen two cumulative results
-            ng_diff = ng_essentials(self._params["n_theta"])
-            ng_diff.difference(self._ng, ng_prev)
+            # Add raw (weighted, not finalized) pair sums
+            self._ng_sums.add_to_rows(idx, ng_lens)
 
-            # Count (and add) correlations
-            n_corr += 1
+            state['i_obj'] = idx + 1
+            if state['i_obj'] % params['checkpoint_interval'] == 0:
+                self.write_checkpoint(state, state['i_obj'])
 
-            self._all_ng.append(ng_diff)
-            # Update previous cumulative correlations
-            ng_prev.copy_from(self._ng)
+    def correlate_n_fg_pool(self, ng_lens, state):
+        """Correlate N FG Pool.
 
-        if params['stack'] == 'cross':
+        Carry out n_fg correlations with a pool of n_proc processes.
+        Each process correlates contiguous blocks of fg objects. The
+        catalogues are shared with the processes by fork (copy-on-write)
+        and are not copied. With checkpoints, blocks are processed in
+        order.
+
+        Parameters
+        ----------
+        ng_lens : treecorr.NGCorrelation
+            correlation of a single fg object
+        state : dict
+            loop state, see :meth:`open_checkpoint`
+
+        """
+        params = self._params
+
+        n_obj = len(self._cats['fg'])
+        first = state['i_obj']
+        if first == n_obj:
+            return
+
+        # Correlate first object here: this builds the bg field
+        # (ball tree), which is then shared with all processes
+        ng_lens.clear()
+        ng_lens.process_cross(
+            self._cats['fg'][first],
+            self._cats['bg'][0],
+            num_threads=params['n_cpu'],
+        )
+        self._ng_sums.add_to_rows(first, ng_lens)
+        state['i_obj'] = first + 1
+
+        # Contiguous blocks of objects, several per process for
+        # load balancing
+        n_block = max(
+            1,
+            int(np.ceil((n_obj - first - 1) / (4 * params['n_proc']))),
+        )
+        if self._checkpoint is not None:
+            n_block = min(n_block, params['checkpoint_interval'])
+        blocks = [
+            (start, min(start + n_block, n_obj))
+            for start in range(first + 1, n_obj, n_block)
+        ]
+
+        _pool_data['cats_fg'] = self._cats['fg']
+        _pool_data['cat_bg'] = self._cats['bg'][0]
+        _pool_data['config'] = self._TreeCorrConfig
+        _pool_data['n_bin'] = params['n_theta']
+
+        context = multiprocessing.get_context('fork')
+        try:
+            with context.Pool(params['n_proc']) as pool:
+                if self._checkpoint is None:
+                    results = pool.imap_unordered(_correlate_block, blocks)
+                else:
+                    results = pool.imap(_correlate_block, blocks)
+                last = first
+                for start, stop, sums in tqdm(
+                    results,
+                    total=len(blocks),
+                    disable=not params['verbose'],
+                ):
+                    # Add raw (weighted, not finalized) pair sums
+                    self._ng_sums.add_to_rows(slice(start, stop), sums)
+
+                    if self._checkpoint is not None:
+                        state['i_obj'] = stop
+                        if stop - last >= params['checkpoint_interval']:
+                            self.write_checkpoint(state, stop)
+                            last = stop
+        finally:
+            _pool_data.clear()
+
+    def get_checkpoint_paths(self):
+        """Get Checkpoint Paths.
+
+        Return checkpoint file paths.
+
+        Returns
+        -------
+        str
+            loop state file path
+        str
+            pair sums file path
+
+        """
+        base = self._params['checkpoint_path']
+
+        return f'{base}.json', f'{base}_rows.npy'
+
+    def open_checkpoint(self):
+        """Open Checkpoint.
+
+        Open checkpoint of individual correlations if checkpoint_path is
+        set. If a checkpoint of the same run exists, pair sums are
+        restored, and the returned loop state is the one of the last
+        checkpoint.
+
+        The pair sums are written to a memory-mapped file for fg objects
+        up to the loop index. This keeps the overhead of checkpoints
+        small.
+
+        Returns
+        -------
+        dict
+            loop state, with number of correlated fg objects (i_obj)
+
+        Raises
+        ------
+        ValueError
+            if the checkpoint was written by a different run
+
+        """
+        params = self._params
+
+        self._checkpoint = None
+        state = {'i_obj': 0}
+        if not params['checkpoint_path']:
+            return state
+
+        n_obj = len(self._ng_sums)
+        key = catalogue.get_cache_key(
+            params['input_path_bg'],
+            fg=catalogue.get_cache_key(params['input_path_fg']),
+            n_obj=n_obj,
+            **{name: params[name] for name in self._checkpoint_keys},
+        )
+        path_state, path_rows = self.get_checkpoint_paths()
+
+        if os.path.exists(path_state):
+            with open(path_state) as f_in:
+                saved = json.load(f_in)
+            if saved['key'] != key:
+                raise ValueError(
+                    f'Checkpoint {path_state} is from a different run'
+                )
+            state = saved['state']
+            rows = np.lib.format.open_memmap(path_rows, mode='r+')
+
+            # Objects up to loop index
+            i_obj = state['i_obj']
+            for jdx, name in enumerate(NGStack.keys):
+                self._ng_sums[name][:i_obj] = rows[jdx, :i_obj]
             if params['verbose']:
-                print('Cross (treecorr process_cross) stacking of fg objects')
-            varg = treecorr.calculateVarG(self._cats['bg'])
-            self._ng.finalize(varg)
+                print(
+                    f'Resuming from checkpoint {path_state} at fg object'
+                    + f' {i_obj}'
+                )
+        else:
+            rows = np.lib.format.open_memmap(
+                path_rows,
+                mode='w+',
+                dtype=self._ng_sums.dtype,
+                shape=(len(NGStack.keys), n_obj, self._ng_sums.n_bin),
+            )
+
+        self._checkpoint = {'key': key, 'rows': rows, 'row': state['i_obj']}
+
+        return state
+
+    def write_checkpoint(self, state, stop):
+        """Write Checkpoint.
+
+        Write pair sums of fg objects correlated since the last
+        checkpoint, and the loop state. The loop state is written last,
+        such that the checkpoint is valid if interrupted at any point.
+
+        Parameters
+        ----------
+        state : dict
+            loop state, see :meth:`open_checkpoint`
+        stop : int
+            number of correlated fg objects
+
+        """
+        if self._checkpoint is None:
+            return
 
+        rows = self._checkpoint['rows']
+        start = self._checkpoint['row']
+        for jdx, name in enumerate(NGStack.keys):
+            rows[jdx, start:stop] = self._ng_sums[name][start:stop]
+        rows.flush()
+
+        path_state, _ = self.get_checkpoint_paths()
+        with open(f'{path_state}.tmp', 'w') as f_out:
+            json.dump({'key': self._checkpoint['key'], 'state': state}, f_out)
+        os.replace(f'{path_state}.tmp', path_state)
+
+        self._checkpoint['row'] = state['i_obj']
+
+    def remove_checkpoint(self):
+        """Remove Checkpoint.
+
+        Remove checkpoint files after a completed run.
+
+        """
+        if not getattr(self, '_checkpoint', None):
+            return
+
+        for path in self.get_checkpoint_paths():
+            os.remove(path)
+        self._checkpoint = None
+
+    def correlate_vectorized(self):
+        """Correlate Vectorized.
+
+        Compute per-object correlations for all foreground objects,
+        binned directly on the output (angular or physical) scales.
+
+        """
+        params = self._params
+
+        r_edges = correlate_ng.get_log_bins(
+            params['theta_min'],
+            params['theta_max'],
+            params['n_theta'],
+        )
+        if params['scales'] == 'physical':
+            # Bins in Mpc, scaled by angular distance to each object
+            scale = self._d_ang_arr
+        else:
+            # Bins in rad
+            r_edges = r_edges * treecorr.config.parse_unit(self._sep_units)
+            scale = None
+
+        if params['verbose']:
+            print('Vectorized per-object correlation of fg objects')
+        self._ng_sums = None
+        for _ in self.iter_bg():
+            ng_sums = correlate_ng.correlate_per_lens(
+                self._tree,
+                self._g1['bg'],
+                self._g2['bg'],
+                self._w['bg'],
+                self._data['fg'][params['key_ra_fg']],
+                self._data['fg'][params['key_dec_fg']],
+                self._w['fg'],
+                r_edges,
+                scale=scale,
+                coord_units=self._coord_units,
+                n_cpu=params['n_cpu'],
+                dtype=self.get_dtype_per_lens(),
+            )
+
+            # Add pair sums of this bg chunk
+            if self._ng_sums is None:
+                self._ng_sums = ng_sums
+            else:
+                self._ng_sums.add_to_rows(slice(None), ng_sums)
+
+        n_corr = len(self._ng_sums)
         if n_corr == 0:
             raise ValueError('No correlations computed')
-        print(f'Computed {n_corr} correlations')
+        if params['verbose']:
+            print(f'Computed {n_corr} correlations')
+
+    def get_dtype_per_lens(self):
+        """Get Dtype Per Lens.
+
+        Return storage type of individual correlations.
+
+        Returns
+        -------
+        type
+            numpy floating point type
+
+        """
+        if self._params.get('single_precision', False):
+            return np.float32
+        return np.float64
 
     def correlate_1(self):
         """Correlate One.
@@ -563,14 +1844,30 @@ class Compute_NG(object):
             num_threads=self._params['n_cpu'],
         )
 
-    def stack(self):
+    def stack(self, idx=None):
         """Stack.
 
         Stack correlations.
 
+        Parameters
+        ----------
+        idx : numpy.array, optional
+            indices of fg objects to stack, default is ``None`` (all)
+
         """
         params = self._params
 
+        if idx is None:
+            ng_sums = self._ng_sums
+            d_ang_arr = self._d_ang_arr
+            idx = slice(None)
+        else:
+            ng_sums = self._ng_sums.subset(idx)
+            if self._d_ang_arr is None:
+                d_ang_arr = None
+            else:
+                d_ang_arr = np.asarray(self._d_ang_arr)[idx]
+
         if params['scales'] == 'physical':
 
             # Create new config for correlations stacked on physical scales.
@@ -586,20 +1883,69 @@ class Compute_NG(object):
             # Re-use previous config for stacking on angular scales
             TreeCorrConfig_for_stack = self._TreeCorrConfig
 
-        if len(self._cats['fg']) > 1 and not params['stack'] == 'cross':
+        # Group fg objects into patches for jackknife covariance
+        patch = None
+        self._patch = None
+        if params['n_patch'] > 0 and params['stack'] != 'cross':
+            if params['verbose']:
+                print(
+                    f"Grouping fg objects into {params['n_patch']}"
+                    + f" {params['patch_method']} patches"
+                )
+            patch = get_patch_labels(
+                self._data['fg'][params['key_ra_fg']][idx],
+                self._data['fg'][params['key_dec_fg']][idx],
+                params['n_patch'],
+                method=params['patch_method'],
+                coord_units=self._coord_units,
+                seed=params['patch_seed'],
+            )
+            if isinstance(idx, slice):
+                self._patch = patch
+
+        if self.is_slices():
+            # Add angular bins of slices to physical bins
+            if params['verbose']:
+                print('Post-process (redshift slice) stacking of fg objects')
+            r_edges = correlate_ng.get_log_bins(
+                float(params['theta_min']),
+                float(params['theta_max']),
+                params['n_theta'],
+            )
+            # The summands are slices, not objects: a delete-one-slice
+            # jackknife is not a meaningful error, and is not written
+            self._ng, _, _ = ng_stack(
+                TreeCorrConfig_for_stack,
+                rebin_physical_sum(ng_sums, r_edges, self._d_ang_slice),
+                None,
+            )
+            self._ng_jk = None
+            self._cov = None
+        elif params['stack'] == 'vectorized':
+            # Individual correlations are on the final scales already
+            if params['verbose']:
+                print('Post-process (vectorized) stacking of fg objects')
+            self._ng, self._ng_jk, self._cov = ng_stack(
+                TreeCorrConfig_for_stack,
+                ng_sums,
+                None,
+                patch=patch,
+            )
+        elif params['stack'] != 'cross':
             # Stack now (in post-processing) if more than one fg catalogue,
             # and not cross stacking done
             if params['verbose']:
                 print('Post-process (this script) stacking of fg objects')
 
-            # MKDEBUG TODO: distinguish from previous ng (not used anymore here)
-            self._ng, self._ng_jk = ng_stack(
+            self._ng, self._ng_jk, self._cov = ng_stack(
                 TreeCorrConfig_for_stack,
-                self._all_ng,
-                self._d_ang_arr,
+                ng_sums,
+                d_ang_arr,
+                patch=patch,
             )
         else:
             self._ng_jk = None
+            self._cov = None
 
     def create_treecorr_config(self, scale_min, scale_max, n_cpu):
         """Create Treecorr Config.
@@ -634,7 +1980,46 @@ class Compute_NG(object):
         return TreeCorrConfig
 
 
-    def _write_corr(self, ng, out_path):
+    def get_provenance(self, name=None, jackknife=False):
+        """Get Provenance.
+
+        Return provenance header keywords of correlation outputs.
+
+        Parameters
+        ----------
+        name : str, optional
+            foreground sample name in batch mode, default is ``None``
+        jackknife : bool, optional
+            True for output with jackknife errors, default is False
+
+        Returns
+        -------
+        dict
+            header keywords
+
+        """
+        params = self._params
+
+        header = {
+            'SOFTWARE': f'unions_wl {unions_wl.__version__}',
+            'TREECORR': treecorr.__version__,
+            'DATE': datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S'),
+            'SCALES': params['scales'],
+            'STACK': params['stack'],
+            'N_PATCH': params['n_patch'],
+            'JK': jackknife,
+        }
+        if params.get('input_path_store'):
+            header['STORE'] = params['input_path_store']
+        elif not params.get('input_path_shards'):
+            header['BG_PATH'] = params['input_path_bg']
+        header['FG_PATH'] = params['input_path_fg']
+        if name is not None:
+            header['SAMPLE'] = name
+
+        return header
+
+    def _write_corr(self, ng, out_path, header=None, images=None):
         """Write Corr.
 
         Write correlation output to disk.
@@ -645,48 +2030,468 @@ class Compute_NG(object):
             number-shear correlation information
         out_path : str
             output file path
+        header : dict, optional
+            additional header keywords, FITS output only, default is
+            ``None``
+        images : dict, optional
+            additional image extensions, FITS output only, default is
+            ``None``
 
         """
         if self._params['verbose']:
             print(f"Writing output file {out_path}")
-        ng.write(out_path, rg=None, file_type=None, precision=None)
+        write_ng(out_path, [ng], header=header, images=images)
 
-    @classmethod
-    def _fix_treecorr_keys(cls, path):
-        """Fix Treecorr Keys.
+    def write_correlations(self, out_path=None, name=None):
+        """Write Correlations.
 
-        Fix Keywords in treecorr FITS output file.
+        Write correlation outputs to disk. The patch jackknife
+        covariance is written as image extension ``cov`` of FITS
+        correlation outputs, or to a separate FITS file otherwise.
 
         Parameters
         ----------
-        path : str
-            file path
+        out_path : str, optional
+            output path; if given, jackknife and covariance output paths
+            are derived from it; default is ``None`` (use parameter
+            values)
+        name : str, optional
+            foreground sample name in batch mode, default is ``None``
 
         """
-        hdu_list = fits.open(path)
-        hdu_list[1].header['COORDS'] = 'spherical'
-        hdu_list[1].header['metric'] = 'Euclidean'
-        hdu_list.writeto(path, overwrite=True)
-
-    def write_correlations(self):
-        """Write Correlations.
-
-        Write correlation outputs to disk.
+        if out_path is None:
+            out_path = self._params['out_path']
+            out_path_jk = self._params['out_path_jk']
+            out_path_cov = self._params['out_path_cov']
+        else:
+            out_path_jk = None
+            out_path_cov = None
 
-        """
-        self._write_corr(self._ng, self._params["out_path"])
-        if self._params['stack'] != 'cross':
-            self._fix_treecorr_keys(self._params["out_path"])
+        # Patch jackknife covariance, next to the correlation for FITS
+        # output
+        images = None
+        if self._cov is not None:
+            if (
+                not out_path_cov
+                and treecorr.util.parse_file_type(
+                    None,
+                    out_path,
+                    output=True,
+                ) != 'FITS'
+            ):
+                base, _ = os.path.splitext(out_path)
+                out_path_cov = f'{base}_cov.fits'
+            if not out_path_cov:
+                images = {'cov': self._cov}
+
+        self._write_corr(
+            self._ng,
+            out_path,
+            self.get_provenance(name),
+            images=images,
+        )
 
         # Write stack with jackknife resamples summaries to file
         if self._ng_jk:
-            if not self._params['out_path_jk']:
-                base, ext = os.path.splitext(self._params['out_path'])
+            if not out_path_jk:
+                base, ext = os.path.splitext(out_path)
                 out_path_jk = f'{base}_jk{ext}'
+            self._write_corr(
+                self._ng_jk,
+                out_path_jk,
+                self.get_provenance(name, jackknife=True),
+            )
+
+        # Write patch jackknife covariance to separate file
+        if self._cov is not None and out_path_cov:
+            if self._params['verbose']:
+                print(f"Writing covariance file {out_path_cov}")
+            header = fits.Header(self.get_provenance(name, jackknife=True))
+            header['COMMENT'] = (
+                'Patch jackknife covariance of tangential shear,'
+                + f" {self._params['n_patch']}"
+                + f" {self._params['patch_method']} patches"
+            )
+            fits.HDUList([
+                fits.PrimaryHDU(),
+                fits.ImageHDU(self._cov, header=header, name='cov'),
+            ]).writeto(out_path_cov, overwrite=True)
+
+    def get_out_path_shard(self):
+        """Get Out Path Shard.
+
+        Return partial output path of this shard.
+
+        Returns
+        -------
+        str
+            output path
+
+        """
+        if self._params['out_path_shard']:
+            return self._params['out_path_shard']
+
+        i_shard, n_shard = self.get_shard()
+        base, _ = os.path.splitext(self._params['out_path'])
+
+        return f'{base}_shard{i_shard}of{n_shard}.npz'
+
+    def write_shard(self):
+        """Write Shard.
+
+        Write partial output of this shard to disk: raw (not normalised)
+        per-object pair sums, object indices in the full foreground
+        sample, and the information needed to stack after merging.
+
+        """
+        params = self._params
+
+        out_path = self.get_out_path_shard()
+        if params['verbose']:
+            print(f'Writing shard output file {out_path}')
+
+        data = {key: self._ng_sums[key] for key in NGStack.keys}
+        data['idx'] = self._shard_idx
+        data['n_obj'] = self._n_obj_all
+        data['shard'] = self.get_shard()
+        data['ra'] = self._data['fg'][params['key_ra_fg']]
+        data['dec'] = self._data['fg'][params['key_dec_fg']]
+        if self._d_ang_arr is not None:
+            data['d_ang'] = self._d_ang_arr
+        data['config'] = json.dumps(self._TreeCorrConfig)
+        data['params'] = json.dumps(
+            {key: params[key] for key in self._shard_keys}
+        )
+
+        # Write to temporary file first, such that a partial output
+        # is either complete or absent
+        out_path_tmp = f'{out_path}.tmp'
+        with open(out_path_tmp, 'wb') as f_out:
+            np.savez(f_out, **data)
+        os.replace(out_path_tmp, out_path)
+
+    def read_shards(self):
+        """Read Shards.
+
+        Read partial outputs of all shards, and combine the per-object
+        pair sums in the order of the full foreground sample.
+
+        Raises
+        ------
+        ValueError
+            if shards are missing, duplicate, or inconsistent
+
+        """
+        params = self._params
+
+        input_path = params['input_path_shards']
+        if ',' in input_path:
+            paths = input_path.split(',')
+        else:
+            paths = sorted(glob.glob(input_path))
+        if len(paths) == 0:
+            raise ValueError(f'No shard outputs found for {input_path}')
+
+        shards = []
+        for path in paths:
+            if params['verbose']:
+                print(f'Reading shard output file {path}')
+            with np.load(path) as dat:
+                shards.append({key: dat[key] for key in dat.files})
+
+        # Check consistency
+        ref = shards[0]
+        n_shard = ref['shard'][1]
+        i_shards = sorted(int(dat['shard'][0]) for dat in shards)
+        if i_shards != list(range(n_shard)):
+            raise ValueError(
+                f'Shards {i_shards} found, need each of 0 ... {n_shard - 1}'
+            )
+        for key in ('shard', 'n_obj', 'config', 'params'):
+            for dat in shards[1:]:
+                if (
+                    (key == 'shard' and dat[key][1] != n_shard)
+                    or (key != 'shard' and dat[key] != ref[key])
+                ):
+                    raise ValueError(f'Inconsistent shard outputs ({key})')
+
+        idx = np.concatenate([dat['idx'] for dat in shards])
+        if not np.array_equal(np.sort(idx), np.arange(ref['n_obj'])):
+            raise ValueError('Shard outputs do not cover fg sample')
+        order = np.argsort(idx)
+
+        # Shard parameters
+        params.update(json.loads(str(ref['params'])))
+        self._TreeCorrConfig = json.loads(str(ref['config']))
+
+        # Per-object pair sums and foreground data in original order
+        self._ng_sums = NGStack(params['n_theta'], dtype=ref['xi'].dtype)
+        self._ng_sums.append({
+            key: np.concatenate([dat[key] for dat in shards])[order]
+            for key in NGStack.keys
+        })
+        self._data = {'fg': {}}
+        for key in ('ra', 'dec'):
+            self._data['fg'][params[f'key_{key}_fg']] = np.concatenate(
+                [dat[key] for dat in shards]
+            )[order]
+        if 'd_ang' in ref:
+            self._d_ang_arr = np.concatenate(
+                [dat['d_ang'] for dat in shards]
+            )[order]
+        else:
+            self._d_ang_arr = None
+        self._fg_samples = None
+
+        if params['verbose']:
+            print(
+                f'Merged {n_shard} shards with {len(self._ng_sums)} fg'
+                + ' objects'
+            )
+
+    def write_store(self):
+        """Write Store.
+
+        Write per-object pair sums to disk, with foreground columns and
+        information needed to re-stack, see
+        :func:`unions_wl.stack_ng.write_ng_store`.
+
+        """
+        params = self._params
+
+        out_path = params['out_path_store']
+        if params['verbose']:
+            print(f'Writing per-object store {out_path}')
+
+        # Foreground columns, in native byte order
+        columns = {}
+        for key, values in self._data['fg'].items():
+            values = np.asarray(values)
+            columns[key] = values.astype(values.dtype.newbyteorder('='))
+        if self._d_ang_arr is not None:
+            columns['d_ang'] = np.asarray(self._d_ang_arr)
+        if self._fg_samples is not None:
+            n_char = max(len(name) for name in self._fg_samples)
+            sample = np.zeros(len(self._ng_sums), dtype=f'U{n_char}')
+            for name, idx in self._fg_samples.items():
+                sample[idx] = name
+            columns['sample'] = sample
+        if getattr(self, '_patch', None) is not None:
+            columns['patch'] = self._patch
+
+        if params['key_id_fg'] in columns:
+            lens_id = columns[params['key_id_fg']]
+        else:
+            lens_id = None
+
+        meta = {
+            'config': self._TreeCorrConfig,
+            'params': {key: params[key] for key in self._shard_keys},
+            'coord_units': self._coord_units,
+            'sep_units': self._sep_units,
+            'key_ra_fg': params['key_ra_fg'],
+            'key_dec_fg': params['key_dec_fg'],
+        }
+
+        write_ng_store(
+            out_path,
+            self._ng_sums,
+            lens_id=lens_id,
+            columns=columns,
+            meta=meta,
+        )
+
+    def get_restack_weights(self, store):
+        """Get Restack Weights.
+
+        Read foreground samples to re-stack, from a list of catalogues or
+        from one catalogue with sample label column, and match objects to
+        the store by ID, or by row if no ID column is given.
+
+        Parameters
+        ----------
+        store : NGStore
+            per-object pair sums
+
+        Raises
+        ------
+        ValueError
+            if objects without ID do not match the store
+
+        Returns
+        -------
+        numpy.array
+            weight of each store object in each sample, zero for objects
+            not in a sample, shape (n_sample, n_obj)
+
+        """
+        params = self._params
+
+        key_row = params['key_id_fg'] or params['key_ra_fg']
+        columns = [key_row]
+        if params['key_label_fg'] is not None:
+            columns.append(params['key_label_fg'])
+
+        input_paths = params['input_path_fg'].split(',')
+        data_list = []
+        names = []
+        for input_path in input_paths:
+            if params['verbose']:
+                print(f'Reading catalogue {input_path}')
+            data_list.append(
+                catalogue.read_columns(input_path, columns=columns)
+            )
+            names.append(os.path.splitext(os.path.basename(input_path))[0])
+
+        n_obj_list = [len(dat[key_row]) for dat in data_list]
+
+        # Rows of objects for each sample
+        self._fg_samples = {}
+        if params['key_label_fg'] is None:
+            start = 0
+            for name, n_obj in zip(names, n_obj_list):
+                self._fg_samples[name] = np.arange(start, start + n_obj)
+                start += n_obj
+        else:
+            labels, idx_inv = np.unique(
+                np.concatenate(
+                    [dat[params['key_label_fg']] for dat in data_list]
+                ),
+                return_inverse=True,
+            )
+            for jdx, label in enumerate(labels):
+                self._fg_samples[str(label)] = np.where(idx_inv == jdx)[0]
+
+        # Store row of each object
+        if params['key_id_fg'] is None:
+            if sum(n_obj_list) != len(store):
+                raise ValueError(
+                    f'Number of fg objects {sum(n_obj_list)} different from'
+                    + f' store {len(store)}, objects need IDs (--key_id_fg)'
+                )
+            idx_store = np.arange(len(store))
+        else:
+            idx_store = store.get_index(
+                np.concatenate([dat[params['key_id_fg']] for dat in data_list])
+            )
+
+        # Weight columns of all samples
+        if params['key_w_fg'] is not None:
+            keys_w = list(dict.fromkeys(
+                params['key_w_fg'].format(jdx)
+                for jdx in range(len(self._fg_samples))
+            ))
+            data_list = [
+                catalogue.read_columns(input_path, columns=keys_w)
+                for input_path in input_paths
+            ]
+
+        weights = np.zeros((len(self._fg_samples), len(store)))
+        for jdx, rows in enumerate(self._fg_samples.values()):
+            if params['key_w_fg'] is None:
+                w = 1
+            else:
+                key_w = params['key_w_fg'].format(jdx)
+                w = np.concatenate([dat[key_w] for dat in data_list])[rows]
+            np.add.at(weights[jdx], idx_store[rows], w)
+
+        return weights
+
+    def restack_store(self):
+        """Restack Store.
+
+        Stack per-object pair sums from a store for one or more
+        foreground samples with new selections and weights, e.g. the
+        splits of ``split_sample.py``, and write outputs to disk. No
+        correlations are computed. All samples are stacked in one
+        weighted reduction, see :func:`unions_wl.stack_ng.ng_restack`.
+
+        """
+        params = self._params
+
+        if params['verbose']:
+            print(f"Reading per-object store {params['input_path_store']}")
+        with NGStore(params['input_path_store']) as store:
+
+            # Parameters and configuration of the correlations
+            meta = store.meta
+            params.update(meta['params'])
+            self._TreeCorrConfig = meta['config']
+            self._coord_units = meta['coord_units']
+            self._sep_units = meta['sep_units']
+
+            weights = self.get_restack_weights(store)
+
+            # Only read objects which are in a sample
+            idx = np.where(np.any(weights != 0, axis=0))[0]
+            weights = weights[:, idx]
+            ng_sums = store.read(idx=idx)
+
+            if params['verbose']:
+                print(
+                    f'Re-stacking {len(weights)} fg sample(s) with'
+                    + f' {len(idx)} objects'
+                )
+
+            if params['scales'] == 'physical':
+                TreeCorrConfig_for_stack = self.create_treecorr_config(
+                    params['theta_min'],
+                    params['theta_max'],
+                    1,
+                )
             else:
-                out_path_jk = self._params['out_path_jk']
-            self._write_corr(ng_jk, out_path_jk)
-            self._fix_treecorr_keys(out_path_jk)
+                TreeCorrConfig_for_stack = self._TreeCorrConfig
+
+            # Re-bin post-processed correlations to physical scales
+            d_ang_arr = None
+            if (
+                params['scales'] == 'physical'
+                and params['stack'] != 'vectorized'
+            ):
+                d_ang_arr = store.get_column('d_ang')[idx]
+
+            # Group fg objects of each sample into patches for jackknife
+            # covariance
+            patch = None
+            if params['n_patch'] > 0 and params['stack'] != 'cross':
+                ra = store.get_column(meta['key_ra_fg'])[idx]
+                dec = store.get_column(meta['key_dec_fg'])[idx]
+                patch = np.zeros(weights.shape, dtype=int)
+                for jdx, w in enumerate(weights):
+                    in_sample = w != 0
+                    patch[jdx][in_sample] = get_patch_labels(
+                        ra[in_sample],
+                        dec[in_sample],
+                        params['n_patch'],
+                        method=params['patch_method'],
+                        coord_units=self._coord_units,
+                        seed=params['patch_seed'],
+                    )
+
+        results = ng_restack(
+            TreeCorrConfig_for_stack,
+            ng_sums,
+            weights,
+            all_d_ang=d_ang_arr,
+            patch=patch,
+        )
+
+        # Write correlation outputs to disk
+        if self.is_batch() and params['out_path_batch']:
+            self.write_correlations_batch([
+                (name, ng, ng_jk, cov)
+                for name, (ng, ng_jk, cov) in zip(self._fg_samples, results)
+            ])
+        elif self.is_batch():
+            for jdx, name in enumerate(self._fg_samples):
+                self._ng, self._ng_jk, self._cov = results[jdx]
+                self.write_correlations(
+                    out_path=self.get_out_path_sample(jdx, name),
+                    name=name,
+                )
+        else:
+            self._ng, self._ng_jk, self._cov = results[0]
+            self.write_correlations()
 
     def run(self):
         """Run.
@@ -697,6 +2502,20 @@ class Compute_NG(object):
         # Check parameter validity
         self.check_params()
 
+        # Re-stack per-object store for fg sample(s) and write to disk
+        if self._params['input_path_store']:
+            self.restack_store()
+            return
+
+        # Merge shards: stack partial outputs and write to disk
+        if self._params['input_path_shards']:
+            self.read_shards()
+            self.stack()
+            self.write_correlations()
+            if self._params['out_path_store']:
+                self.write_store()
+            return
+
         # Read input catalogues
         self.read_data()
 
@@ -707,7 +2526,154 @@ class Compute_NG(object):
         self.correlate()
 
         # Write correlation outputs to disk
-        self.write_correlations()
+        if self.is_shard():
+            self.write_shard()
+        elif self._fg_samples is None:
+            self.write_correlations()
+        else:
+            self.stack_and_write_samples()
+        if self._params['out_path_store'] and not self.is_shard():
+            self.write_store()
+
+        # Outputs are complete, checkpoint not needed anymore
+        self.remove_checkpoint()
+
+    def get_out_path_sample(self, jdx, name):
+        """Get Out Path Sample.
+
+        Return output path of a foreground sample in batch mode.
+
+        Parameters
+        ----------
+        jdx : int
+            sample index
+        name : str
+            sample name
+
+        Returns
+        -------
+        str
+            output path
+
+        """
+        out_path = self._params['out_path']
+        if ',' in out_path:
+            out_paths = out_path.split(',')
+            if len(out_paths) != len(self._fg_samples):
+                raise ValueError(
+                    f'Number of output paths {len(out_paths)} different'
+                    + f' from number of fg samples {len(self._fg_samples)}'
+                )
+            return out_paths[jdx]
+        elif '{}' in out_path:
+            return out_path.format(name)
+        else:
+            base, ext = os.path.splitext(out_path)
+            return f'{base}_{name}{ext}'
+
+    def stack_and_write_samples(self):
+        """Stack And Write Samples.
+
+        Stack correlations of each foreground sample in batch mode, and
+        write outputs to disk.
+
+        """
+        samples = []
+        for jdx, (name, idx) in enumerate(self._fg_samples.items()):
+            if self._params['verbose']:
+                print(f'Stacking fg sample {name} with {len(idx)} objects')
+            self.stack(idx=idx)
+            if self._params['out_path_batch']:
+                samples.append((name, self._ng, self._ng_jk, self._cov))
+            else:
+                self.write_correlations(
+                    out_path=self.get_out_path_sample(jdx, name),
+                    name=name,
+                )
+
+        if samples:
+            self.write_correlations_batch(samples)
+
+    def write_correlations_batch(self, samples):
+        """Write Correlations Batch.
+
+        Write correlation outputs of all foreground samples to one
+        multi-extension FITS file, in one pass. The extensions of each
+        sample are the stacked correlation <sample>, the correlation
+        with jackknife errors <sample>_jk, and the patch jackknife
+        covariance <sample>_cov if computed.
+
+        Parameters
+        ----------
+        samples : list
+            sample name, stacked correlation, correlation with jackknife
+            errors, and patch jackknife covariance (both ``None`` if not
+            available) of each sample
+
+        """
+        out_path = self._params['out_path_batch']
+        if self._params['verbose']:
+            print(f'Writing {len(samples)} fg samples to {out_path}')
+
+        ng_list = []
+        ext_names = []
+        header = []
+        images = {}
+        for name, ng, ng_jk, cov in samples:
+            ng_list.append(ng)
+            ext_names.append(name)
+            header.append(self.get_provenance(name))
+            if ng_jk:
+                ng_list.append(ng_jk)
+                ext_names.append(f'{name}_jk')
+                header.append(self.get_provenance(name, jackknife=True))
+            if cov is not None:
+                images[f'{name}_cov'] = cov
+
+        write_ng(
+            out_path,
+            ng_list,
+            ext_names=ext_names,
+            header=header,
+            images=images,
+        )
+
+
+def _correlate_block(block):
+    """Correlate Block.
+
+    Correlate a block of fg objects with the bg catalogue, in a worker
+    process of :meth:`Compute_NG.correlate_n_fg_pool`.
+
+    Parameters
+    ----------
+    block : tuple
+        start and stop index of fg objects
+
+    Returns
+    -------
+    int
+        start index
+    int
+        stop index
+    dict
+        raw pair sums of the objects, see :class:`NGStack`
+
+    """
+    start, stop = block
+
+    ng_lens = treecorr.NGCorrelation(_pool_data['config'])
+    sums = NGStack(_pool_data['n_bin'], n_obj=stop - start)
+    for idx in range(start, stop):
+        ng_lens.clear()
+        ng_lens.process_cross(
+            _pool_data['cats_fg'][idx],
+            _pool_data['cat_bg'],
+            num_threads=1,
+        )
+        sums.set_row(idx - start, ng_lens)
+
+    return start, stop, {key: sums[key] for key in NGStack.keys}
 
 
 # MKDEBUG TODO to cs_util
@@ -721,6 +2687,44 @@ def unit_to_rad(value, unit):
     return value * units.Unit(units).to('rad')
 
 
+def run_merge_ng_shards(*argv):
+    """Run Merge NG Shards.
+
+    Merge partial number-shear correlation outputs of shards, from
+    command line.
+
+    """
+    # Create instance for number-shear correlation computation
+    obj = Compute_NG()
+
+    # Read command line arguments
+    obj.set_params_from_command_line(argv)
+    if not obj._params['input_path_shards']:
+        raise ValueError('No shard outputs given (--input_path_shards)')
+
+    # Run code
+    obj.run()
+
+
+def run_restack_ng(*argv):
+    """Run Restack NG.
+
+    Re-stack per-object number-shear correlations from a store for new
+    foreground samples, from command line.
+
+    """
+    # Create instance for number-shear correlation computation
+    obj = Compute_NG()
+
+    # Read command line arguments
+    obj.set_params_from_command_line(argv)
+    if not obj._params['input_path_store']:
+        raise ValueError('No per-object store given (--input_path_store)')
+
+    # Run code
+    obj.run()
+
+
 def run_compute_ng_binned_samples(*argv):
     """Run Compute NG Binned Samples.
 
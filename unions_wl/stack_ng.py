@@ -9,12 +9,19 @@
 
 
 import math
+import json
+import os
+import zipfile
+
 import numpy as np
 
+from scipy import sparse
 from scipy.interpolate import interp1d
 
-from astropy.stats import jackknife_stats                                       
+import healpy as hp
+
 from astropy import units
+from astropy.io import fits
 
 import treecorr
 
@@ -45,8 +52,16 @@ class ng_essentials(object):
         self.xi_jk = np.zeros(n_bin)
         self.xi_im_jk = np.zeros(n_bin)
         self.varxi_jk = np.zeros(n_bin)
-        self.xi_jk_arr = []
-        self.xi_im_jk_arr = []
+
+        # Running number, mean, and sum of squared deviations of
+        # individual correlations
+        self.n_jk = 0
+        self.mean_xi_jk = np.zeros(n_bin)
+        self.m2_xi_jk = np.zeros(n_bin)
+        self.mean_xi_im_jk = np.zeros(n_bin)
+
+        # Patch jackknife covariance, if computed
+        self.cov = None
 
     def copy_from(self, ng):
         """Copy From.
@@ -59,13 +74,12 @@ class ng_essentials(object):
             number-shear correleation information
 
         """
-        for jdx in range(len(self.meanr)):
-            self.meanr[jdx] = ng.meanr[jdx]
-            self.meanlogr[jdx] = ng.meanlogr[jdx]
-            self.xi[jdx] = ng.xi[jdx]
-            self.xi_im[jdx] = ng.xi_im[jdx]
-            self.weight[jdx] = ng.weight[jdx]
-            self.npairs[jdx] = ng.npairs[jdx]
+        self.meanr[:] = ng.meanr
+        self.meanlogr[:] = ng.meanlogr
+        self.xi[:] = ng.xi
+        self.xi_im[:] = ng.xi_im
+        self.weight[:] = ng.weight
+        self.npairs[:] = ng.npairs
 
     def copy_to(self, ng, jackknife=False):
         """Copy To.
@@ -80,19 +94,18 @@ class ng_essentials(object):
             uses jackknife mean and std if True; default is False
 
         """
-        for jdx in range(len(ng.meanr)):
-            ng.meanr[jdx] = self.meanr[jdx]
-            ng.meanlogr[jdx] = self.meanlogr[jdx]
-            if not jackknife:
-                ng.xi[jdx] = self.xi[jdx]
-                ng.xi_im[jdx] = self.xi_im[jdx]
-                ng.varxi[jdx] = self.varxi[jdx]
-            else:
-                ng.xi[jdx] = self.xi_jk[jdx]
-                ng.xi_im[jdx] = self.xi_im_jk[jdx]
-                ng.varxi[jdx] = self.varxi_jk[jdx]
-            ng.weight[jdx] = self.weight[jdx]
-            ng.npairs[jdx] = self.npairs[jdx]
+        ng.meanr[:] = self.meanr
+        ng.meanlogr[:] = self.meanlogr
+        if not jackknife:
+            ng.xi[:] = self.xi
+            ng.xi_im[:] = self.xi_im
+            ng.varxi[:] = self.varxi
+        else:
+            ng.xi[:] = self.xi_jk
+            ng.xi_im[:] = self.xi_im_jk
+            ng.varxi[:] = self.varxi_jk
+        ng.weight[:] = self.weight
+        ng.npairs[:] = self.npairs
 
     def difference(self, ng_min, ng_sub):
         """Difference.
@@ -111,22 +124,24 @@ class ng_essentials(object):
         # treecorr.proess_cross, these are weighted quantities.
         # This is because the cumulative processing adds
         # weighted results.
-        for jdx in range(len(self.meanr)):
-            self.weight[jdx] = ng_min.weight[jdx] - ng_sub.weight[jdx]
+        self.weight[:] = ng_min.weight - ng_sub.weight
 
-            self.meanr[jdx] = ng_min.meanr[jdx] - ng_sub.meanr[jdx]
-            self.meanlogr[jdx] = ng_min.meanlogr[jdx] - ng_sub.meanlogr[jdx]
+        self.meanr[:] = ng_min.meanr - ng_sub.meanr
+        self.meanlogr[:] = ng_min.meanlogr - ng_sub.meanlogr
 
-            self.xi[jdx] = ng_min.xi[jdx] - ng_sub.xi[jdx]
-            self.xi_im[jdx] = ng_min.xi_im[jdx] - ng_sub.xi_im[jdx]
-            self.npairs[jdx] = ng_min.npairs[jdx] - ng_sub.npairs[jdx]
+        self.xi[:] = ng_min.xi - ng_sub.xi
+        self.xi_im[:] = ng_min.xi_im - ng_sub.xi_im
+        self.npairs[:] = ng_min.npairs - ng_sub.npairs
 
         # Remove weight for angular scales, such that the latter
         # are unweighted scales. Required for stacking on physical
         # scales, where we need unweighted scale for each correlation
-        for jdx in range(len(self.meanr)):
-            if self.meanr[jdx] > 0:
-                self.meanr[jdx] = self.meanr[jdx] / self.weight[jdx]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.meanr[:] = np.where(
+                self.meanr > 0,
+                self.meanr / self.weight,
+                self.meanr,
+            )
 
     def add(self, ng_sum):
         """Add.
@@ -141,8 +156,7 @@ class ng_essentials(object):
 
         """
         # Add weighted angular scales
-        for jdx in range(len(self.meanr)):
-            self.meanr[jdx] += ng_sum.meanr[jdx] * ng_sum.weight[jdx]
+        self.meanr += ng_sum.meanr * ng_sum.weight
 
         self.meanlogr += ng_sum.meanlogr
         self.xi += ng_sum.xi
@@ -150,8 +164,7 @@ class ng_essentials(object):
         self.weight += ng_sum.weight
         self.npairs += ng_sum.npairs
 
-        self.xi_jk_arr.append(ng_sum.xi)
-        self.xi_im_jk_arr.append(ng_sum.xi_im)
+        self.add_jk(ng_sum.xi, ng_sum.xi_im)
 
     def add_physical(self, ng, r, d_ang):
         """Add Physical.
@@ -175,83 +188,141 @@ class ng_essentials(object):
         # New x values: transfer from physical [Mpc] to angular [rad]
         x_new = r / d_ang
 
-        # Re-bin to new angular coordinates and add (= stack)
-
+        # Re-bin to new angular coordinates and add (= stack).
         # Angular scales: individual ones were not weighted, add weight
         # back here
-        self.meanr += get_interp(x_new, x, ng.meanr * ng.weight)
-        self.meanlogr += get_interp(x_new, x, ng.meanlogr)
+        res = get_interp_batch(
+            x_new[np.newaxis],
+            x[np.newaxis],
+            [
+                ng.meanr * ng.weight,
+                ng.meanlogr,
+                ng.xi,
+                ng.xi_im,
+                ng.weight,
+                ng.npairs,
+            ],
+        )
+        meanr_new, meanlogr_new, xi_new, xi_im_new, w_new, npairs_new = [
+            y_new[0] for y_new in res
+        ]
 
-        xi_new = get_interp(x_new, x, ng.xi)
+        self.meanr += meanr_new
+        self.meanlogr += meanlogr_new
         self.xi += xi_new
-
-        xi_im_new = get_interp(x_new, x, ng.xi_im)
         self.xi_im += xi_im_new
+        self.weight += w_new
+        self.npairs += npairs_new
 
-        self.weight += get_interp(x_new, x, ng.weight)
-        self.npairs += get_interp(x_new, x, ng.npairs)
+        # Jackknife moments
+        self.add_jk(xi_new, xi_im_new)
 
-        # Jackknife array
-        self.xi_jk_arr.append(xi_new)
-        self.xi_im_jk_arr.append(xi_im_new)
+    def add_per_lens(self, stack):
+        """Add Per Lens.
 
-    def normalise(self):
-        """Normalise.
+        Add number-shear correlations of individual objects to class
+        content, from raw (weighted) per-object pair sums.
 
-        Normalise class content.
+        Parameters
+        ----------
+        stack : NGStack
+            per-object pair sums
 
         """
-        sw = self.weight
+        # Angular scales are weighted sums already
+        sums = stack.sum()
+        self.meanr += sums['meanr']
+        self.meanlogr += sums['meanlogr']
+        self.xi += sums['xi']
+        self.xi_im += sums['xi_im']
+        self.weight += sums['weight']
+        self.npairs += sums['npairs']
 
-        for jdx in range(len(self.meanr)):
-            self.meanr[jdx] = self.meanr[jdx] / sw[jdx]
-            self.meanlogr[jdx] = self.meanlogr[jdx] / sw[jdx]
-            self.xi[jdx] = self.xi[jdx] / sw[jdx]
-            self.xi_im[jdx] = self.xi_im[jdx] / sw[jdx]
+        # Jackknife moments
+        self.add_jk(stack.xi, stack.xi_im)
 
-    def jackknife(self, all_ng):
-        """Jackknife.
+    def add_jk(self, xi, xi_im):
+        """Add JK.
 
-        Compute jackknife mean and standard deviation of number-shear
-        correlation.
+        Update running moments of individual correlations, used for
+        the delete-one jackknife. Batches are combined with the
+        pairwise update formula of Chan et al. (1979).
 
         Parameters
         ----------
-        all_ng : list
-            number-shear correlations for all foreground objects
+        xi : numpy.array
+            weighted tangential shear of one object, shape (n_bin), or
+            of several objects, shape (n_obj, n_bin)
+        xi_im : numpy.array
+            weighted cross shear, same shape as xi
 
         """
-        test_statistic = lambda x: (np.mean(x), np.var(x))
-        xi_jk_arr_all = np.array(self.xi_jk_arr)
-        xi_im_jk_arr_all = np.array(self.xi_im_jk_arr)
+        xi = np.atleast_2d(xi)
+        xi_im = np.atleast_2d(xi_im)
+        n_b = len(xi)
+        if n_b == 0:
+            return
 
-        for jdx in range(len(self.meanr)):
+        mean_b = np.mean(xi, axis=0, dtype=np.float64)
+        m2_b = np.sum((xi - mean_b) ** 2, axis=0, dtype=np.float64)
+        mean_im_b = np.mean(xi_im, axis=0, dtype=np.float64)
 
-            # The following lines correct xi by the already included weights
-            my_xi = xi_jk_arr_all[:, jdx] / self.weight[jdx]
-            my_xi *= len(my_xi)
+        n_a = self.n_jk
+        n = n_a + n_b
+        delta = mean_b - self.mean_xi_jk
 
-            estimate, bias, stderr, conf_interval = jackknife_stats(
-                my_xi,
-                lambda x: (np.mean(x), np.var(x)),
-            )
-            # std of samples -> std of mean
-            estimate[1] /= len(my_xi)
+        self.mean_xi_jk += delta * n_b / n
+        self.m2_xi_jk += m2_b + delta ** 2 * n_a * n_b / n
+        self.mean_xi_im_jk += (mean_im_b - self.mean_xi_im_jk) * n_b / n
+        self.n_jk = n
+
+    def normalise(self):
+        """Normalise.
+
+        Normalise class content.
+
+        """
+        sw = self.weight
 
-            # Assign Jackknife estimates
-            self.xi_jk[jdx] = estimate[0]
-            self.varxi_jk[jdx] = estimate[1]
+        # Bins without pairs are NaN
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.meanr /= sw
+            self.meanlogr /= sw
+            self.xi /= sw
+            self.xi_im /= sw
 
-            my_xi_im = xi_im_jk_arr_all[:, jdx] / self.weight[jdx]
-            my_xi_im *= len(my_xi_im)
+    def jackknife(self):
+        """Jackknife.
+
+        Compute jackknife mean and standard deviation of number-shear
+        correlation. The delete-one estimates are obtained in closed
+        form from the running moments of the individual correlations.
+        The estimates are NaN for fewer than two correlations.
+
+        """
+        n = self.n_jk
+        if n < 2:
+            # Not defined for fewer than two correlations, e.g. for an
+            # empty sample
+            self.xi_jk[:] = np.nan
+            self.varxi_jk[:] = np.nan
+            self.xi_im_jk[:] = np.nan
+            return
+
+        # Individual correlations xi_i are weighted; the jackknife
+        # samples are x_i = n xi_i / w. The jackknife mean of x is
+        # the sample mean, the bias-corrected jackknife variance
+        # is the unbiased sample variance. The latter is divided by n
+        # to obtain the variance of the mean.
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.xi_jk[:] = n * self.mean_xi_jk / self.weight
+            self.varxi_jk[:] = (
+                n * self.m2_xi_jk / (self.weight ** 2 * (n - 1))
+            )
 
             # Only compute mean; ignore var_jk(xi_im), which is
             # very close to var_jk(xi)
-            estimate, bias, stderr, conf_interval = jackknife_stats(
-                my_xi_im,
-                np.mean,
-            )
-            self.xi_im_jk[jdx] = estimate
+            self.xi_im_jk[:] = n * self.mean_xi_im_jk / self.weight
 
     def set_units_scales(self, sep_units):
 
@@ -261,19 +332,383 @@ class ng_essentials(object):
         # Log-scales: TODO
 
 
-def ng_stack(TreeCorrConfig, all_ng, all_d_ang):
+class NGStack(object):
+    """NG Stack.
+
+    This class stores number-shear correlation pair sums of individual
+    objects in contiguous arrays of shape (n_obj, n_bin). The sums are
+    raw, i.e. weighted and not normalised, as the output of
+    treecorr.NGCorrelation.process_cross before finalize.
+
+    Parameters
+    ----------
+    n_bin : int
+        number of (angular or physical) bins
+    n_obj : int, optional
+        number of objects (rows) to preallocate, default is 0
+    dtype : type, optional
+        storage type, default is ``numpy.float64``; use ``numpy.float32``
+        to halve memory
+    chunk_size : int, optional
+        number of rows by which storage grows, default is 4096
+
+    """
+
+    # Names of pair sums, same as ng_essentials attributes
+    keys = ('meanr', 'meanlogr', 'xi', 'xi_im', 'weight', 'npairs')
+
+    def __init__(self, n_bin, n_obj=0, dtype=np.float64, chunk_size=4096):
+        self._n_bin = n_bin
+        self._n_obj = 0
+        self._dtype = dtype
+        self._chunk_size = chunk_size
+
+        self._data = {}
+        for key in self.keys:
+            self._data[key] = np.zeros((0, n_bin), dtype=dtype)
+
+        self.resize(n_obj)
+
+    def __len__(self):
+        return self._n_obj
+
+    def __getitem__(self, key):
+        return self._data[key][:self._n_obj]
+
+    def __getattr__(self, key):
+        # Pair sums as attributes, e.g. stack.xi
+        if key in NGStack.keys:
+            return self[key]
+        raise AttributeError(key)
+
+    @property
+    def n_bin(self):
+        """Return number of bins."""
+        return self._n_bin
+
+    @property
+    def dtype(self):
+        """Return storage type."""
+        return self._dtype
+
+    @property
+    def nbytes(self):
+        """Return number of bytes of used storage."""
+        return sum(self[key].nbytes for key in self.keys)
+
+    def reserve(self, n_obj):
+        """Reserve.
+
+        Grow storage capacity, in multiples of chunk_size, to hold
+        at least n_obj rows.
+
+        Parameters
+        ----------
+        n_obj : int
+            number of rows
+
+        """
+        capacity = len(self._data['xi'])
+        if n_obj <= capacity:
+            return
+
+        n_chunk = -(-n_obj // self._chunk_size)
+        capacity = max(n_chunk * self._chunk_size, n_obj)
+        for key in self.keys:
+            arr = np.zeros((capacity, self._n_bin), dtype=self._dtype)
+            arr[:self._n_obj] = self._data[key][:self._n_obj]
+            self._data[key] = arr
+
+    def resize(self, n_obj):
+        """Resize.
+
+        Set number of rows. New rows are zero.
+
+        Parameters
+        ----------
+        n_obj : int
+            number of rows
+
+        """
+        self.reserve(n_obj)
+        if n_obj < self._n_obj:
+            for key in self.keys:
+                self._data[key][n_obj:self._n_obj] = 0
+        self._n_obj = n_obj
+
+    def set_row(self, idx, ng):
+        """Set Row.
+
+        Copy raw pair sums of one object.
+
+        Parameters
+        ----------
+        idx : int
+            row index
+        ng : treecorr.NGCorrelation or dict
+            raw (not finalized) correlation of one object
+
+        """
+        for key in self.keys:
+            self._data[key][idx] = _get_sums(ng, key)
+
+    def add_to_rows(self, idx, ng):
+        """Add To Rows.
+
+        Add raw pair sums to existing objects, e.g. from a further
+        chunk of the background sample.
+
+        Parameters
+        ----------
+        idx : int, slice, or numpy.array
+            row index or indices
+        ng : treecorr.NGCorrelation, dict, or NGStack
+            raw (not finalized) correlation(s) with same shape as the
+            selected rows
+
+        """
+        for key in self.keys:
+            self[key][idx] += _get_sums(ng, key)
+
+    def append(self, ng):
+        """Append.
+
+        Append raw pair sums of one or more objects.
+
+        Parameters
+        ----------
+        ng : treecorr.NGCorrelation, dict, or NGStack
+            raw (not finalized) correlation(s); arrays of shape (n_bin)
+            for one object, or (n, n_bin) for n objects
+
+        """
+        n_new = np.atleast_2d(_get_sums(ng, 'xi')).shape[0]
+        start = self._n_obj
+        self.resize(start + n_new)
+        for key in self.keys:
+            self._data[key][start:start + n_new] = _get_sums(ng, key)
+
+    def sum(self, weights=None):
+        """Sum.
+
+        Return sum over objects.
+
+        Parameters
+        ----------
+        weights : numpy.array, optional
+            per-object multiplicative weights, default is ``None``;
+            pair counts are summed over objects with non-zero weight
+
+        Returns
+        -------
+        dict
+            summed pair sums, each of shape (n_bin)
+
+        """
+        sums = {}
+        for key in self.keys:
+            if weights is None:
+                sums[key] = self[key].sum(axis=0, dtype=np.float64)
+            elif key == 'npairs':
+                sums[key] = np.dot(
+                    np.asarray(weights) != 0,
+                    self[key].astype(np.float64),
+                )
+            else:
+                sums[key] = np.dot(weights, self[key].astype(np.float64))
+
+        return sums
+
+    def get_meanr(self):
+        """Get Meanr.
+
+        Return unweighted (normalised) mean scales for each object,
+        zero for bins without pairs.
+
+        Returns
+        -------
+        numpy.array
+            mean scales, shape (n_obj, n_bin)
+
+        """
+        weight = self.weight
+        meanr = np.zeros(weight.shape)
+        np.divide(self.meanr, weight, out=meanr, where=weight > 0)
+
+        return meanr
+
+    def subset(self, idx):
+        """Subset.
+
+        Return stack of selected objects.
+
+        Parameters
+        ----------
+        idx : numpy.array
+            row indices or boolean mask
+
+        Returns
+        -------
+        NGStack
+            selected pair sums
+
+        """
+        new = NGStack(self._n_bin, dtype=self._dtype)
+        new.append({key: self[key][idx] for key in self.keys})
+
+        return new
+
+    @classmethod
+    def concatenate(cls, stacks):
+        """Concatenate.
+
+        Return stack containing the rows of all input stacks.
+
+        Parameters
+        ----------
+        stacks : list
+            NGStack instances with the same number of bins
+
+        Returns
+        -------
+        NGStack
+            concatenated pair sums
+
+        """
+        n_obj = sum(len(stack) for stack in stacks)
+        new = cls(stacks[0].n_bin, dtype=stacks[0].dtype)
+        new.reserve(n_obj)
+        for stack in stacks:
+            new.append(stack)
+
+        return new
+
+
+def _get_sums(ng, key):
+    """Get Sums.
+
+    Return pair sum array from a correlation, dict or NGStack.
+
+    """
+    if isinstance(ng, (dict, NGStack)):
+        return ng[key]
+    return getattr(ng, key)
+
+
+def rebin_physical(stack, r, d_ang_arr):
+    """Rebin Physical.
+
+    Re-bin per-object correlations from angular to physical coordinates.
+
+    Parameters
+    ----------
+    stack : NGStack
+        per-object pair sums on angular coordinates [rad]
+    r : numpy.array
+        physical coordinates
+    d_ang_arr : numpy.array
+        angular diameter distance to all objects, interpreted in
+        same units as r
+
+    Returns
+    -------
+    NGStack
+        per-object pair sums on physical coordinates
+
+    """
+    stack_phys = NGStack(len(r), n_obj=len(stack), dtype=stack.dtype)
+
+    # Original angular x values [rad], unweighted
+    x_all = stack.get_meanr()
+
+    # New x values: transfer from physical [Mpc] to angular [rad]
+    d_ang_arr = np.asarray(d_ang_arr, dtype=float)
+    x_new_all = r[np.newaxis, :] / d_ang_arr[:, np.newaxis]
+
+    # Re-bin all objects to new angular coordinates
+    res = get_interp_batch(
+        x_new_all,
+        x_all,
+        [stack[key] for key in NGStack.keys],
+    )
+    for key, y_new in zip(NGStack.keys, res):
+        stack_phys[key][:] = y_new
+
+    return stack_phys
+
+
+def rebin_physical_sum(stack, r_edges, d_ang_arr):
+    """Rebin Physical Sum.
+
+    Re-bin correlations from (fine) angular to physical coordinates, by
+    adding the pair sums of all angular bins whose mean scale falls into
+    a physical bin. Unlike :func:`rebin_physical`, no pairs are lost if
+    there are more angular than physical bins.
+
+    Parameters
+    ----------
+    stack : NGStack
+        pair sums on angular coordinates [rad], e.g. of redshift slices
+    r_edges : numpy.array
+        logarithmic physical bin edges
+    d_ang_arr : numpy.array
+        angular diameter distance for each row of stack, interpreted in
+        same units as r_edges
+
+    Returns
+    -------
+    NGStack
+        pair sums on physical coordinates
+
+    """
+    n_obj = len(stack)
+    n_new = len(r_edges) - 1
+    stack_phys = NGStack(n_new, n_obj=n_obj, dtype=stack.dtype)
+
+    # Physical scales of angular bins, zero without pairs
+    d_ang_arr = np.asarray(d_ang_arr, dtype=float)
+    r_all = stack.get_meanr() * d_ang_arr[:, np.newaxis]
+
+    # Physical bin index
+    log_r_min = np.log(r_edges[0])
+    bin_size = (np.log(r_edges[-1]) - log_r_min) / n_new
+    with np.errstate(divide='ignore'):
+        kdx = np.floor((np.log(r_all) - log_r_min) / bin_size)
+    valid = (r_all > 0) & (kdx >= 0) & (kdx < n_new)
+
+    rows, jdx = np.nonzero(valid)
+    idx_flat = rows * n_new + kdx[rows, jdx].astype(np.intp)
+    for key in NGStack.keys:
+        stack_phys[key][:] = np.bincount(
+            idx_flat,
+            weights=stack[key][rows, jdx],
+            minlength=n_obj * n_new,
+        ).reshape(n_obj, n_new)
+
+    return stack_phys
+
+
+def ng_stack(TreeCorrConfig, all_ng, all_d_ang, patch=None):
     """NG Stack.
 
-    Stack number-shear correlations.
+    Stack number-shear correlations. If patch labels of the objects are
+    given, the patch jackknife covariance is computed, see
+    :func:`jackknife_cov_patch`. It is returned separately, and its
+    diagonal is set as ``varxi`` of the first output correlation.
 
     Parameters
     ----------
     TreeCorrConfig : dict
         treecorr configuration information
-    all_ng : list
-        individual number-shear correlations
+    all_ng : list or NGStack
+        individual number-shear correlations; list of ng_essentials, or
+        per-object raw pair sums
     all_d_ang : list
-        angular diameter distance to objects from all_ng
+        angular diameter distance to objects from all_ng; if ``None``
+        stack on angular coordinates
+    patch : numpy.array, optional
+        patch index of each object, default is ``None`` (no patch
+        jackknife); requires all_ng to be NGStack
 
     Returns
     -------
@@ -281,6 +716,9 @@ def ng_stack(TreeCorrConfig, all_ng, all_d_ang):
         stacked number-shear correlation
     treecorr.NGCorrelation
         stacked number-shear correlation with Jackknife errors
+    numpy.array
+        patch jackknife covariance, shape (n_bin, n_bin); ``None``
+        without patch
 
     """
     # Initialise combined correlation objects
@@ -288,11 +726,30 @@ def ng_stack(TreeCorrConfig, all_ng, all_d_ang):
     ng_comb_jk = treecorr.NGCorrelation(TreeCorrConfig)
 
     n_bins = len(ng_comb.rnom)
-    sep_units = ng_comb.sep_units
 
     ng_final = ng_essentials(n_bins)
 
-    if all_d_ang is not None:
+    if patch is not None and not isinstance(all_ng, NGStack):
+        raise ValueError('Patch jackknife requires per-object pair sums')
+
+    if isinstance(all_ng, NGStack):
+
+        if all_d_ang is not None:
+
+            # Add up all individual correlations on physical coordinates
+            all_ng = rebin_physical(all_ng, ng_comb.rnom, all_d_ang)
+
+        # Add up all individual correlations
+        ng_final.add_per_lens(all_ng)
+
+        if patch is not None:
+            sums_patch = get_patch_sums(all_ng, patch)
+            ng_final.cov = jackknife_cov_patch(
+                sums_patch['xi'],
+                sums_patch['weight'],
+            )
+
+    elif all_d_ang is not None:
 
         # New x values to interpolate on [Mpc]
         r = ng_comb.rnom
@@ -307,9 +764,180 @@ def ng_stack(TreeCorrConfig, all_ng, all_d_ang):
         for ng in all_ng:
             ng_final.add(ng)
 
+    finalise_stack(ng_final, ng_comb, ng_comb_jk)
+
+    return ng_comb, ng_comb_jk, ng_final.cov
+
+
+def ng_restack(TreeCorrConfig, stack, weights, all_d_ang=None, patch=None):
+    """NG Restack.
+
+    Stack per-object pair sums for several samples at once, e.g. splits
+    in mass or redshift, with per-object weights. All samples are
+    obtained from one weighted reduction over objects, a product of the
+    (n_sample, n_obj) weight matrix with the (n_obj, n_bin) pair sums;
+    pair counts are summed over selected objects without weights.
+    Without patches, and for unit weights, the result is the same as
+    :func:`ng_stack` of each sample. Jackknife estimates of samples
+    with fewer than two objects (or patches) are NaN.
+
+    Parameters
+    ----------
+    TreeCorrConfig : dict
+        treecorr configuration information of the stacked correlations
+    stack : NGStack
+        per-object raw pair sums
+    weights : numpy.array
+        weight of each object in each sample, multiplying the pair
+        sums, shape (n_sample, n_obj); zero for objects not in a sample
+    all_d_ang : numpy.array, optional
+        angular diameter distance to objects; if given, pair sums are
+        re-binned from angular to physical coordinates first, see
+        :func:`rebin_physical`; default is ``None``
+    patch : numpy.array, optional
+        patch index of each object, shape (n_obj) for all samples or
+        (n_sample, n_obj); if given, the patch jackknife covariance is
+        computed for each sample, see :func:`jackknife_cov_patch`;
+        default is ``None``
+
+    Raises
+    ------
+    ValueError
+        if weights or patch indices have wrong shape
+
+    Returns
+    -------
+    list
+        stacked number-shear correlation, stacked number-shear
+        correlation with Jackknife errors (both treecorr.NGCorrelation),
+        and patch jackknife covariance (``None`` without patch), for
+        each sample
+
+    """
+    weights = np.atleast_2d(np.asarray(weights, dtype=np.float64))
+    n_sample, n_obj = weights.shape
+    if n_obj != len(stack):
+        raise ValueError(
+            f'Number of weights {n_obj} different from number of objects'
+            + f' {len(stack)}'
+        )
+
+    if all_d_ang is not None:
+        stack = rebin_physical(
+            stack,
+            treecorr.NGCorrelation(TreeCorrConfig).rnom,
+            all_d_ang,
+        )
+    n_bin = stack.n_bin
+
+    # Weighted sums over objects, shape (n_sample, n_bin). Pair counts
+    # are not weighted, only selected.
+    in_sample = weights != 0
+    sums = {}
+    for key in NGStack.keys:
+        if key == 'npairs':
+            sums[key] = in_sample @ stack[key].astype(np.float64)
+        else:
+            sums[key] = weights @ stack[key].astype(np.float64)
+
+    # Jackknife moments of the weighted individual correlations. The
+    # sum of squares is computed from deviations to the mean, to avoid
+    # cancellation.
+    n_jk = np.count_nonzero(in_sample, axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean_xi = sums['xi'] / n_jk[:, np.newaxis]
+        mean_xi_im = sums['xi_im'] / n_jk[:, np.newaxis]
+    m2_xi = np.zeros((n_sample, n_bin))
+    for jdx in range(n_sample):
+        members = np.where(in_sample[jdx])[0]
+        dxi = (
+            weights[jdx, members, np.newaxis]
+            * stack.xi[members].astype(np.float64)
+            - mean_xi[jdx]
+        )
+        m2_xi[jdx] = np.sum(dxi ** 2, axis=0)
+
+    cov = [None] * n_sample
+    if patch is not None:
+        patch = np.asarray(patch, dtype=np.intp)
+        if patch.ndim == 1:
+            patch = np.broadcast_to(patch, weights.shape)
+        if patch.shape != weights.shape:
+            raise ValueError('Patch indices need same shape as weights')
+
+        # Weighted sums over (sample, patch) pairs
+        n_patch = patch.max() + 1
+        sample_idx, obj_idx = np.nonzero(in_sample)
+        w_patch_mat = sparse.csr_matrix(
+            (
+                weights[sample_idx, obj_idx],
+                (sample_idx * n_patch + patch[sample_idx, obj_idx], obj_idx),
+            ),
+            shape=(n_sample * n_patch, n_obj),
+        )
+        xi_patch = (w_patch_mat @ stack.xi.astype(np.float64)).reshape(
+            n_sample, n_patch, n_bin
+        )
+        w_patch = (w_patch_mat @ stack.weight.astype(np.float64)).reshape(
+            n_sample, n_patch, n_bin
+        )
+        for jdx in range(n_sample):
+            # Patches with objects in this sample
+            occupied = np.bincount(
+                patch[jdx][in_sample[jdx]],
+                minlength=n_patch,
+            ) > 0
+            if np.count_nonzero(occupied) < 2:
+                # Not defined, e.g. for an empty sample
+                cov[jdx] = np.full((n_bin, n_bin), np.nan)
+                continue
+            cov[jdx] = jackknife_cov_patch(
+                xi_patch[jdx][occupied],
+                w_patch[jdx][occupied],
+            )
+
+    results = []
+    for jdx in range(n_sample):
+        ng_final = ng_essentials(n_bin)
+        for key in NGStack.keys:
+            getattr(ng_final, key)[:] = sums[key][jdx]
+        ng_final.n_jk = n_jk[jdx]
+        ng_final.mean_xi_jk[:] = mean_xi[jdx]
+        ng_final.m2_xi_jk[:] = m2_xi[jdx]
+        ng_final.mean_xi_im_jk[:] = mean_xi_im[jdx]
+        ng_final.cov = cov[jdx]
+
+        ng_comb = treecorr.NGCorrelation(TreeCorrConfig)
+        ng_comb_jk = treecorr.NGCorrelation(TreeCorrConfig)
+        finalise_stack(ng_final, ng_comb, ng_comb_jk)
+        results.append((ng_comb, ng_comb_jk, ng_final.cov))
+
+    return results
+
+
+def finalise_stack(ng_final, ng_comb, ng_comb_jk):
+    """Finalise Stack.
+
+    Normalise stacked correlation, compute jackknife mean and
+    variance, and copy results to NGCorrelation instances.
+
+    Parameters
+    ----------
+    ng_final : ng_essentials
+        stacked (sum of) number-shear correlations
+    ng_comb : treecorr.NGCorrelation
+        stacked number-shear correlation, output
+    ng_comb_jk : treecorr.NGCorrelation
+        stacked number-shear correlation with Jackknife errors, output
+
+    """
+    sep_units = ng_comb.sep_units
+
     ng_final.set_units_scales(sep_units)
     ng_final.normalise()
-    ng_final.jackknife(all_ng)
+    ng_final.jackknife()
+    if ng_final.cov is not None:
+        ng_final.varxi[:] = np.diag(ng_final.cov)
 
     # Copy results to NGCorrelation instances
     ng_final.copy_to(ng_comb)
@@ -322,7 +950,587 @@ def ng_stack(TreeCorrConfig, all_ng, all_d_ang):
         )
         this_ng.meanlogr = np.log(this_ng.meanlogr)
 
-    return ng_comb, ng_comb_jk
+
+def get_patch_labels(
+    ra,
+    dec,
+    n_patch,
+    method='kmeans',
+    coord_units='degrees',
+    seed=0,
+):
+    """Get Patch Labels.
+
+    Group objects into sky patches.
+
+    Parameters
+    ----------
+    ra : numpy.array
+        right ascension
+    dec : numpy.array
+        declination
+    n_patch : int
+        number of patches
+    method : str, optional
+        'kmeans' (treecorr k-means on the sphere, default) or 'healpix';
+        for the latter the HEALPix resolution is increased until at
+        least n_patch pixels contain objects, up to nside=8192
+    coord_units : str, optional
+        units of ra and dec, default is 'degrees'
+    seed : int, optional
+        random seed for k-means initialisation, default is 0; the
+        patches are reproducible for a given seed
+
+    Raises
+    ------
+    ValueError
+        if method is invalid, fewer objects than patches, or fewer
+        occupied HEALPix pixels than patches
+
+    Returns
+    -------
+    numpy.array
+        patch index of each object, in 0 .. number of patches - 1
+
+    """
+    if len(ra) < n_patch:
+        raise ValueError(
+            f'Number of objects {len(ra)} smaller than number of'
+            + f' patches {n_patch}'
+        )
+
+    if method == 'kmeans':
+        cat = treecorr.Catalog(
+            ra=ra,
+            dec=dec,
+            ra_units=coord_units,
+            dec_units=coord_units,
+            npatch=n_patch,
+            rng=np.random.RandomState(seed),
+        )
+        return cat.patch
+
+    elif method == 'healpix':
+        fac = treecorr.config.parse_unit(coord_units)
+        ra_deg = np.degrees(np.asarray(ra, dtype=float) * fac)
+        dec_deg = np.degrees(np.asarray(dec, dtype=float) * fac)
+
+        nside = 1
+        while True:
+            ipix = hp.ang2pix(nside, ra_deg, dec_deg, lonlat=True)
+            ipix_occ, patch = np.unique(ipix, return_inverse=True)
+            if len(ipix_occ) >= n_patch:
+                break
+            if nside >= 2 ** 13:
+                raise ValueError(
+                    f'Only {len(ipix_occ)} HEALPix pixels with nside={nside}'
+                    + f' contain objects, fewer than {n_patch} patches'
+                )
+            nside *= 2
+
+        return patch
+
+    else:
+        raise ValueError(f'Invalid patch method {method}')
+
+
+def get_patch_sums(stack, patch):
+    """Get Patch Sums.
+
+    Return sums of per-object pair sums over patches.
+
+    Parameters
+    ----------
+    stack : NGStack
+        per-object pair sums
+    patch : numpy.array
+        patch index of each object
+
+    Returns
+    -------
+    dict
+        pair sums of shape (n_patch, n_bin) for each key of NGStack
+
+    """
+    patch = np.asarray(patch, dtype=np.intp)
+    n_patch = patch.max() + 1
+    n_bin = stack.n_bin
+
+    # Flat (patch, bin) index of each element
+    idx_flat = (patch[:, np.newaxis] * n_bin + np.arange(n_bin)).ravel()
+
+    sums = {}
+    for key in NGStack.keys:
+        sums[key] = np.bincount(
+            idx_flat,
+            weights=stack[key].ravel(),
+            minlength=n_patch * n_bin,
+        ).reshape(n_patch, n_bin)
+
+    return sums
+
+
+def jackknife_cov_patch(xi_patch, w_patch):
+    """Jackknife Cov Patch.
+
+    Compute delete-one patch jackknife covariance of the stacked
+    tangential shear. Cost is O(n_patch n_bin^2), independent of
+    the number of objects.
+
+    Parameters
+    ----------
+    xi_patch : numpy.array
+        weighted tangential shear summed over each patch, shape
+        (n_patch, n_bin)
+    w_patch : numpy.array
+        weights summed over each patch, same shape as xi_patch
+
+    Returns
+    -------
+    numpy.array
+        covariance matrix, shape (n_bin, n_bin)
+
+    """
+    n_patch = len(xi_patch)
+    if n_patch < 2:
+        raise ValueError('Patch jackknife requires at least two patches')
+
+    # Stack with one patch removed
+    xi_del = xi_patch.sum(axis=0) - xi_patch
+    w_del = w_patch.sum(axis=0) - w_patch
+    with np.errstate(divide='ignore', invalid='ignore'):
+        xi_del = xi_del / w_del
+
+    dxi = xi_del - xi_del.mean(axis=0)
+    cov = (n_patch - 1) / n_patch * dxi.T @ dxi
+
+    return cov
+
+
+def write_ng(
+    path,
+    ng_list,
+    ext_names=None,
+    header=None,
+    images=None,
+    precision=None,
+):
+    """Write NG.
+
+    Write number-shear correlations to disk in one pass. Coordinates
+    and metric of correlations which were not computed by treecorr,
+    e.g. stacks, are set to spherical and Euclidean, as required to
+    read the output with ``treecorr.NGCorrelation.read``. For FITS
+    output, table extensions are created from the correlation arrays,
+    see :func:`get_ng_table_hdu`, and written to one file together with
+    header keywords and images, see :func:`read_ng`. ASCII output is
+    written with ``treecorr.NGCorrelation.write``.
+
+    Parameters
+    ----------
+    path : str
+        output path; the file type (FITS or ASCII) is determined from
+        the extension
+    ng_list : list
+        correlations, treecorr.NGCorrelation
+    ext_names : list, optional
+        extension names, default is ``None`` (no name for one
+        correlation, ng_<i> otherwise)
+    header : dict or list, optional
+        additional header keywords, e.g. provenance, for all correlations
+        or a list with one dict per correlation, FITS output only;
+        default is ``None``
+    images : dict, optional
+        additional image extensions with name as key, e.g. covariance
+        matrices, FITS output only; default is ``None``
+    precision : int, optional
+        number of digits of ASCII output, default is ``None`` (treecorr
+        configuration or 4)
+
+    Raises
+    ------
+    ValueError
+        if several correlations or images are given for ASCII output
+
+    """
+    for ng in ng_list:
+        if ng.coords is None:
+            ng.coords = 'spherical'
+        if ng.metric is None:
+            ng.metric = 'Euclidean'
+
+    file_type = treecorr.util.parse_file_type(None, path, output=True)
+    if file_type != 'FITS':
+        if len(ng_list) > 1 or images:
+            raise ValueError(
+                'Several correlations or image extensions require FITS'
+                + ' output'
+            )
+        ng_list[0].write(path, precision=precision)
+        return
+
+    if ext_names is None:
+        if len(ng_list) == 1:
+            ext_names = [None]
+        else:
+            ext_names = [f'ng_{jdx}' for jdx in range(len(ng_list))]
+    if header is None or isinstance(header, dict):
+        header = [header] * len(ng_list)
+
+    hdu_list = fits.HDUList([fits.PrimaryHDU()])
+    for ng, ext_name, this_header in zip(ng_list, ext_names, header):
+        hdu = get_ng_table_hdu(ng, ext_name=ext_name)
+        for key, value in (this_header or {}).items():
+            hdu.header[key] = value
+        hdu_list.append(hdu)
+
+    for ext_name, arr in (images or {}).items():
+        hdu_list.append(fits.ImageHDU(np.asarray(arr), name=ext_name))
+
+    hdu_list.writeto(path, overwrite=True)
+
+
+def get_ng_table_hdu(ng, ext_name=None):
+    """Get NG Table HDU.
+
+    Create FITS table extension of a number-shear correlation, with the
+    columns and header keywords of ``treecorr.NGCorrelation.write``.
+
+    Parameters
+    ----------
+    ng : treecorr.NGCorrelation
+        number-shear correlation
+    ext_name : str, optional
+        extension name, default is ``None``
+
+    Returns
+    -------
+    astropy.io.fits.BinTableHDU
+        correlation table
+
+    """
+    data = {
+        'r_nom': ng.rnom,
+        'meanr': ng.meanr,
+        'meanlogr': ng.meanlogr,
+        'gamT': ng.xi,
+        'gamX': ng.xi_im,
+        'sigma': np.sqrt(ng.varxi),
+        'weight': ng.weight,
+        'npairs': ng.npairs,
+    }
+    columns = [
+        fits.Column(name=name, format='D', array=np.ravel(arr))
+        for name, arr in data.items()
+    ]
+    hdu = fits.BinTableHDU.from_columns(columns, name=ext_name)
+
+    hdu.header['COORDS'] = ng.coords
+    hdu.header['METRIC'] = ng.metric
+    hdu.header['HIERARCH SEP_UNITS'] = ng.sep_units
+    hdu.header['BIN_TYPE'] = ng.bin_type
+
+    return hdu
+
+
+def read_ng(path, TreeCorrConfig, ext=None):
+    """Read NG.
+
+    Read number-shear correlation from a file written by
+    :func:`write_ng` or ``treecorr.NGCorrelation.write``.
+
+    Parameters
+    ----------
+    path : str
+        input path
+    TreeCorrConfig : dict
+        treecorr configuration information, with the same binning as
+        the correlation on input
+    ext : str, optional
+        extension name of FITS input, default is ``None`` (first
+        extension)
+
+    Returns
+    -------
+    treecorr.NGCorrelation
+        number-shear correlation
+
+    """
+    ng = treecorr.NGCorrelation(TreeCorrConfig)
+    if ext is None:
+        ng.read(path)
+        return ng
+
+    data = fits.getdata(path, extname=ext)
+    ng.meanr[:] = data['meanr']
+    ng.meanlogr[:] = data['meanlogr']
+    ng.xi[:] = data['gamT']
+    ng.xi_im[:] = data['gamX']
+    ng.varxi[:] = data['sigma'] ** 2
+    ng.weight[:] = data['weight']
+    ng.npairs[:] = data['npairs']
+
+    return ng
+
+
+def write_ng_store(
+    path,
+    stack,
+    lens_id=None,
+    columns=None,
+    meta=None,
+    chunk_size=65536,
+):
+    """Write NG Store.
+
+    Write per-object pair sums to a compressed NPZ file, in chunks of
+    rows. Each chunk is a separate array (zip member), such that a subset
+    of objects can be read without decompressing the entire file. The
+    file is written to a temporary path first and then renamed.
+
+    Parameters
+    ----------
+    path : str
+        output path
+    stack : NGStack
+        per-object raw pair sums
+    lens_id : numpy.array, optional
+        unique object IDs, default is ``None`` (row index)
+    columns : dict, optional
+        per-object columns, e.g. coordinates, redshift, patch index;
+        default is ``None``
+    meta : dict, optional
+        JSON-serializable information, e.g. binning; default is ``None``
+    chunk_size : int, optional
+        number of rows per chunk, default is 65536
+
+    Raises
+    ------
+    ValueError
+        if lens IDs are not unique, or columns have wrong length
+
+    """
+    n_obj = len(stack)
+    if lens_id is None:
+        lens_id = np.arange(n_obj)
+    lens_id = np.asarray(lens_id)
+    if len(lens_id) != n_obj or len(np.unique(lens_id)) != n_obj:
+        raise ValueError('Lens IDs need to be unique, one per object')
+    columns = columns or {}
+    for name in columns:
+        if len(columns[name]) != n_obj:
+            raise ValueError(f'Column {name} has wrong length')
+
+    info = {
+        'n_obj': n_obj,
+        'n_bin': stack.n_bin,
+        'dtype': np.dtype(stack.dtype).str,
+        'chunk_size': chunk_size,
+        'columns': list(columns),
+        'meta': meta or {},
+    }
+
+    arrays = {'info': np.array(json.dumps(info)), 'lens_id': lens_id}
+    for name in columns:
+        arrays[f'col_{name}'] = np.asarray(columns[name])
+
+    # Per-patch pair sums
+    if 'patch' in columns:
+        sums_patch = get_patch_sums(stack, columns['patch'])
+        for key in NGStack.keys:
+            arrays[f'patch_{key}'] = sums_patch[key]
+
+    path_tmp = f'{path}.tmp'
+    with zipfile.ZipFile(
+        path_tmp,
+        'w',
+        compression=zipfile.ZIP_DEFLATED,
+        allowZip64=True,
+    ) as zip_file:
+        for name, arr in arrays.items():
+            _write_zip_array(zip_file, name, arr)
+        for jdx, start in enumerate(range(0, n_obj, chunk_size)):
+            for key in NGStack.keys:
+                _write_zip_array(
+                    zip_file,
+                    f'{key}_{jdx:06d}',
+                    stack[key][start:start + chunk_size],
+                )
+    os.replace(path_tmp, path)
+
+
+def _write_zip_array(zip_file, name, arr):
+    """Write Zip Array.
+
+    Write array in npy format as member of zip file.
+
+    """
+    with zip_file.open(f'{name}.npy', 'w', force_zip64=True) as f_out:
+        np.lib.format.write_array(f_out, np.asarray(arr), allow_pickle=False)
+
+
+class NGStore(object):
+    """NG Store.
+
+    This class reads per-object pair sums written by
+    :func:`write_ng_store`. Objects are selected by row index or object
+    ID; only chunks containing selected objects are read.
+
+    Parameters
+    ----------
+    path : str
+        input path
+
+    """
+
+    def __init__(self, path):
+        self._npz = np.load(path, allow_pickle=False)
+        info = json.loads(str(self._npz['info']))
+
+        self._n_obj = info['n_obj']
+        self._n_bin = info['n_bin']
+        self._dtype = np.dtype(info['dtype'])
+        self._chunk_size = info['chunk_size']
+        self._column_names = info['columns']
+        self.meta = info['meta']
+
+        self.lens_id = self._npz['lens_id']
+        self._order = None
+
+    def __len__(self):
+        return self._n_obj
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """Close.
+
+        Close input file.
+
+        """
+        self._npz.close()
+
+    @property
+    def n_bin(self):
+        """Return number of bins."""
+        return self._n_bin
+
+    @property
+    def column_names(self):
+        """Return names of per-object columns."""
+        return list(self._column_names)
+
+    def get_column(self, name):
+        """Get Column.
+
+        Return per-object column.
+
+        Parameters
+        ----------
+        name : str
+            column name
+
+        Returns
+        -------
+        numpy.array
+            column values
+
+        """
+        if name not in self._column_names:
+            raise KeyError(f'Column {name} not in store')
+        return self._npz[f'col_{name}']
+
+    def get_patch_sums(self):
+        """Get Patch Sums.
+
+        Return per-patch pair sums, if patch indices were stored.
+
+        Returns
+        -------
+        dict
+            pair sums of shape (n_patch, n_bin) for each key of NGStack,
+            ``None`` if not available
+
+        """
+        if 'patch' not in self._column_names:
+            return None
+        return {key: self._npz[f'patch_{key}'] for key in NGStack.keys}
+
+    def get_index(self, lens_id):
+        """Get Index.
+
+        Return row indices of objects.
+
+        Parameters
+        ----------
+        lens_id : numpy.array
+            object IDs
+
+        Returns
+        -------
+        numpy.array
+            row indices
+
+        Raises
+        ------
+        KeyError
+            if an object ID is not in the store
+
+        """
+        if self._order is None:
+            self._order = np.argsort(self.lens_id, kind='stable')
+        lens_id = np.atleast_1d(lens_id)
+        sorted_id = self.lens_id[self._order]
+        pos = np.searchsorted(sorted_id, lens_id)
+        pos = np.minimum(pos, self._n_obj - 1)
+        found = sorted_id[pos] == lens_id
+        if not np.all(found):
+            raise KeyError(f'Object IDs not in store: {lens_id[~found][:5]}')
+
+        return self._order[pos]
+
+    def read(self, idx=None, lens_id=None):
+        """Read.
+
+        Return pair sums of selected objects, in the order of
+        selection.
+
+        Parameters
+        ----------
+        idx : numpy.array, optional
+            row indices or boolean mask, default is ``None``
+        lens_id : numpy.array, optional
+            object IDs, used if idx is ``None``; default is ``None``
+            (all objects)
+
+        Returns
+        -------
+        NGStack
+            per-object pair sums
+
+        """
+        if idx is None:
+            if lens_id is None:
+                idx = np.arange(self._n_obj)
+            else:
+                idx = self.get_index(lens_id)
+        idx = np.asarray(idx)
+        if idx.dtype == bool:
+            idx = np.where(idx)[0]
+
+        chunks = idx // self._chunk_size
+        stack = NGStack(self._n_bin, n_obj=len(idx), dtype=self._dtype)
+        for jdx in np.unique(chunks):
+            sel = np.where(chunks == jdx)[0]
+            rows = idx[sel] - jdx * self._chunk_size
+            for key in NGStack.keys:
+                stack[key][sel] = self._npz[f'{key}_{jdx:06d}'][rows]
+
+        return stack
 
 
 def get_interp(x_new, x, y):                                                    
@@ -386,3 +1594,89 @@ def get_interp(x_new, x, y):
         y_new[idx_new] = y[idx]                                                 
                                                                                 
     return y_new
+
+
+def get_interp_batch(x_new, x, y_list, n_block=4096):
+    """Get Interp Batch.
+
+    Return values of functions y(x) interpolated to x_new, for many
+    objects at once. Each row is treated as in :func:`get_interp`:
+    values are placed into the nearest new bin, bins with x = 0
+    or out of range are ignored, and later bins overwrite earlier ones
+    if they are placed into the same new bin.
+
+    Parameters
+    ----------
+    x_new : numpy.array
+        new x-values, shape (n_obj, n_new)
+    x : numpy.array
+        existing x-values, shape (n_obj, n_bin)
+    y_list : list
+        existing y-values, each of shape (n_obj, n_bin)
+    n_block : int, optional
+        number of objects processed at once, default is 4096
+
+    Returns
+    -------
+    list
+        new y-values, each of shape (n_obj, n_new)
+
+    """
+    n_obj, n_new = x_new.shape
+    n_bins = x.shape[1]
+
+    y_new_list = [np.zeros(x_new.shape) for _ in y_list]
+
+    # Compute upper limits (assuming logarithmic bins)
+    log_x_upper_new = (
+        np.log(x_new[:, -1]) + np.log(x_new[:, -1]) - np.log(x_new[:, -2])
+    )
+    x_upper_new = np.exp(log_x_upper_new)
+
+    # Original bin indices
+    jdx = np.arange(n_bins)
+
+    for start in range(0, n_obj, n_block):
+        stop = min(start + n_block, n_obj)
+        my_x = x[start:stop]
+        my_x_new = x_new[start:stop]
+
+        # Zero value indicates no data in this bin; skip out of range
+        # values if not first or last bins
+        valid = my_x != 0
+        valid &= ~((jdx != 0) & (my_x < my_x_new[:, :1]))
+        valid &= ~(
+            (jdx != n_bins - 1) & (my_x > x_upper_new[start:stop, None])
+        )
+
+        # Equivalent to searchsorted with side='left', for each row
+        idx_tmp = np.sum(
+            my_x_new[:, np.newaxis, :] < my_x[:, :, np.newaxis],
+            axis=2,
+        )
+        valid &= idx_tmp != n_new
+
+        # Nearest new bin
+        rows = np.arange(stop - start)[:, np.newaxis]
+        idx_lo = np.maximum(idx_tmp - 1, 0)
+        idx_hi = np.minimum(idx_tmp, n_new - 1)
+        closer_lo = (
+            np.fabs(my_x - my_x_new[rows, idx_lo])
+            < np.fabs(my_x - my_x_new[rows, idx_hi])
+        )
+        idx_new = np.where((idx_tmp > 0) & closer_lo, idx_tmp - 1, idx_tmp)
+
+        # Last valid original bin placed into a new bin wins
+        row_v, jdx_v = np.nonzero(valid)
+        idx_flat = row_v * n_new + idx_new[row_v, jdx_v]
+        _, idx_last = np.unique(idx_flat[::-1], return_index=True)
+        keep = len(idx_flat) - 1 - idx_last
+        row_v = row_v[keep]
+        jdx_v = jdx_v[keep]
+        idx_v = idx_new[row_v, jdx_v]
+
+        # Place y values
+        for y, y_new in zip(y_list, y_new_list):
+            y_new[start + row_v, idx_v] = y[start:stop][row_v, jdx_v]
+
+    return y_new_list
@@ -0,0 +1,7 @@
+# -*- coding: utf-8 -*-
+
+"""UNIT TESTS.
+
+Unit testing framework for the package.
+
+"""
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+
+"""UNIT TESTS FOR CATALOGUE MODULE.
+
+This module contains unit tests for the catalogue module.
+
+"""
+
+import os
+import tempfile
+from unittest import TestCase
+
+import numpy as np
+from numpy import testing as npt
+
+from astropy.io import fits
+
+from unions_wl import catalogue
+
+
+class ReadColumnsTestCase(TestCase):
+    """Test case for column-projected catalogue reading."""
+
+    def setUp(self):
+        """Set test parameter values."""
+        self._tmp_dir = tempfile.TemporaryDirectory()
+
+        rng = np.random.default_rng(7)
+        n_row = 100
+        self._data = {
+            'RA': rng.uniform(0, 360, n_row),
+            'DEC': rng.uniform(-90, 90, n_row),
+            'e1': rng.normal(size=n_row).astype(np.float32),
+            'id': np.arange(n_row),
+        }
+        self._path = os.path.join(self._tmp_dir.name, 'cat.fits')
+        fits.BinTableHDU.from_columns([
+            fits.Column('RA', 'D', array=self._data['RA']),
+            fits.Column('DEC', 'D', array=self._data['DEC']),
+            fits.Column('e1', 'E', array=self._data['e1']),
+            fits.Column('id', 'K', array=self._data['id']),
+        ]).writeto(self._path)
+        self._path_csv = os.path.join(self._tmp_dir.name, 'cat.csv')
+        np.savetxt(
+            self._path_csv,
+            np.column_stack([self._data['RA'], self._data['DEC']]),
+            delimiter=',',
+            header='RA,DEC',
+            comments='',
+        )
+
+    def tearDown(self):
+        """Unset test parameter values."""
+        self._tmp_dir.cleanup()
+        self._tmp_dir = None
+        self._data = None
+
+    def test_read_columns(self):
+        """Test ``unions_wl.catalogue.read_columns`` function.
+
+        Only requested columns are provided, and FITS columns are
+        converted to native byte order on first access.
+
+        See Also
+        --------
+        unions_wl.catalogue.read_columns : Implementation of the
+            ``read_columns`` function.
+        unions_wl.catalogue.FitsColumns : Implementation of the
+            ``FitsColumns`` class.
+
+        """
+        dat = catalogue.read_columns(self._path, columns=['RA', 'e1'])
+        npt.assert_equal(list(dat), ['RA', 'e1'])
+        npt.assert_equal(dat.n_row, len(self._data['RA']))
+        with self.assertRaises(KeyError):
+            dat['DEC']
+
+        # Nothing converted before access
+        npt.assert_equal(dat._cache, {})
+        for key in dat:
+            values = dat[key]
+            self.assertTrue(values.dtype.isnative)
+            npt.assert_equal(values, self._data[key])
+            self.assertIs(dat[key], values)
+        dat.close()
+
+        with self.assertRaises(KeyError):
+            catalogue.read_columns(self._path, columns=['RA', 'z'])
+
+        dat = catalogue.read_columns(self._path, native=False)
+        npt.assert_equal(list(dat), ['RA', 'DEC', 'e1', 'id'])
+        self.assertFalse(dat['RA'].dtype.isnative)
+        npt.assert_equal(dat['RA'], self._data['RA'])
+        dat.close()
+
+        dat = catalogue.read_columns(self._path_csv, columns=['DEC'])
+        npt.assert_equal(list(dat), ['DEC'])
+        npt.assert_allclose(dat['DEC'], self._data['DEC'], rtol=1e-15)
+
+    def test_get_typed_column(self):
+        """Test ``unions_wl.catalogue.get_typed_column`` function.
+
+        Convert a non-native column to typed and scaled array.
+
+        See Also
+        --------
+        unions_wl.catalogue.get_typed_column : Implementation of the
+            ``get_typed_column`` function.
+
+        """
+        dat = catalogue.read_columns(self._path, native=False)
+        for factor in (1, -1):
+            values = catalogue.get_typed_column(dat['e1'], factor=factor)
+            self.assertEqual(values.dtype, np.float64)
+            self.assertTrue(values.flags.c_contiguous)
+            npt.assert_equal(values, factor * self._data['e1'])
+        dat.close()
+
+    def test_cache(self):
+        """Test ``unions_wl.catalogue.write_cache`` function.
+
+        Read back cached arrays, add an array to an existing entry, and
+        change the cache key on modification of the input file.
+
+        See Also
+        --------
+        unions_wl.catalogue.get_cache_key : Implementation of the
+            ``get_cache_key`` function.
+        unions_wl.catalogue.write_cache : Implementation of the
+            ``write_cache`` function.
+        unions_wl.catalogue.read_cache : Implementation of the
+            ``read_cache`` function.
+
+        """
+        cache_dir = os.path.join(self._tmp_dir.name, 'cache')
+        key = catalogue.get_cache_key(self._path, columns=['RA'])
+        npt.assert_equal(
+            catalogue.get_cache_key(self._path, columns=['RA']),
+            key,
+        )
+        self.assertNotEqual(
+            catalogue.get_cache_key(self._path, columns=['DEC']),
+            key,
+        )
+        self.assertIsNone(catalogue.read_cache(cache_dir, key, ['RA']))
+
+        catalogue.write_cache(
+            cache_dir,
+            key,
+            {'RA': self._data['RA'], 'w': None},
+        )
+        catalogue.write_cache(cache_dir, key, {'DEC': self._data['DEC']})
+        data = catalogue.read_cache(cache_dir, key, ['RA', 'DEC', 'w'])
+        self.assertIsInstance(data['RA'], np.memmap)
+        npt.assert_equal(data['RA'], self._data['RA'])
+        npt.assert_equal(data['DEC'], self._data['DEC'])
+        self.assertIsNone(data['w'])
+
+        stat = os.stat(self._path)
+        os.utime(
+            self._path,
+            ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000),
+        )
+        self.assertNotEqual(
+            catalogue.get_cache_key(self._path, columns=['RA']),
+            key,
+        )
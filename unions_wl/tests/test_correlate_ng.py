@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+
+"""UNIT TESTS FOR CORRELATE_NG MODULE.
+
+This module contains unit tests for the correlate_ng module.
+
+"""
+
+from unittest import TestCase
+
+import numpy as np
+from numpy import testing as npt
+
+import treecorr
+
+from unions_wl import correlate_ng
+from unions_wl.stack_ng import NGStack
+
+
+class CorrelatePerLensTestCase(TestCase):
+    """Test case for ``correlate_per_lens`` function."""
+
+    def setUp(self):
+        """Set test parameter values."""
+        rng = np.random.default_rng(2)
+        n_bg = 20_000
+        self._ra_bg = rng.uniform(148, 156, n_bg)
+        self._dec_bg = rng.uniform(28, 36, n_bg)
+        self._g1 = rng.normal(0, 0.3, n_bg)
+        self._g2 = rng.normal(0, 0.3, n_bg)
+        self._w_bg = rng.uniform(0.2, 1.5, n_bg)
+
+        n_fg = 5
+        self._ra_fg = rng.uniform(151, 153, n_fg)
+        self._dec_fg = rng.uniform(31, 33, n_fg)
+        self._w_fg = rng.uniform(0.5, 2, n_fg)
+        self._d_ang = rng.uniform(300, 1500, n_fg)
+
+        self._theta_min = 1
+        self._theta_max = 60
+        self._n_theta = 8
+        self._r_min = 0.1
+        self._r_max = 3
+        self._rtol = 1e-5
+
+    def tearDown(self):
+        """Unset test parameter values."""
+        self._ra_bg = None
+        self._dec_bg = None
+        self._g1 = None
+        self._g2 = None
+        self._w_bg = None
+        self._ra_fg = None
+        self._dec_fg = None
+        self._w_fg = None
+        self._d_ang = None
+
+    def test_correlate_per_lens(self):
+        """Test ``unions_wl.correlate_ng.correlate_per_lens`` function.
+
+        Compare the per-object pair sums to brute-force
+        ``treecorr.NGCorrelation.process_cross`` of each object.
+
+        See Also
+        --------
+        unions_wl.correlate_ng.correlate_per_lens : Implementation of the
+            ``correlate_per_lens`` function.
+
+        """
+        tree = correlate_ng.build_tree(self._ra_bg, self._dec_bg)
+        r_edges = correlate_ng.get_log_bins(
+            self._theta_min,
+            self._theta_max,
+            self._n_theta,
+        ) * treecorr.config.parse_unit('arcmin')
+        stack = correlate_ng.correlate_per_lens(
+            tree,
+            self._g1,
+            self._g2,
+            self._w_bg,
+            self._ra_fg,
+            self._dec_fg,
+            self._w_fg,
+            r_edges,
+        )
+
+        self._compare_treecorr(
+            stack,
+            self._theta_min * np.ones(len(self._ra_fg)),
+            self._theta_max * np.ones(len(self._ra_fg)),
+            'arcmin',
+        )
+
+    def test_correlate_per_lens_physical(self):
+        """Test ``unions_wl.correlate_ng.correlate_per_lens`` function.
+
+        Compare the per-object pair sums in physical scales to
+        brute-force ``treecorr.NGCorrelation.process_cross`` of each
+        object, with angular scales set by its distance. Small blocks
+        of objects and pairs are used.
+
+        See Also
+        --------
+        unions_wl.correlate_ng.correlate_per_lens : Implementation of the
+            ``correlate_per_lens`` function.
+
+        """
+        tree = correlate_ng.build_tree(self._ra_bg, self._dec_bg)
+        r_edges = correlate_ng.get_log_bins(
+            self._r_min,
+            self._r_max,
+            self._n_theta,
+        )
+        stack = correlate_ng.correlate_per_lens(
+            tree,
+            self._g1,
+            self._g2,
+            self._w_bg,
+            self._ra_fg,
+            self._dec_fg,
+            self._w_fg,
+            r_edges,
+            scale=self._d_ang,
+            n_block=2,
+            max_pairs=500,
+        )
+        self._compare_treecorr(
+            stack,
+            self._r_min / self._d_ang,
+            self._r_max / self._d_ang,
+            'radians',
+        )
+
+    def _compare_treecorr(self, stack, sep_min, sep_max, sep_units):
+        """Compare per-object pair sums to treecorr.
+
+        Parameters
+        ----------
+        stack : unions_wl.stack_ng.NGStack
+            per-object pair sums
+        sep_min : numpy.array
+            smallest scale of each object
+        sep_max : numpy.array
+            largest scale of each object
+        sep_units : str
+            units of scales
+
+        """
+        cat_bg = treecorr.Catalog(
+            ra=self._ra_bg,
+            dec=self._dec_bg,
+            g1=self._g1,
+            g2=self._g2,
+            w=self._w_bg,
+            ra_units='deg',
+            dec_units='deg',
+        )
+        for idx in range(len(self._ra_fg)):
+            cat_fg = treecorr.Catalog(
+                ra=self._ra_fg[idx:idx + 1],
+                dec=self._dec_fg[idx:idx + 1],
+                w=self._w_fg[idx:idx + 1],
+                ra_units='deg',
+                dec_units='deg',
+            )
+            ng = treecorr.NGCorrelation(
+                min_sep=sep_min[idx],
+                max_sep=sep_max[idx],
+                nbins=self._n_theta,
+                sep_units=sep_units,
+                brute=True,
+            )
+            ng.process_cross(cat_fg, cat_bg)
+            for key in NGStack.keys:
+                expected = getattr(ng, key)
+                npt.assert_allclose(
+                    stack[key][idx],
+                    expected,
+                    rtol=self._rtol,
+                    atol=self._rtol * np.max(np.abs(expected)),
+                    err_msg=f'Incorrect pair sums {key} of object {idx}.',
+                )
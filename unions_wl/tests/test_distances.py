@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+
+"""UNIT TESTS FOR DISTANCES MODULE.
+
+This module contains unit tests for the distances module.
+
+"""
+
+from unittest import TestCase
+
+import numpy as np
+from numpy import testing as npt
+
+from astropy.cosmology import LambdaCDM, Planck18
+
+from cs_util import cosmo as cs_cosmo
+
+from unions_wl import distances
+
+
+class DistanceTableTestCase(TestCase):
+    """Test case for the ``DistanceTable`` class."""
+
+    def setUp(self):
+        """Set test parameter values."""
+        self._z = np.linspace(0.01, 3, 57)
+        self._rtol = 1e-6
+
+    def tearDown(self):
+        """Unset test parameter values."""
+        self._z = None
+
+    def test_distances(self):
+        """Test ``unions_wl.distances.DistanceTable.d_ang`` method.
+
+        Compare interpolated distances to astropy, for flat and
+        curved cosmologies.
+
+        See Also
+        --------
+        unions_wl.distances.DistanceTable : Implementation of the
+            ``DistanceTable`` class.
+
+        """
+        for cosmo in (
+            Planck18,
+            LambdaCDM(H0=70, Om0=0.3, Ode0=0.6),
+            LambdaCDM(H0=70, Om0=0.3, Ode0=0.8),
+        ):
+            table = distances.DistanceTable(cosmo, z_max=3)
+            npt.assert_allclose(
+                table.d_ang(self._z),
+                cosmo.angular_diameter_distance(self._z).value,
+                rtol=self._rtol,
+                err_msg=f'Incorrect d_ang for {cosmo}.',
+            )
+            npt.assert_allclose(
+                table.d_com(self._z),
+                cosmo.comoving_distance(self._z).value,
+                rtol=self._rtol,
+                err_msg=f'Incorrect d_com for {cosmo}.',
+            )
+            npt.assert_allclose(
+                table.d_ang_12(self._z[:-5], self._z[5:]),
+                cosmo.angular_diameter_distance_z1z2(
+                    self._z[:-5],
+                    self._z[5:],
+                ).value,
+                rtol=1e-5,
+                err_msg=f'Incorrect d_ang_12 for {cosmo}.',
+            )
+
+            with self.assertRaises(ValueError):
+                table.d_ang(3.5)
+
+    def test_sigma_crit(self):
+        """Test ``unions_wl.distances.DistanceTable.sigma_crit_m1`` method.
+
+        Compare inverse critical surface mass densities to cs_util.
+
+        See Also
+        --------
+        unions_wl.distances.DistanceTable.sigma_crit_m1 : Implementation
+            of the ``sigma_crit_m1`` method.
+        unions_wl.distances.DistanceTable.sigma_crit_m1_eff :
+            Implementation of the ``sigma_crit_m1_eff`` method.
+
+        """
+        cosmo = cs_cosmo.get_cosmo_default()
+        table = distances.DistanceTable(cosmo, z_max=3)
+
+        z_source = np.linspace(0.05, 2.5, 50)
+        nz_source = np.exp(-((z_source - 0.8) / 0.4) ** 2)
+
+        for z_lens in (0.1, 0.35, 0.7):
+            expected = [
+                1 / cs_cosmo.sigma_crit(z_lens, z, cosmo).value
+                if z > z_lens else 0
+                for z in z_source
+            ]
+            npt.assert_allclose(
+                table.sigma_crit_m1(z_lens, z_source),
+                expected,
+                rtol=1e-5,
+                atol=1e-5 * np.max(expected),
+                err_msg=f'Incorrect Sigma_crit^-1 at z_lens={z_lens}.',
+            )
+            npt.assert_allclose(
+                table.sigma_crit_m1_eff(z_lens, z_source, nz_source),
+                cs_cosmo.sigma_crit_m1_eff(
+                    z_lens,
+                    z_source,
+                    nz_source,
+                    cosmo,
+                ).value,
+                rtol=1e-4,
+                err_msg=f'Incorrect Sigma_crit_eff^-1 at z_lens={z_lens}.',
+            )
+
+    def test_get_distance_table(self):
+        """Test ``unions_wl.distances.get_distance_table`` function.
+
+        Tables are shared for equal cosmologies, extended to larger
+        redshifts, and evicted when least recently used.
+
+        See Also
+        --------
+        unions_wl.distances.get_distance_table : Implementation of the
+            ``get_distance_table`` function.
+
+        """
+        table = distances.get_distance_table(Planck18)
+        self.assertIs(distances.get_distance_table(Planck18), table)
+
+        table_ext = distances.get_distance_table(Planck18, z_max=7)
+        self.assertIsNot(table_ext, table)
+        self.assertGreaterEqual(table_ext.z_max, 7)
+        self.assertIs(distances.get_distance_table(Planck18), table_ext)
+
+        for idx in range(distances.N_TABLE_MAX):
+            distances.get_distance_table(
+                LambdaCDM(H0=70, Om0=0.3 + 0.01 * idx, Ode0=0.7)
+            )
+        self.assertIsNot(distances.get_distance_table(Planck18), table_ext)
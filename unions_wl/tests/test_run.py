@@ -0,0 +1,448 @@
+# -*- coding: utf-8 -*-
+
+"""UNIT TESTS FOR RUN MODULE.
+
+This module contains unit tests for the run module.
+
+"""
+
+import glob
+import os
+import tempfile
+from unittest import TestCase, mock
+
+import numpy as np
+from numpy import testing as npt
+
+from astropy.io import fits
+
+from unions_wl import run, stack_ng
+
+
+class ComputeNGTestCase(TestCase):
+    """Test case for the ``Compute_NG`` class."""
+
+    def setUp(self):
+        """Set test parameter values."""
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self._dir = self._tmp_dir.name
+
+        rng = np.random.default_rng(5)
+        n_fg = 30
+        n_bg = 20000
+        self._path_fg = [
+            os.path.join(self._dir, f'fg_{name}.fits') for name in ('a', 'b')
+        ]
+        for path in self._path_fg:
+            fits.BinTableHDU.from_columns([
+                fits.Column('RA', 'D', array=rng.uniform(150, 154, n_fg)),
+                fits.Column('DEC', 'D', array=rng.uniform(30, 34, n_fg)),
+                fits.Column('z', 'E', array=rng.uniform(0.2, 0.6, n_fg)),
+                fits.Column('w', 'D', array=rng.uniform(0.5, 2, n_fg)),
+                fits.Column('id', 'K', array=rng.permutation(n_fg) + 1),
+            ]).writeto(path)
+        self._path_bg = os.path.join(self._dir, 'bg.fits')
+        fits.BinTableHDU.from_columns([
+            fits.Column('RA', 'D', array=rng.uniform(148, 156, n_bg)),
+            fits.Column('DEC', 'D', array=rng.uniform(28, 36, n_bg)),
+            fits.Column('e1', 'D', array=rng.normal(0, 0.3, n_bg)),
+            fits.Column('e2', 'D', array=rng.normal(0, 0.3, n_bg)),
+            fits.Column('w', 'D', array=rng.uniform(0.2, 1.5, n_bg)),
+        ]).writeto(self._path_bg)
+
+    def tearDown(self):
+        """Unset test parameter values."""
+        self._tmp_dir.cleanup()
+        self._tmp_dir = None
+
+    def _path(self, name):
+        """Return path of a file in the temporary directory."""
+        return os.path.join(self._dir, name)
+
+    def _run(self, **kwargs):
+        """Run ``Compute_NG`` on the test catalogues.
+
+        Parameters
+        ----------
+        kwargs : dict
+            parameters updating the test defaults
+
+        Returns
+        -------
+        unions_wl.run.Compute_NG
+            processing object
+
+        """
+        obj = run.Compute_NG()
+        obj._params.update({
+            'input_path_fg': self._path_fg[0],
+            'input_path_bg': self._path_bg,
+            'key_w_fg': 'w',
+            'key_w_bg': 'w',
+            'theta_min': 1,
+            'theta_max': 60,
+            'n_theta': 6,
+            'n_patch': 3,
+            'patch_method': 'healpix',
+        })
+        obj._params.update(kwargs)
+        obj.run()
+
+        return obj
+
+    def _assert_equal_output(self, path, path_expected, rtol=1e-12):
+        """Assert equal correlation output files."""
+        data = fits.getdata(path)
+        data_expected = fits.getdata(path_expected)
+        for name in data_expected.names:
+            npt.assert_allclose(
+                data[name],
+                data_expected[name],
+                rtol=rtol,
+                atol=1e-300,
+                err_msg=f'Incorrect column {name} in {path}.',
+            )
+
+    def test_chunk_bg(self):
+        """Test chunked reading of the bg catalogue.
+
+        Compare the vectorized stack of bg chunks to a run with the full
+        bg catalogue in memory.
+
+        See Also
+        --------
+        unions_wl.run.Compute_NG.iter_bg : Implementation of the
+            ``iter_bg`` method.
+
+        """
+        for scales, theta_max in (('angular', 60), ('physical', 5)):
+            path_single = self._path(f'single_{scales}.fits')
+            self._run(
+                stack='vectorized',
+                scales=scales,
+                theta_min=0.1 if scales == 'physical' else 1,
+                theta_max=theta_max,
+                out_path=path_single,
+            )
+            path_chunk = self._path(f'chunk_{scales}.fits')
+            self._run(
+                stack='vectorized',
+                scales=scales,
+                theta_min=0.1 if scales == 'physical' else 1,
+                theta_max=theta_max,
+                chunk_size_bg=3000,
+                out_path=path_chunk,
+            )
+            for suffix in ('', '_jk'):
+                self._assert_equal_output(
+                    path_chunk.replace('.fits', f'{suffix}.fits'),
+                    path_single.replace('.fits', f'{suffix}.fits'),
+                    rtol=1e-10,
+                )
+
+        with self.assertRaises(ValueError):
+            self._run(stack='post', chunk_size_bg=3000)
+
+    def test_cache(self):
+        """Test caching of the bg catalogue.
+
+        Compare runs from a new and an existing cache entry to a run
+        without cache. A modified bg catalogue creates a new entry.
+
+        See Also
+        --------
+        unions_wl.run.Compute_NG.get_columns_cached : Implementation of
+            the ``get_columns_cached`` method.
+
+        """
+        cache_dir = self._path('cache')
+        for stack in ('vectorized', 'post'):
+            path_single = self._path(f'single_{stack}.fits')
+            self._run(stack=stack, out_path=path_single)
+            for idx in range(2):
+                path_cache = self._path(f'cache_{stack}_{idx}.fits')
+                self._run(
+                    stack=stack,
+                    cache_dir=cache_dir,
+                    out_path=path_cache,
+                )
+                self._assert_equal_output(path_cache, path_single)
+        entries = os.listdir(cache_dir)
+        npt.assert_equal(len(entries), 1)
+        npt.assert_equal(
+            sorted(os.listdir(os.path.join(cache_dir, entries[0]))),
+            ['dec.npy', 'g1.npy', 'g2.npy', 'ra.npy', 'w.npy', 'xyz.npy'],
+        )
+
+        stat = os.stat(self._path_bg)
+        os.utime(
+            self._path_bg,
+            ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000),
+        )
+        self._run(
+            stack='vectorized',
+            cache_dir=cache_dir,
+            out_path=self._path('cache_modified.fits'),
+        )
+        npt.assert_equal(len(os.listdir(cache_dir)), 2)
+
+    def test_batch(self):
+        """Test batch mode.
+
+        Compare a batch of fg samples to separate runs. The auto stack
+        is rejected in batch mode.
+
+        See Also
+        --------
+        unions_wl.run.Compute_NG.run : Implementation of the ``run``
+            method.
+
+        """
+        for stack in ('post', 'vectorized'):
+            self._run(
+                stack=stack,
+                input_path_fg=','.join(self._path_fg),
+                out_path=self._path(f'batch_{stack}_{{}}.fits'),
+            )
+            for path_fg in self._path_fg:
+                name = os.path.splitext(os.path.basename(path_fg))[0]
+                path_single = self._path(f'single_{stack}_{name}.fits')
+                self._run(
+                    stack=stack,
+                    input_path_fg=path_fg,
+                    out_path=path_single,
+                )
+                for suffix in ('', '_jk'):
+                    self._assert_equal_output(
+                        self._path(f'batch_{stack}_{name}{suffix}.fits'),
+                        path_single.replace('.fits', f'{suffix}.fits'),
+                    )
+
+        with self.assertRaises(ValueError):
+            self._run(stack='auto', input_path_fg=','.join(self._path_fg))
+
+    def test_n_proc(self):
+        """Test process pool of individual fg correlations.
+
+        Compare runs with two processes to serial runs.
+
+        See Also
+        --------
+        unions_wl.run.Compute_NG.correlate_n_fg : Implementation of the
+            ``correlate_n_fg`` method.
+
+        """
+        for stack, scales in (
+            ('post', 'angular'),
+            ('post', 'physical'),
+            ('cross', 'angular'),
+        ):
+            kwargs = {
+                'stack': stack,
+                'scales': scales,
+                'theta_min': 0.1 if scales == 'physical' else 1,
+                'theta_max': 5 if scales == 'physical' else 60,
+                'n_patch': 0,
+            }
+            paths = []
+            for n_proc in (1, 2):
+                paths.append(self._path(f'{stack}_{scales}_{n_proc}.fits'))
+                self._run(n_proc=n_proc, out_path=paths[-1], **kwargs)
+            self._assert_equal_output(paths[1], paths[0], rtol=0)
+
+    def test_shards(self):
+        """Test merging of shards.
+
+        Compare merged lens and sky shards to a single run. Sky shards
+        are rejected for treecorr stacks.
+
+        See Also
+        --------
+        unions_wl.run.Compute_NG.read_shards : Implementation of the
+            ``read_shards`` method.
+
+        """
+        for stack, method in (('post', 'lens'), ('vectorized', 'sky')):
+            path_single = self._path(f'single_{stack}.fits')
+            self._run(stack=stack, out_path=path_single)
+            for idx in range(3):
+                self._run(
+                    stack=stack,
+                    shard=f'{idx}/3',
+                    shard_method=method,
+                    out_path=self._path(f'part_{stack}.fits'),
+                )
+            path_merged = self._path(f'merged_{stack}.fits')
+            self._run(
+                input_path_shards=self._path(f'part_{stack}_shard*of3.npz'),
+                out_path=path_merged,
+            )
+            for suffix in ('', '_jk'):
+                self._assert_equal_output(
+                    path_merged.replace('.fits', f'{suffix}.fits'),
+                    path_single.replace('.fits', f'{suffix}.fits'),
+                )
+
+        with self.assertRaises(ValueError):
+            self._run(stack='post', shard='0/3', shard_method='sky')
+
+    def test_checkpoint(self):
+        """Test resuming from a checkpoint.
+
+        Compare a run resumed after a failure to an uninterrupted run.
+
+        See Also
+        --------
+        unions_wl.run.Compute_NG.write_checkpoint : Implementation of
+            the ``write_checkpoint`` method.
+
+        """
+        path_single = self._path('single.fits')
+        self._run(stack='post', out_path=path_single)
+
+        add_to_rows = stack_ng.NGStack.add_to_rows
+        n_call = [0]
+
+        def add_to_rows_fail(stack, idx, ng):
+            n_call[0] += 1
+            if n_call[0] == 20:
+                raise RuntimeError('Interrupted')
+            return add_to_rows(stack, idx, ng)
+
+        path_resumed = self._path('resumed.fits')
+        kwargs = {
+            'stack': 'post',
+            'out_path': path_resumed,
+            'checkpoint_path': self._path('checkpoint'),
+            'checkpoint_interval': 7,
+        }
+        with mock.patch.object(
+            stack_ng.NGStack,
+            'add_to_rows',
+            add_to_rows_fail,
+        ):
+            with self.assertRaises(RuntimeError):
+                self._run(**kwargs)
+        self.assertTrue(os.path.exists(self._path('checkpoint.json')))
+
+        self._run(**kwargs)
+        self._assert_equal_output(path_resumed, path_single)
+        npt.assert_equal(glob.glob(self._path('checkpoint*')), [])
+
+        with self.assertRaises(ValueError):
+            self._run(
+                stack='vectorized',
+                checkpoint_path=kwargs['checkpoint_path'],
+            )
+
+    def test_slices(self):
+        """Test redshift slices.
+
+        Compare pair counts and weights of slices on physical scales to
+        the vectorized stack, which bins each object exactly. No
+        jackknife output is written for slices.
+
+        See Also
+        --------
+        unions_wl.run.Compute_NG.correlate_slices : Implementation of
+            the ``correlate_slices`` method.
+
+        """
+        kwargs = {
+            'scales': 'physical',
+            'theta_min': 0.1,
+            'theta_max': 5,
+            'n_patch': 0,
+        }
+        path_exact = self._path('exact.fits')
+        self._run(stack='vectorized', out_path=path_exact, **kwargs)
+        path_slices = self._path('slices.fits')
+        self._run(
+            stack='post',
+            dz_slice=0.005,
+            out_path=path_slices,
+            **kwargs,
+        )
+
+        data = fits.getdata(path_slices)
+        data_exact = fits.getdata(path_exact)
+        for key in ('npairs', 'weight'):
+            npt.assert_allclose(
+                data[key],
+                data_exact[key],
+                rtol=0.02,
+                err_msg=f'Incorrect {key} of redshift slices.',
+            )
+        self.assertFalse(os.path.exists(self._path('slices_jk.fits')))
+
+        kwargs['n_patch'] = 3
+        with self.assertRaises(ValueError):
+            self._run(stack='post', dz_slice=0.005, **kwargs)
+
+    def test_store_restack(self):
+        """Test restacking of a per-object store.
+
+        Compare restacked correlations of the stored sample to the
+        original run, and of labelled subsamples to runs of these
+        subsamples. The stored pair sums include the fg weights, which
+        are therefore not applied again.
+
+        See Also
+        --------
+        unions_wl.run.Compute_NG.restack_store : Implementation of the
+            ``restack_store`` method.
+
+        """
+        path_store = self._path('store.npz')
+        path_single = self._path('single.fits')
+        self._run(
+            stack='vectorized',
+            key_id_fg='id',
+            out_path=path_single,
+            out_path_store=path_store,
+        )
+        path_restack = self._path('restack.fits')
+        self._run(
+            input_path_store=path_store,
+            key_id_fg='id',
+            key_w_fg=None,
+            out_path=path_restack,
+        )
+        for suffix in ('', '_jk'):
+            self._assert_equal_output(
+                path_restack.replace('.fits', f'{suffix}.fits'),
+                path_single.replace('.fits', f'{suffix}.fits'),
+            )
+
+        # Re-stack by label, compared to runs of each labelled sample
+        path_fg = self._path('fg_label.fits')
+        with fits.open(self._path_fg[0]) as hdu_list:
+            data = hdu_list[1].data
+            label = np.arange(len(data)) % 2
+            columns = hdu_list[1].columns + fits.ColDefs([
+                fits.Column('label', 'K', array=label),
+            ])
+            fits.BinTableHDU.from_columns(columns).writeto(path_fg)
+            for idx in range(2):
+                fits.BinTableHDU(data[label == idx]).writeto(
+                    self._path(f'fg_{idx}.fits')
+                )
+        self._run(
+            input_path_store=path_store,
+            input_path_fg=path_fg,
+            key_id_fg='id',
+            key_label_fg='label',
+            key_w_fg=None,
+            out_path=self._path('restack_{}.fits'),
+        )
+        for idx in range(2):
+            path_single = self._path(f'single_{idx}.fits')
+            self._run(
+                stack='vectorized',
+                input_path_fg=self._path(f'fg_{idx}.fits'),
+                out_path=path_single,
+            )
+            self._assert_equal_output(
+                self._path(f'restack_{idx}.fits'),
+                path_single,
+            )
@@ -0,0 +1,391 @@
+# -*- coding: utf-8 -*-
+
+"""UNIT TESTS FOR STACK_NG MODULE.
+
+This module contains unit tests for the stack_ng module.
+
+"""
+
+import os
+import tempfile
+from unittest import TestCase
+
+import numpy as np
+from numpy import testing as npt
+
+from astropy.io import fits
+from astropy.stats import jackknife_stats
+
+import treecorr
+
+from unions_wl import stack_ng
+
+
+class InterpTestCase(TestCase):
+    """Test case for interpolation functions."""
+
+    def setUp(self):
+        """Set test parameter values."""
+        rng = np.random.default_rng(3)
+        n_obj = 20
+        n_bin = 10
+        self._x = np.sort(
+            np.exp(rng.uniform(-2, 3, (n_obj, n_bin))),
+            axis=1,
+        )
+        self._x[0, 3] = 0
+        self._x_new = np.exp(np.linspace(-1.5, 2.5, 6))[np.newaxis] * (
+            rng.uniform(0.8, 1.2, (n_obj, 1))
+        )
+        self._y = rng.normal(size=(n_obj, n_bin))
+
+    def tearDown(self):
+        """Unset test parameter values."""
+        self._x = None
+        self._x_new = None
+        self._y = None
+
+    def test_get_interp_batch(self):
+        """Test ``unions_wl.stack_ng.get_interp_batch`` function.
+
+        Compare to :func:`unions_wl.stack_ng.get_interp` of each object.
+
+        See Also
+        --------
+        unions_wl.stack_ng.get_interp_batch : Implementation of the
+            ``get_interp_batch`` function.
+
+        """
+        y_new, = stack_ng.get_interp_batch(
+            self._x_new,
+            self._x,
+            [self._y],
+            n_block=7,
+        )
+        for idx in range(len(self._x)):
+            npt.assert_equal(
+                y_new[idx],
+                stack_ng.get_interp(self._x_new[idx], self._x[idx], self._y[idx]),
+                err_msg=f'Incorrect interpolation of object {idx}.',
+            )
+
+
+class StackTestCase(TestCase):
+    """Test case for stacking functions."""
+
+    def setUp(self):
+        """Set test parameter values."""
+        rng = np.random.default_rng(4)
+        self._n_obj = 50
+        self._n_bin = 6
+        self._stack = stack_ng.NGStack(self._n_bin, n_obj=self._n_obj)
+        for key in stack_ng.NGStack.keys:
+            self._stack[key][:] = rng.uniform(1, 2, (self._n_obj, self._n_bin))
+        self._stack.xi[:] = rng.normal(0, 1, (self._n_obj, self._n_bin))
+        self._config = {
+            'min_sep': 1,
+            'max_sep': 60,
+            'nbins': self._n_bin,
+            'sep_units': 'arcmin',
+        }
+        self._patch = rng.integers(0, 5, self._n_obj)
+        self._in_sample = rng.uniform(size=(2, self._n_obj)) < 0.6
+
+    def tearDown(self):
+        """Unset test parameter values."""
+        self._stack = None
+        self._config = None
+        self._patch = None
+        self._in_sample = None
+
+    def test_jackknife(self):
+        """Test ``unions_wl.stack_ng.ng_essentials.jackknife`` method.
+
+        Compare closed-form delete-one jackknife to astropy.
+
+        See Also
+        --------
+        unions_wl.stack_ng.ng_essentials.jackknife : Implementation of
+            the ``jackknife`` method.
+
+        """
+        _, ng_jk, _ = stack_ng.ng_stack(self._config, self._stack, None)
+
+        weight = self._stack.weight.sum(axis=0)
+        for jdx in range(self._n_bin):
+            x = self._stack.xi[:, jdx] / weight[jdx] * self._n_obj
+            estimate, _, _, _ = jackknife_stats(
+                x,
+                lambda x: (np.mean(x), np.var(x)),
+            )
+            npt.assert_allclose(
+                ng_jk.xi[jdx],
+                estimate[0],
+                rtol=1e-10,
+                err_msg='Incorrect jackknife mean.',
+            )
+            npt.assert_allclose(
+                ng_jk.varxi[jdx],
+                estimate[1] / self._n_obj,
+                rtol=1e-10,
+                err_msg='Incorrect jackknife variance.',
+            )
+
+    def test_patch_cov(self):
+        """Test ``unions_wl.stack_ng.jackknife_cov_patch`` function.
+
+        Compare the patch jackknife covariance of a stack to the
+        covariance of stacks with one patch removed.
+
+        See Also
+        --------
+        unions_wl.stack_ng.jackknife_cov_patch : Implementation of the
+            ``jackknife_cov_patch`` function.
+
+        """
+        ng, _, cov_patch = stack_ng.ng_stack(
+            self._config,
+            self._stack,
+            None,
+            patch=self._patch,
+        )
+
+        n_patch = self._patch.max() + 1
+        xi_del = np.empty((n_patch, self._n_bin))
+        for idx in range(n_patch):
+            ng_del, _, _ = stack_ng.ng_stack(
+                self._config,
+                self._stack.subset(np.where(self._patch != idx)[0]),
+                None,
+            )
+            xi_del[idx] = ng_del.xi
+        cov = np.cov(xi_del, rowvar=False, bias=True) * (n_patch - 1)
+
+        npt.assert_allclose(
+            cov_patch,
+            cov,
+            rtol=1e-10,
+            err_msg='Incorrect patch jackknife covariance.',
+        )
+        npt.assert_allclose(ng.varxi, np.diag(cov), rtol=1e-10)
+
+    def test_get_patch_labels(self):
+        """Test ``unions_wl.stack_ng.get_patch_labels`` function.
+
+        K-means patches are reproducible for a given seed. HEALPix
+        patches are at least the requested number of occupied pixels.
+
+        See Also
+        --------
+        unions_wl.stack_ng.get_patch_labels : Implementation of the
+            ``get_patch_labels`` function.
+
+        """
+        rng = np.random.default_rng(6)
+        ra = rng.uniform(148, 156, 2000)
+        dec = rng.uniform(28, 36, 2000)
+
+        patch = stack_ng.get_patch_labels(ra, dec, 4, seed=1)
+        npt.assert_equal(
+            stack_ng.get_patch_labels(ra, dec, 4, seed=1),
+            patch,
+            err_msg='K-means patches not reproducible.',
+        )
+        npt.assert_equal(np.unique(patch), np.arange(4))
+
+        patch = stack_ng.get_patch_labels(ra, dec, 4, method='healpix')
+        n_patch = patch.max() + 1
+        self.assertGreaterEqual(n_patch, 4)
+        npt.assert_equal(np.unique(patch), np.arange(n_patch))
+
+        with self.assertRaises(ValueError):
+            stack_ng.get_patch_labels(ra, dec, 4, method='invalid')
+
+    def test_rebin_physical_sum(self):
+        """Test ``unions_wl.stack_ng.rebin_physical_sum`` function.
+
+        Compare to the sum over angular bins with mean physical scale in
+        each physical bin.
+
+        See Also
+        --------
+        unions_wl.stack_ng.rebin_physical_sum : Implementation of the
+            ``rebin_physical_sum`` function.
+
+        """
+        rng = np.random.default_rng(8)
+        d_ang = rng.uniform(500, 1500, self._n_obj)
+        r_edges = np.geomspace(0.1, 5, 4)
+        theta = np.geomspace(2e-5, 1e-2, self._n_bin)
+        self._stack.meanr[:] = theta * self._stack.weight
+        self._stack.weight[:, 2] = 0
+
+        stack_phys = stack_ng.rebin_physical_sum(self._stack, r_edges, d_ang)
+
+        for idx in range(self._n_obj):
+            r = theta * d_ang[idx]
+            for kdx in range(len(r_edges) - 1):
+                in_bin = (
+                    (r >= r_edges[kdx]) & (r < r_edges[kdx + 1])
+                    & (self._stack.weight[idx] > 0)
+                )
+                for key in stack_ng.NGStack.keys:
+                    npt.assert_allclose(
+                        stack_phys[key][idx, kdx],
+                        self._stack[key][idx, in_bin].sum(),
+                        rtol=1e-12,
+                        err_msg=f'Incorrect {key} of object {idx}.',
+                    )
+
+    def test_write_read_ng(self):
+        """Test ``unions_wl.stack_ng.write_ng`` function.
+
+        Read back correlations, header keywords and images of a
+        multi-extension file.
+
+        See Also
+        --------
+        unions_wl.stack_ng.write_ng : Implementation of the
+            ``write_ng`` function.
+        unions_wl.stack_ng.read_ng : Implementation of the
+            ``read_ng`` function.
+
+        """
+        ng, ng_jk, cov = stack_ng.ng_stack(
+            self._config,
+            self._stack,
+            None,
+            patch=self._patch,
+        )
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'ng.fits')
+            stack_ng.write_ng(
+                path,
+                [ng, ng_jk],
+                ext_names=['a', 'a_jk'],
+                header={'SAMPLE': 'a'},
+                images={'a_cov': cov},
+            )
+            for ext, ng_expected in ((None, ng), ('a_jk', ng_jk)):
+                ng_read = stack_ng.read_ng(path, self._config, ext=ext)
+                for key in ('meanr', 'xi', 'xi_im', 'varxi', 'weight'):
+                    npt.assert_allclose(
+                        getattr(ng_read, key),
+                        getattr(ng_expected, key),
+                        rtol=1e-12,
+                        err_msg=f'Incorrect {key} of extension {ext}.',
+                    )
+
+            ng_read = treecorr.NGCorrelation(self._config)
+            ng_read.read(path)
+            npt.assert_allclose(ng_read.xi, ng.xi, rtol=1e-12)
+            npt.assert_equal(ng_read.coords, 'spherical')
+
+            with fits.open(path) as hdu_list:
+                npt.assert_equal(hdu_list['a_jk'].header['SAMPLE'], 'a')
+                npt.assert_allclose(
+                    hdu_list['a_cov'].data,
+                    cov,
+                    rtol=1e-12,
+                    err_msg='Incorrect covariance image.',
+                )
+
+    def test_ng_store(self):
+        """Test ``unions_wl.stack_ng.NGStore`` class.
+
+        Read back a subset of pair sums by ID and columns from a store.
+
+        See Also
+        --------
+        unions_wl.stack_ng.write_ng_store : Implementation of the
+            ``write_ng_store`` function.
+        unions_wl.stack_ng.NGStore : Implementation of the ``NGStore``
+            class.
+
+        """
+        lens_id = np.arange(self._n_obj) * 3 + 7
+        idx = np.array([4, 0, 17, 33])
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'store.npz')
+            stack_ng.write_ng_store(
+                path,
+                self._stack,
+                lens_id=lens_id,
+                columns={'patch': self._patch},
+                meta={'n_bin': self._n_bin},
+                chunk_size=16,
+            )
+            with stack_ng.NGStore(path) as store:
+                npt.assert_equal(len(store), self._n_obj)
+                npt.assert_equal(store.meta['n_bin'], self._n_bin)
+                npt.assert_equal(store.get_column('patch'), self._patch)
+                subset = store.read(lens_id=lens_id[idx])
+
+        for key in stack_ng.NGStack.keys:
+            npt.assert_equal(
+                subset[key],
+                self._stack[key][idx],
+                err_msg=f'Incorrect pair sums {key} from store.',
+            )
+
+    def test_ng_restack(self):
+        """Test ``unions_wl.stack_ng.ng_restack`` function.
+
+        Compare weighted stacks of two samples to :func:`ng_stack` of
+        each sample.
+
+        See Also
+        --------
+        unions_wl.stack_ng.ng_restack : Implementation of the
+            ``ng_restack`` function.
+
+        """
+        results = stack_ng.ng_restack(
+            self._config,
+            self._stack,
+            self._in_sample.astype(float),
+            patch=self._patch,
+        )
+        for jdx, in_sample in enumerate(self._in_sample):
+            expected = stack_ng.ng_stack(
+                self._config,
+                self._stack.subset(np.where(in_sample)[0]),
+                None,
+                patch=self._patch[in_sample],
+            )
+            for ng, ng_expected in zip(results[jdx][:2], expected[:2]):
+                for key in ('meanr', 'xi', 'xi_im', 'varxi', 'weight'):
+                    npt.assert_allclose(
+                        getattr(ng, key),
+                        getattr(ng_expected, key),
+                        rtol=1e-10,
+                        err_msg=f'Incorrect {key} of sample {jdx}.',
+                    )
+            npt.assert_allclose(
+                results[jdx][2],
+                expected[2],
+                rtol=1e-10,
+                err_msg=f'Incorrect covariance of sample {jdx}.',
+            )
+
+    def test_ng_restack_weights(self):
+        """Test ``unions_wl.stack_ng.ng_restack`` function.
+
+        Constant weights do not change the stack and pair counts; an
+        empty sample gives NaN.
+
+        See Also
+        --------
+        unions_wl.stack_ng.ng_restack : Implementation of the
+            ``ng_restack`` function.
+
+        """
+        weights = np.zeros((3, self._n_obj))
+        weights[0] = 1
+        weights[1] = 2.5
+        results = stack_ng.ng_restack(self._config, self._stack, weights)
+        (ng_1, ng_jk_1, _), (ng_2, ng_jk_2, _), (ng_0, _, _) = results
+        npt.assert_allclose(ng_2.xi, ng_1.xi, rtol=1e-12)
+        npt.assert_allclose(ng_jk_2.varxi, ng_jk_1.varxi, rtol=1e-12)
+        npt.assert_equal(ng_2.npairs, ng_1.npairs)
+        npt.assert_equal(np.isnan(ng_0.xi), True)
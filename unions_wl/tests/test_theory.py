@@ -0,0 +1,481 @@
+# -*- coding: utf-8 -*-
+
+"""UNIT TESTS FOR THEORY MODULE.
+
+This module contains unit tests for the theory module.
+
+"""
+
+import os
+import tempfile
+from unittest import TestCase, skipIf
+
+import numpy as np
+from numpy import testing as npt
+
+try:
+    import pyccl as ccl
+    import pyccl.nl_pt as pt
+
+    from unions_wl import theory
+except ImportError:
+    theory = None
+
+
+@skipIf(theory is None, 'theory module requires pyccl')
+class CacheTestCase(TestCase):
+    """Test case for the cache of the ``theory`` module."""
+
+    def setUp(self):
+        """Set test parameter values."""
+        theory.clear_cache()
+        self._n_create = {}
+
+    def tearDown(self):
+        """Unset test parameter values."""
+        theory.clear_cache()
+        self._n_create = None
+
+    def _get(self, key):
+        """Return cached object, and count the creations of each key."""
+        def create():
+            self._n_create[key] = self._n_create.get(key, 0) + 1
+            return [key]
+
+        return theory.get_cached((key,), create)
+
+    def test_get_cached(self):
+        """Test ``unions_wl.theory.get_cached`` function.
+
+        Objects are created once and returned from the cache on
+        subsequent calls. When the cache is full, the least recently
+        used object is removed.
+
+        See Also
+        --------
+        unions_wl.theory.get_cached : Implementation of the
+            ``get_cached`` function.
+
+        """
+        n_max = theory.N_CACHE_MAX
+
+        obj = self._get(0)
+        self.assertIs(self._get(0), obj, 'Object not returned from cache.')
+        npt.assert_equal(self._n_create[0], 1)
+
+        # Fill cache, with key 0 used again after key 1
+        for key in range(1, n_max):
+            self._get(key)
+        self._get(0)
+
+        # Adding one more key removes the least recently used key 1
+        self._get(n_max)
+        npt.assert_equal(len(theory._cache), n_max)
+        self._get(0)
+        npt.assert_equal(self._n_create[0], 1, err_msg='Key 0 evicted.')
+        self._get(1)
+        npt.assert_equal(self._n_create[1], 2, err_msg='Key 1 not evicted.')
+
+    def test_get_array_key(self):
+        """Test ``unions_wl.theory.get_array_key`` function.
+
+        Keys only depend on the array values and their grouping.
+
+        See Also
+        --------
+        unions_wl.theory.get_array_key : Implementation of the
+            ``get_array_key`` function.
+
+        """
+        x = np.linspace(0, 1, 5)
+        y = np.arange(3)
+
+        npt.assert_equal(
+            theory.get_array_key(x, y),
+            theory.get_array_key(list(x), y.astype(np.float32)),
+        )
+        self.assertNotEqual(
+            theory.get_array_key(x, y),
+            theory.get_array_key(x, y + 1),
+        )
+        self.assertNotEqual(
+            theory.get_array_key(x, None, y),
+            theory.get_array_key(x, y),
+        )
+
+
+@skipIf(theory is None, 'theory module requires pyccl')
+class EllGridTestCase(TestCase):
+    """Test case for the adaptive grid of 2D Fourier modes."""
+
+    def setUp(self):
+        """Set test parameter values."""
+        theory.clear_cache()
+        self._theta_deg = np.geomspace(0.02, 2, 10)
+        self._ell_tol = 1e-3
+        self._n_ell = []
+
+    def tearDown(self):
+        """Unset test parameter values."""
+        theory.clear_cache()
+        self._theta_deg = None
+        self._ell_tol = None
+        self._n_ell = None
+
+    def _get_cls(self, ell, amplitude=1):
+        """Return power-law spectrum with a feature, count the modes."""
+        self._n_ell.append(len(ell))
+        return (
+            amplitude * 1e-5 * (ell / 100) ** -1.2
+            / (1 + (ell / 3000) ** 1.5)
+            * (1 + 0.5 * np.exp(-np.log(ell / 500) ** 2 / 0.02))
+        )
+
+    def _get_gt(self, ell, cls):
+        """Return tangential shear."""
+        return theory.correlation_ng_fftlog(
+            ell,
+            cls[np.newaxis],
+            self._theta_deg[np.newaxis],
+        )[0]
+
+    def test_get_angular_cl(self):
+        """Test ``unions_wl.theory.get_angular_cl`` function.
+
+        Compare the tangential shear from the adaptive grid to the
+        dense grid. The number of modes is cached, and reused for a
+        different amplitude of the spectrum.
+
+        See Also
+        --------
+        unions_wl.theory.get_angular_cl : Implementation of the
+            ``get_angular_cl`` function.
+
+        """
+        ell_dense = theory.get_ell_dense()
+        gt_dense = self._get_gt(ell_dense, self._get_cls(ell_dense))
+
+        self._n_ell = []
+        ell, cls = theory.get_angular_cl(
+            self._get_cls,
+            self._get_gt,
+            'auto',
+            ell_tol=self._ell_tol,
+            key=('test',),
+        )
+        npt.assert_equal(ell, ell_dense)
+        n_ell = sum(self._n_ell)
+        self.assertGreater(n_ell, theory.N_ELL_MIN, 'Grid not refined.')
+        npt.assert_allclose(
+            self._get_gt(ell, cls),
+            gt_dense,
+            rtol=0,
+            atol=self._ell_tol * np.max(np.abs(gt_dense)),
+            err_msg='Adaptive grid exceeds tolerance.',
+        )
+
+        # Cached number of modes, spectrum only computed on the nodes
+        self._n_ell = []
+        _, cls_2 = theory.get_angular_cl(
+            lambda ell: self._get_cls(ell, amplitude=2),
+            self._get_gt,
+            'auto',
+            ell_tol=self._ell_tol,
+            key=('test',),
+        )
+        npt.assert_equal(self._n_ell, [n_ell])
+        npt.assert_allclose(cls_2, 2 * cls, rtol=1e-10)
+
+        with self.assertRaises(ValueError):
+            theory.get_angular_cl(self._get_cls, self._get_gt, 'dense')
+
+
+@skipIf(theory is None, 'theory module requires pyccl')
+class GammaTTestCase(TestCase):
+    """Test case for the tangential shear predictions."""
+
+    def setUp(self):
+        """Set test parameter values."""
+        theory.clear_cache()
+        self._cosmo = ccl.Cosmology(
+            Omega_c=0.27,
+            Omega_b=0.045,
+            h=0.67,
+            sigma8=0.83,
+            n_s=0.96,
+        )
+        z_lens = np.linspace(0.2, 0.5, 30)
+        z_source = np.linspace(0.01, 1.5, 60)
+        self._dndz_lens = (z_lens, np.exp(-((z_lens - 0.35) / 0.05) ** 2))
+        self._dndz_source = (
+            z_source,
+            np.exp(-((z_source - 0.8) / 0.3) ** 2),
+        )
+        self._theta_deg = np.geomspace(0.02, 2, 8)
+        self._ell = np.geomspace(2, 99_999, 1025)
+
+    def tearDown(self):
+        """Unset test parameter values."""
+        theory.clear_cache()
+        self._cosmo = None
+        self._dndz_lens = None
+        self._dndz_source = None
+        self._theta_deg = None
+        self._ell = None
+
+    def test_linear_bias_template(self):
+        """Test ``unions_wl.theory.gamma_t_theo`` function.
+
+        The linear-bias prediction, a cached unit-bias template times
+        the bias, is compared to the projection of the galaxy-matter
+        power spectrum with that bias. A change of bias does not add
+        objects to the cache.
+
+        See Also
+        --------
+        unions_wl.theory.gamma_t_theo : Implementation of the
+            ``gamma_t_theo`` function.
+
+        """
+        for bias_1 in (1.0, 1.7):
+            gt, _, cls_gG = theory.gamma_t_theo(
+                self._theta_deg,
+                self._cosmo,
+                self._dndz_lens,
+                self._dndz_source,
+                {'model_type': 'linear_bias', 'bias_1': bias_1},
+                ell=self._ell,
+            )
+            if bias_1 == 1:
+                n_cache = len(theory._cache)
+
+            pk_gm = pt.get_pt_pk2d(
+                self._cosmo,
+                pt.PTNumberCountsTracer(b1=bias_1),
+                tracer2=pt.PTMatterTracer(),
+                ptc=theory.get_pt_calculator(),
+            )
+            gt_direct, _, cls_gG_direct = theory._gamma_t_theo(
+                self._theta_deg,
+                self._cosmo,
+                self._dndz_lens,
+                self._dndz_source,
+                pk_gm,
+                self._ell,
+                'FFTlog',
+            )
+            npt.assert_allclose(
+                cls_gG,
+                cls_gG_direct,
+                rtol=1e-6,
+                err_msg=f'Incorrect C_ell for bias {bias_1}.',
+            )
+            npt.assert_allclose(
+                gt,
+                gt_direct,
+                rtol=1e-6,
+                err_msg=f'Incorrect gamma_t for bias {bias_1}.',
+            )
+
+        npt.assert_equal(len(theory._cache), n_cache)
+
+    def test_correlation_ng_fftlog(self):
+        """Test ``unions_wl.theory.correlation_ng_fftlog`` function.
+
+        Compare to the analytical Hankel transform of
+        C(ell) = ell^2 exp(-ell^2 / (2 ell_0^2)), which is
+        gamma_t(theta) = theta^2 ell_0^6 exp(-theta^2 ell_0^2 / 2) / (2 pi).
+
+        See Also
+        --------
+        unions_wl.theory.correlation_ng_fftlog : Implementation of the
+            ``correlation_ng_fftlog`` function.
+
+        """
+        ell_0 = 1000
+        ell = theory.get_ell_dense()
+        cls = ell ** 2 * np.exp(-ell ** 2 / (2 * ell_0 ** 2))
+        theta_rad = np.deg2rad(self._theta_deg)
+        gt_exp = (
+            theta_rad ** 2 * ell_0 ** 6
+            * np.exp(-theta_rad ** 2 * ell_0 ** 2 / 2) / (2 * np.pi)
+        )
+
+        gt = theory.correlation_ng_fftlog(
+            ell,
+            np.array([cls, 2 * cls]),
+            np.array([self._theta_deg, self._theta_deg]),
+        )
+        for idx, factor in enumerate((1, 2)):
+            npt.assert_allclose(
+                gt[idx],
+                factor * gt_exp,
+                rtol=0,
+                atol=1e-4 * factor * np.max(gt_exp),
+                err_msg=f'Incorrect gamma_t of spectrum {idx}.',
+            )
+
+    def test_gamma_t_theo_phys_batched(self):
+        """Test ``unions_wl.theory.gamma_t_theo_phys`` function.
+
+        Compare the batched computation of the sub-slices, with
+        ``angular_cl_slices`` and ``correlation_ng_fftlog``, to ccl for
+        each sub-slice. Both agree to 1% of the maximum, for the
+        tangential shear and the excess surface mass density; the
+        deviation for these distributions is about 0.4%.
+
+        See Also
+        --------
+        unions_wl.theory.gamma_t_theo_phys : Implementation of the
+            ``gamma_t_theo_phys`` function.
+        unions_wl.theory.angular_cl_slices : Implementation of the
+            ``angular_cl_slices`` function.
+
+        """
+        r_Mpc = np.geomspace(0.1, 10, 8)
+        for Delta_Sigma in (False, True):
+            y = {}
+            for batched in (True, False):
+                y[batched] = theory.gamma_t_theo_phys(
+                    r_Mpc,
+                    self._cosmo,
+                    self._dndz_lens,
+                    self._dndz_source,
+                    {'model_type': 'linear_bias', 'bias_1': 1.5},
+                    ell=self._ell,
+                    Delta_Sigma=Delta_Sigma,
+                    batched=batched,
+                )
+            npt.assert_allclose(
+                y[True],
+                y[False],
+                rtol=0,
+                atol=1e-2 * np.max(np.abs(y[False])),
+                err_msg=f'Batched sub-slices differ, DS={Delta_Sigma}.',
+            )
+
+
+@skipIf(theory is None, 'theory module requires pyccl')
+class GammaTEmulatorTestCase(TestCase):
+    """Test case for the ``GammaTEmulator`` class."""
+
+    def setUp(self):
+        """Set test parameter values."""
+        self._param_grid = {
+            'bias_1': np.linspace(0.5, 2.5, 5),
+            'log10_Mmin': np.linspace(11, 13, 4),
+        }
+        self._x = np.geomspace(0.01, 1, 12)
+        bias, log10_Mmin = np.meshgrid(
+            *self._param_grid.values(),
+            indexing='ij',
+        )
+        self._y = self._get_y(
+            bias[..., np.newaxis],
+            log10_Mmin[..., np.newaxis],
+            self._x,
+        )
+        self._params = {'bias_1': 1.3, 'log10_Mmin': 12.4}
+
+    def _get_y(self, bias, log10_Mmin, x):
+        """Return training function, linear in log and parameters."""
+        return np.exp(0.5 * bias + 0.2 * log10_Mmin) * x ** -0.8
+
+    def tearDown(self):
+        """Unset test parameter values."""
+        self._param_grid = None
+        self._x = None
+        self._y = None
+        self._params = None
+
+    def test_predict(self):
+        """Test ``unions_wl.theory.GammaTEmulator.predict`` method.
+
+        Compare to the exact function between grid points, which is
+        reproduced by the emulator since its log is linear in the
+        parameters.
+
+        See Also
+        --------
+        unions_wl.theory.GammaTEmulator.predict : Implementation of the
+            ``predict`` method.
+
+        """
+        emulator = theory.GammaTEmulator(self._param_grid, self._x, self._y)
+        x = np.geomspace(0.02, 0.8, 7)
+        npt.assert_allclose(
+            emulator.predict(self._params, x=x),
+            self._get_y(
+                self._params['bias_1'],
+                self._params['log10_Mmin'],
+                x,
+            ),
+            rtol=1e-6,
+            err_msg='Incorrect emulator prediction.',
+        )
+        with self.assertRaises(ValueError):
+            emulator.predict({'bias_1': 3, 'log10_Mmin': 12})
+
+    def test_save_read(self):
+        """Test ``unions_wl.theory.GammaTEmulator.save`` method.
+
+        Read back a saved emulator and compare predictions.
+
+        See Also
+        --------
+        unions_wl.theory.GammaTEmulator.save : Implementation of the
+            ``save`` method.
+        unions_wl.theory.GammaTEmulator.read : Implementation of the
+            ``read`` method.
+
+        """
+        emulator = theory.GammaTEmulator(
+            self._param_grid,
+            self._x,
+            self._y,
+            physical=True,
+        )
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'emulator.npz')
+            emulator.save(path)
+            emulator_read = theory.GammaTEmulator.read(path)
+
+        npt.assert_equal(emulator_read.param_names, emulator.param_names)
+        npt.assert_equal(emulator_read.physical, True)
+        npt.assert_equal(emulator_read.pca_error, emulator.pca_error)
+        npt.assert_equal(
+            emulator_read.predict(self._params),
+            emulator.predict(self._params),
+            err_msg='Incorrect prediction of emulator read from file.',
+        )
+
+    def test_g_t_model(self):
+        """Test ``unions_wl.theory.g_t_model`` function.
+
+        With an emulator, the model is the emulated prediction. The
+        emulator parameters need to be fit parameters, and the emulator
+        scales those of the data.
+
+        See Also
+        --------
+        unions_wl.theory.g_t_model : Implementation of the
+            ``g_t_model`` function.
+
+        """
+        emulator = theory.GammaTEmulator(self._param_grid, self._x, self._y)
+        extra = {'cosmo': None, 'physical': False, 'emulator': emulator}
+        for sample in ('source', 'lens'):
+            extra[f'z_centers_{sample}'] = None
+            extra[f'nz_{sample}'] = None
+        x = np.geomspace(0.02, 0.8, 7)
+
+        npt.assert_equal(
+            theory.g_t_model(self._params, x, extra),
+            emulator.predict(self._params, x=x),
+            err_msg='Model is not the emulated prediction.',
+        )
+        with self.assertRaises(ValueError):
+            theory.g_t_model({'bias_1': 1.3}, x, extra)
+        extra['physical'] = True
+        with self.assertRaises(ValueError):
+            theory.g_t_model(self._params, x, extra)
@@ -7,6 +7,11 @@
 
 """
 
+import hashlib
+import json
+
+from collections import OrderedDict
+
 import numpy as np
 
 from astropy import units
@@ -17,7 +22,363 @@ from pyccl.core import Cosmology
 import pyccl.nl_pt as pt
 import pyccl.ccllib as lib
 
-import cs_util.cosmo
+from scipy import fft
+from scipy.interpolate import CubicSpline, RegularGridInterpolator
+
+from unions_wl import distances
+
+
+# Cosmology- and k-grid dependent objects of recent calls, most recently
+# used last
+_cache = OrderedDict()
+
+# Maximum number of cached objects
+N_CACHE_MAX = 16
+
+# Range of 2D Fourier modes of the dense grid
+ELL_MIN = 2
+ELL_MAX = 100_000
+
+# Default relative tolerance of gamma_t for the adaptive ell grid
+ELL_TOL = 1e-3
+
+# Minimum and maximum number of log-spaced ell nodes of the adaptive grid.
+# Numbers 2^k + 1 such that the nodes of a grid are part of the next
+# finer grid.
+N_ELL_MIN = 33
+N_ELL_MAX = 4097
+
+
+def get_cached(key, create):
+    """Get Cached.
+
+    Return object from the cache, or create it and add it to the cache.
+    The cache keeps the N_CACHE_MAX most recently used objects.
+
+    Parameters
+    ----------
+    key : tuple
+        key identifying the object, e.g. by name, cosmology and k-grid
+    create : callable
+        function without arguments returning the object
+
+    Returns
+    -------
+    object
+        cached object
+
+    """
+    if key not in _cache:
+        _cache[key] = create()
+        if len(_cache) > N_CACHE_MAX:
+            _cache.popitem(last=False)
+    _cache.move_to_end(key)
+
+    return _cache[key]
+
+
+def clear_cache():
+    """Clear Cache.
+
+    Remove all objects from the cache.
+
+    """
+    _cache.clear()
+
+
+def get_array_key(*arrays):
+    """Get Array Key.
+
+    Return key identifying the values of arrays, for use in the cache.
+
+    Parameters
+    ----------
+    arrays : list
+        arrays, ``None`` is allowed
+
+    Returns
+    -------
+    str
+        key
+
+    """
+    hash_arr = hashlib.sha1()
+    for arr in arrays:
+        if arr is not None:
+            hash_arr.update(np.asarray(arr, dtype=float).tobytes())
+        hash_arr.update(b'|')
+
+    return hash_arr.hexdigest()
+
+
+def get_ell_dense():
+    """Get Ell Dense.
+
+    Return dense grid of 2D Fourier modes, on which angular power spectra
+    are passed to the Hankel transform.
+
+    Returns
+    -------
+    numpy.array
+        2D Fourier modes
+
+    """
+    return np.arange(ELL_MIN, ELL_MAX)
+
+
+def get_ell_nodes(n_ell):
+    """Get Ell Nodes.
+
+    Return log-spaced 2D Fourier modes of the adaptive grid.
+
+    Parameters
+    ----------
+    n_ell : int
+        number of modes
+
+    Returns
+    -------
+    numpy.array
+        2D Fourier modes
+
+    """
+    return np.geomspace(ELL_MIN, ELL_MAX - 1, num=n_ell)
+
+
+def interp_cls(ell_nodes, cls_nodes, ell):
+    """Interp Cls.
+
+    Interpolate angular power spectra with a cubic spline in log ell. If
+    all spectra are positive, the spline is in log C_ell.
+
+    Parameters
+    ----------
+    ell_nodes : numpy.array
+        2D Fourier modes of the nodes
+    cls_nodes : numpy.array
+        angular power spectra at the nodes, the last axis corresponds to
+        ell_nodes
+    ell : numpy.array
+        2D Fourier modes to interpolate at
+
+    Returns
+    -------
+    numpy.array
+        interpolated angular power spectra
+
+    """
+    if np.all(cls_nodes > 0):
+        spline = CubicSpline(np.log(ell_nodes), np.log(cls_nodes), axis=-1)
+        return np.exp(spline(np.log(ell)))
+
+    spline = CubicSpline(np.log(ell_nodes), cls_nodes, axis=-1)
+    return spline(np.log(ell))
+
+
+def get_angular_cl(get_cls, transform, ell, ell_tol=ELL_TOL, key=None):
+    """Get Angular Cl.
+
+    Return angular power spectra on a grid of 2D Fourier modes.
+
+    For ``ell='auto'``, the spectra are computed on log-spaced nodes and
+    spline-interpolated onto the dense grid. The number of nodes is
+    doubled until the transform of the spectra, e.g. the tangential shear,
+    changes by less than the tolerance relative to its maximum absolute
+    value. The number of nodes is then cached under ``key``, subsequent
+    calls only compute the spectra on the chosen nodes.
+
+    Parameters
+    ----------
+    get_cls : callable
+        function returning the angular power spectra for an array of
+        2D Fourier modes
+    transform : callable
+        function of 2D Fourier modes and angular power spectra returning
+        the observable to control
+    ell : array or str
+        2D Fourier modes; ``None`` for the dense grid, ``'auto'`` for
+        the adaptive grid
+    ell_tol : float, optional
+        relative tolerance of the transform for ``ell='auto'``, default
+        is ELL_TOL
+    key : tuple, optional
+        cache key of the number of nodes for ``ell='auto'``; if not
+        given, the number is not cached
+
+    Raises
+    ------
+    ValueError
+        if ell is an invalid string
+
+    Returns
+    -------
+    tuple
+        2D Fourier modes and angular power spectra
+
+    """
+    if ell is None:
+        ell = get_ell_dense()
+
+    if not isinstance(ell, str):
+        return ell, get_cls(ell)
+
+    if ell != 'auto':
+        raise ValueError(f'Invalid ell grid {ell}')
+
+    ell = get_ell_dense()
+
+    # Spectra on the nodes, if computed while choosing the number of nodes
+    cls_chosen = {}
+
+    def create():
+        n_ell, cls_chosen['nodes'] = _choose_n_ell(
+            get_cls,
+            transform,
+            ell,
+            ell_tol,
+        )
+        return n_ell
+
+    if key is None:
+        n_ell = create()
+    else:
+        n_ell = get_cached(key + (ell_tol,), create)
+
+    ell_nodes = get_ell_nodes(n_ell)
+    if 'nodes' in cls_chosen:
+        cls_nodes = cls_chosen['nodes']
+    else:
+        cls_nodes = get_cls(ell_nodes)
+
+    return ell, interp_cls(ell_nodes, cls_nodes, ell)
+
+
+def _choose_n_ell(get_cls, transform, ell, ell_tol):
+    """Choose N Ell.
+
+    Return number of ell nodes and angular power spectra on those nodes,
+    see :func:`get_angular_cl`. At most N_ELL_MAX nodes are used.
+
+    """
+    n_ell = N_ELL_MIN
+    ell_nodes = get_ell_nodes(n_ell)
+    cls_nodes = get_cls(ell_nodes)
+    y = transform(ell, interp_cls(ell_nodes, cls_nodes, ell))
+
+    while n_ell < N_ELL_MAX:
+        # Refined grid, only compute spectra on the new nodes
+        n_ell = 2 * n_ell - 1
+        ell_nodes = get_ell_nodes(n_ell)
+        cls_fine = np.zeros(cls_nodes.shape[:-1] + (n_ell,))
+        cls_fine[..., ::2] = cls_nodes
+        cls_fine[..., 1::2] = get_cls(ell_nodes[1::2])
+        cls_nodes = cls_fine
+
+        y_fine = transform(ell, interp_cls(ell_nodes, cls_nodes, ell))
+        dev = np.max(np.abs(y_fine - y)) / np.max(np.abs(y_fine))
+        y = y_fine
+        if dev < ell_tol:
+            break
+
+    return n_ell, cls_nodes
+
+
+def get_pt_calculator(
+    log10k_min=-4,
+    log10k_max=2,
+    nk_per_decade=20,
+    with_IA=False,
+):
+    """Get PT Calculator.
+
+    Return perturbation-theory power-spectrum calculator, from the cache
+    if available. The FAST-PT initialisation depends on the k-grid only.
+
+    Parameters
+    ----------
+    log10k_min : float, optional
+        minimum 3D Fourier scale (log-10), default=-4
+    log10k_max : float, optional
+        maximum 3D Fourier scale (log-10), default=2
+    nk_per_decade : int, optional
+        number of k-modes per log-10  interval in k, default=20
+    with_IA : bool, optional
+        compute intrinsic-alignment terms if True, default is False
+
+    Returns
+    -------
+    pyccl.nl_pt.PTCalculator
+        calculator
+
+    """
+    key = ('PTCalculator', with_IA, log10k_min, log10k_max, nk_per_decade)
+
+    return get_cached(
+        key,
+        lambda: pt.PTCalculator(
+            with_NC=True,
+            with_IA=with_IA,
+            log10k_min=log10k_min,
+            log10k_max=log10k_max,
+            nk_per_decade=nk_per_decade,
+        ),
+    )
+
+
+def get_halo_model(cosmo):
+    """Get Halo Model.
+
+    Return halo-model ingredients which only depend on cosmology, from
+    the cache if available.
+
+    Parameters
+    ----------
+    cosmo : pyccl.core.Cosmology
+        Cosmological parameter
+
+    Returns
+    -------
+    dict
+        mass definition 'mass_def', concentration-mass relation
+        'c_of_M', halo-model calculator 'hmc' with mass function and
+        halo bias, and mass profile 'prof_m'
+
+    """
+    key = ('halo_model', distances.get_cosmo_key(cosmo))
+
+    return get_cached(key, lambda: _create_halo_model(cosmo))
+
+
+def _create_halo_model(cosmo):
+    """Create Halo Model.
+
+    Return halo-model ingredients, see :func:`get_halo_model`.
+
+    """
+    # Mass definition
+    mass_def = ccl.halos.MassDef200m()
+
+    # c(M) relation
+    c_of_M = ccl.halos.ConcentrationDuffy08(mass_def)
+
+    # Mass function
+    dlogn_dlogM = ccl.halos.MassFuncTinker10(cosmo, mass_def=mass_def)
+
+    # Halo bias
+    bh_of_M = ccl.halos.HaloBiasTinker10(cosmo, mass_def=mass_def)
+
+    # Halo model calculator
+    hmc = ccl.halos.HMCalculator(cosmo, dlogn_dlogM, bh_of_M, mass_def)
+
+    # Halo profile for mass
+    prof_m = ccl.halos.profiles.HaloProfileNFW(c_of_M)
+
+    return {
+        'mass_def': mass_def,
+        'c_of_M': c_of_M,
+        'hmc': hmc,
+        'prof_m': prof_m,
+    }
 
 
 def pk_gm_theo(
@@ -50,27 +411,57 @@ def pk_gm_theo(
         3D power spectrum on a grid in (k, z)
 
     """
+    # Without higher-order bias terms, the spectrum is linear in the
+    # bias. The unit-bias spectrum only depends on cosmology and k-grid.
+    key = (
+        'pk_gm_unit_bias',
+        distances.get_cosmo_key(cosmo),
+        log10k_min,
+        log10k_max,
+        nk_per_decade,
+    )
+    a_arr, lk_arr, pk_arr = get_cached(
+        key,
+        lambda: _pk_gm_theo_unit_bias(
+            cosmo,
+            log10k_min,
+            log10k_max,
+            nk_per_decade,
+        ).get_spline_arrays(),
+    )
 
-   # Tracers
-    # Galaxies with constant linear bias
-    ptt_g = pt.PTNumberCountsTracer(b1=bias_1)
+    pk_gm = ccl.Pk2D(
+        a_arr=a_arr,
+        lk_arr=lk_arr,
+        pk_arr=bias_1 * pk_arr,
+        is_logp=False,
+    )
+
+    return pk_gm
+
+
+def _pk_gm_theo_unit_bias(cosmo, log10k_min, log10k_max, nk_per_decade):
+    """PK GM Theo Unit Bias.
+
+    3D galaxy-matter power spectrum for unit linear bias.
+
+    """
+    # Tracers
+    # Galaxies with unit linear bias
+    ptt_g = pt.PTNumberCountsTracer(b1=1)
 
     # Dark matter
     ptt_m = pt.PTMatterTracer()
 
     # Power spectrum pre-computation
-    ptc = pt.PTCalculator(
-        with_NC=True,
-        with_IA=False,
+    ptc = get_pt_calculator(
         log10k_min=log10k_min,
         log10k_max=log10k_max,
         nk_per_decade=nk_per_decade,
     )
 
     # 3D galaxy - dark-matter cross power spectrum
-    pk_gm = pt.get_pt_pk2d(cosmo, ptt_g, tracer2=ptt_m, ptc=ptc)
-
-    return pk_gm
+    return pt.get_pt_pk2d(cosmo, ptt_g, tracer2=ptt_m, ptc=ptc)
 
 
 def pk_gm_theo_hod(
@@ -81,20 +472,10 @@ def pk_gm_theo_hod(
     nk_per_decade=20,
 ):
 
-    # Mass definition
-    mass_def = ccl.halos.MassDef200m()
-
-    # c(M) relation
-    c_of_M = ccl.halos.ConcentrationDuffy08(mass_def)
-
-    # Mass function
-    dlogn_dlogM = ccl.halos.MassFuncTinker10(cosmo, mass_def=mass_def)
-
-    # Halo bias
-    bh_of_M = ccl.halos.HaloBiasTinker10(cosmo, mass_def=mass_def)
-
-    # Halo model calculator
-    hmc = ccl.halos.HMCalculator(cosmo, dlogn_dlogM, bh_of_M, mass_def)
+    # Mass definition, c(M) relation, mass function, halo bias, and
+    # mass profile only depend on cosmology
+    halo_model = get_halo_model(cosmo)
+    c_of_M = halo_model['c_of_M']
 
     # Halo profile for galaxies
     # MKDEBUG: gamma_t with oscillations for default parameters
@@ -124,9 +505,6 @@ def pk_gm_theo_hod(
         siglM_0=0.2,
     )
 
-    # Halo profile for mass
-    prof_m = ccl.halos.profiles.HaloProfileNFW(c_of_M)
-
     # Halo-model 3D power spectrum
     #k_arr = np.geomspace(1e-4, 1e1, 256)
     k_arr = np.logspace(
@@ -137,9 +515,9 @@ def pk_gm_theo_hod(
     a_arr = np.linspace(0.1, 1, 32)
     pk_gm = ccl.Cosmology.halomod_Pk2D(
         cosmo,
-        hmc,
+        halo_model['hmc'],
         prof_g,
-        prof2=prof_m,
+        prof2=halo_model['prof_m'],
         normprof1=True,
         normprof2=True,
         lk_arr=np.log(k_arr),
@@ -162,7 +540,18 @@ def g_t_model(params, x_data, extra):
     x_data : numpy.array
         x-values of the data (angular scales in deg)
     extra : dict
-        additional parameters
+        additional parameters; optional are the 2D Fourier modes 'ell',
+        default is ``None`` (dense grid), or 'auto' for log-spaced
+        modes with tolerance 'ell_tol', see
+        :func:`gamma_t_theo`, and the number of lens sub-slices 'n_sub'
+        for physical scales, see :func:`gamma_t_theo_phys`. With an
+        'emulator' (:class:`GammaTEmulator`), the model is emulated.
+
+    Raises
+    ------
+    ValueError
+        if the emulator scales are not the ones of the data, or
+        emulator parameters are missing in params
 
     Returns
     -------
@@ -180,21 +569,41 @@ def g_t_model(params, x_data, extra):
 
     # Set up model for 3D galaxy-matter power spectrum
     pk_gm_info = {}
-    if 'bias_1' in params:
+    if 'emulator' in extra:
+        pk_gm_info['model_type'] = 'emulator'
+        pk_gm_info['emulator'] = extra['emulator']
+    elif 'bias_1' in params:
         pk_gm_info['model_type'] = 'linear_bias'
         pk_gm_info['bias_1'] = params['bias_1']
     else:
         pk_gm_info['model_type'] = 'HOD'
         pk_gm_info['log10_Mmin'] = params['log10_Mmin']
 
-    if not extra['physical']:
+    if pk_gm_info['model_type'] == 'emulator':
+        emulator = pk_gm_info['emulator']
+        if emulator.physical != extra['physical']:
+            raise ValueError(
+                'Emulator and data scales are not both angular or physical'
+            )
+        missing = [
+            name for name in emulator.param_names if name not in params
+        ]
+        if missing:
+            raise ValueError(
+                f'Emulator parameters {missing} missing in fit parameters'
+                + f' {list(params)}'
+            )
+        y_model = emulator.predict(params, x_data)
+    elif not extra['physical']:
         y_model, _, _ = gamma_t_theo(
             x_data,
             cosmo,
             (z_centers['lens'], nz['lens']),
             (z_centers['source'], nz['source']),
             pk_gm_info,
+            ell=extra.get('ell', None),
             integr_method='FFTlog',
+            ell_tol=extra.get('ell_tol', ELL_TOL),
         )
     else:
         y_model = gamma_t_theo_phys(
@@ -203,8 +612,11 @@ def g_t_model(params, x_data, extra):
             (z_centers['lens'], nz['lens']),
             (z_centers['source'], nz['source']),
             pk_gm_info,
+            ell=extra.get('ell', None),
             integr_method='FFTlog',
             Delta_Sigma=False,
+            ell_tol=extra.get('ell_tol', ELL_TOL),
+            n_sub=extra.get('n_sub', 5),
         )
 
     return y_model
@@ -218,12 +630,17 @@ def gamma_t_theo(
         pk_gm_info,
         ell=None,
         integr_method='FFTlog',
+        ell_tol=ELL_TOL,
 ):
     """GAMMA T THEO.
 
     Theoretical prediction of the tangential shear of a source
     population around lenses using the ccl library.
 
+    The prediction is linear in the bias for the linear-bias model. It
+    is computed for unit bias once for each cosmology, redshift
+    distributions, and scales, and then multiplied by the bias.
+
     Parameters
     ----------
     theta_deg : array
@@ -234,17 +651,26 @@ def gamma_t_theo(
         Lens redshift distribution (z, n(z))
     dndz_source : tuple of arrays
         Source redshift distribution (z, n(z))
-    ell : array, optional
-        2D Fourier mode, default is
-        np.geomspace(2, 10000, 1000)
     pk_gm_info : dict
         information about 3D galaxy-matter power spectrum
-    p_of_k : array_like, optional
-        3D power spectrum on a grid in (k, z). If not given,
-        the function ``pk_gm_theo`` is called
+    ell : array or str, optional
+        2D Fourier modes; default is ``None`` for the dense grid
+        np.arange(2, 100_000); for 'auto', the angular power spectrum
+        is interpolated from log-spaced modes, see
+        :func:`get_angular_cl`; their number is chosen at the first call
+        for given cosmology, redshift distributions and scales, and
+        reused for other model parameters
     integr_method : str, optional
         Method of integration over the Bessel function times
         the angular power spectrum, default is 'FFT_log'
+    ell_tol : float, optional
+        relative tolerance of the tangential shear for ``ell='auto'``,
+        default is ELL_TOL
+
+    Raises
+    ------
+    ValueError
+        if the power-spectrum model type is not valid
 
     Returns
     -------
@@ -254,20 +680,92 @@ def gamma_t_theo(
         cls
 
     """
+    key_scales = (
+        distances.get_cosmo_key(cosmo),
+        get_array_key(theta_deg, *dndz_lens, *dndz_source),
+        _get_ell_key(ell, ell_tol),
+        integr_method,
+    )
+    # The number of ell nodes is chosen once for all model parameters
+    key_n_ell = ('n_ell',) + key_scales
+
+    if pk_gm_info['model_type'] == 'linear_bias':
+        gt, ell, cls_gG = get_cached(
+            ('gamma_t_unit_bias',) + key_scales,
+            lambda: _gamma_t_theo(
+                theta_deg,
+                cosmo,
+                dndz_lens,
+                dndz_source,
+                pk_gm_theo(cosmo, 1),
+                ell,
+                integr_method,
+                ell_tol,
+                key_n_ell,
+            ),
+        )
+        bias_1 = pk_gm_info['bias_1']
+        return bias_1 * gt, ell, bias_1 * cls_gG
+
+    elif pk_gm_info['model_type'] == 'HOD':
+        pk_gm = pk_gm_theo_hod(cosmo, pk_gm_info['log10_Mmin'])
+
+    else:
+        raise ValueError(
+            'Invalid power-spectrum model type '
+            + pk_gm_info['model_type']
+        )
+
+    return _gamma_t_theo(
+        theta_deg,
+        cosmo,
+        dndz_lens,
+        dndz_source,
+        pk_gm,
+        ell,
+        integr_method,
+        ell_tol,
+        key_n_ell,
+    )
+
+
+def _get_ell_key(ell, ell_tol):
+    """Get Ell Key.
+
+    Return key identifying the 2D Fourier modes, for use in the cache.
+
+    """
+    if isinstance(ell, str):
+        return (ell, ell_tol)
+
+    return (get_array_key(ell),)
+
+
+def _gamma_t_theo(
+        theta_deg,
+        cosmo,
+        dndz_lens,
+        dndz_source,
+        pk_gm,
+        ell,
+        integr_method,
+        ell_tol=ELL_TOL,
+        key_n_ell=None,
+):
+    """Gamma T Theo.
 
+    Tangential shear for a galaxy-matter power spectrum, see
+    :func:`gamma_t_theo`.
+
+    """
     z_lens = dndz_lens[0]
 
     # 2D tracers
 
-    # Galaxies (lenses)
+    # Galaxies (lenses). The galaxy bias is part of the galaxy-matter
+    # power spectrum, leave tracer bias to unity here.
     bias_g = np.ones_like(z_lens)
 
-    # Multiply galaxy bias with linear bias according to model.
-    # For HOD model galaxy bias is implemented in model, leave
-    # value to unity here.
-    if pk_gm_info['model_type'] == 'linear_bias':
-        bias_g *= pk_gm_info['bias_1']
-
     tracer_g = ccl.NumberCountsTracer(
             cosmo,
             False,
@@ -284,40 +782,35 @@ def gamma_t_theo(
     )
 
     # Angular cross-power spectrum
-    if ell is None:
-        ell_min = 2
-        ell_max = 100_000
-        ell = np.arange(ell_min, ell_max)
-
-    # MKDEBUG to check: bias twice?
-    if pk_gm_info['model_type'] == 'linear_bias':
-        pk_gm = pk_gm_theo(cosmo, pk_gm_info['bias_1'])
-    elif pk_gm_info['model_type'] == 'HOD':
-        pk_gm = pk_gm_theo_hod(cosmo, pk_gm_info['log10_Mmin'])
-    else:
-        raise ValueError(
-            'Invalid power-spectrum model type '
-            + pk_gm_info['model_type']
+    def get_cls(ell):
+        return ccl.angular_cl(
+            cosmo,
+            tracer_g,
+            tracer_l,
+            ell,
+            p_of_k_a=pk_gm,
+            limber_integration_method='qag_quad'
         )
 
-    cls_gG = ccl.angular_cl(
-        cosmo,
-        tracer_g,
-        tracer_l,
-        ell,
-        p_of_k_a=pk_gm,
-        limber_integration_method='qag_quad'
-    )
-
     # Tangential shear
-    gt = ccl.correlation(
-        cosmo,
+    def get_gt(ell, cls_gG):
+        return ccl.correlation(
+            cosmo,
+            ell,
+            cls_gG,
+            theta_deg,
+            type='NG',
+            method=integr_method,
+        )
+
+    ell, cls_gG = get_angular_cl(
+        get_cls,
+        get_gt,
         ell,
-        cls_gG,
-        theta_deg,
-        type='NG',
-        method=integr_method,
+        ell_tol=ell_tol,
+        key=key_n_ell,
     )
+    gt = get_gt(ell, cls_gG)
 
     return gt, ell, cls_gG
 
@@ -331,12 +824,18 @@ def gamma_t_theo_phys(
         ell=None,
         integr_method='FFTlog',
         Delta_Sigma=False,
+        ell_tol=ELL_TOL,
+        n_sub=5,
+        batched=True,
 ):
     """GAMMA T THEO.
 
     Theoretical prediction of the tangential shear of a source
     population around lenses using the ccl library.
 
+    As for :func:`gamma_t_theo`, the linear-bias prediction is computed
+    for unit bias once, and multiplied by the bias.
+
     Parameters
     ----------
     r_Mpc: array
@@ -347,25 +846,34 @@ def gamma_t_theo_phys(
         Lens redshift distribution (z, n(z))
     dndz_source : tuple of arrays
         Source redshift distribution (z, n(z))
-    ell : array, optional
-        2D Fourier mode, default is
-        np.geomspace(2, 10000, 1000)
     pk_gm_info : dict
         information about 3D galaxy-matter power spectrum
-    p_of_k : array_like, optional
-        3D power spectrum on a grid in (k, z). If not given,
-        the function ``pk_gm_theo`` is called
+    ell : array or str, optional
+        2D Fourier modes; default is ``None`` for the dense grid
+        np.arange(2, 100_000); 'auto' for log-spaced modes, see
+        :func:`gamma_t_theo`
     integr_method : str, optional
         Method of integration over the Bessel function times
         the angular power spectrum, default is 'FFT_log'
     Delta_Sigma : bool, optional
         Return excess surface mass density (ESD) if `True`;
         default is `False`
+    ell_tol : float, optional
+        relative tolerance of the output for ``ell='auto'``, default is
+        ELL_TOL
+    n_sub : int, optional
+        number of lens redshift sub-slices, default is 5
+    batched : bool, optional
+        if `True` (default), compute the angular power spectra of all
+        sub-slices together with :func:`angular_cl_slices`, and their
+        Hankel transforms with :func:`correlation_ng_fftlog` for
+        integr_method='FFTlog'; the cost then hardly depends on n_sub.
+        Otherwise, use ccl for each sub-slice.
 
     Raises
     ------
     ValueError
-        
+        if the power-spectrum model type is not valid
 
     Returns
     -------
@@ -373,15 +881,85 @@ def gamma_t_theo_phys(
         Tangential shear or excess surface mass density at input scales
 
     """
-    z_lens = dndz_lens[0]
-    nz_lens = dndz_lens[1]
-    bias_g = np.ones_like(z_lens)
+    key_scales = (
+        distances.get_cosmo_key(cosmo),
+        get_array_key(r_Mpc, *dndz_lens, *dndz_source),
+        _get_ell_key(ell, ell_tol),
+        integr_method,
+        Delta_Sigma,
+        n_sub,
+        batched,
+    )
+    # The number of ell nodes is chosen once for all model parameters
+    key_n_ell = ('n_ell_phys',) + key_scales
 
-    # Multiply galaxy bias with linear bias according to model.
-    # For HOD model galaxy bias is implemented in model, leave
-    # value to unity here.
     if pk_gm_info['model_type'] == 'linear_bias':
-        bias_g *= pk_gm_info['bias_1']
+        y_tot = get_cached(
+            ('gamma_t_phys_unit_bias',) + key_scales,
+            lambda: _gamma_t_theo_phys(
+                r_Mpc,
+                cosmo,
+                dndz_lens,
+                dndz_source,
+                pk_gm_theo(cosmo, 1),
+                ell,
+                integr_method,
+                Delta_Sigma,
+                ell_tol,
+                key_n_ell,
+                n_sub,
+                batched,
+            ),
+        )
+        return pk_gm_info['bias_1'] * y_tot
+
+    elif pk_gm_info['model_type'] == 'HOD':
+        pk_gm = pk_gm_theo_hod(cosmo, pk_gm_info['log10_Mmin'])
+
+    else:
+        raise ValueError(
+            'Invalid power-spectrum model type '
+            + pk_gm_info['model_type']
+        )
+
+    return _gamma_t_theo_phys(
+        r_Mpc,
+        cosmo,
+        dndz_lens,
+        dndz_source,
+        pk_gm,
+        ell,
+        integr_method,
+        Delta_Sigma,
+        ell_tol,
+        key_n_ell,
+        n_sub,
+        batched,
+    )
+
+
+def _gamma_t_theo_phys(
+        r_Mpc,
+        cosmo,
+        dndz_lens,
+        dndz_source,
+        pk_gm,
+        ell,
+        integr_method,
+        Delta_Sigma,
+        ell_tol=ELL_TOL,
+        key_n_ell=None,
+        n_sub=5,
+        batched=True,
+):
+    """Gamma T Theo Phys.
+
+    Tangential shear or excess surface mass density for a galaxy-matter
+    power spectrum, see :func:`gamma_t_theo_phys`.
+
+    """
+    z_lens = dndz_lens[0]
+    nz_lens = dndz_lens[1]
 
     # 2D tracers
 
@@ -393,99 +971,908 @@ def gamma_t_theo_phys(
         n_samples=n_nz,
     )
 
-    # Angular cross-power spectrum
-    if ell is None:
-        ell_min = 2
-        ell_max = 100_000
-        ell = np.arange(ell_min, ell_max)
-
-    # MKDEBUG to check: bias twice?
-    if pk_gm_info['model_type'] == 'linear_bias':
-        pk_gm = pk_gm_theo(cosmo, pk_gm_info['bias_1'])
-    elif pk_gm_info['model_type'] == 'HOD':
-        pk_gm = pk_gm_theo_hod(cosmo, pk_gm_info['log10_Mmin'])
-    else:
+    # Galaxies (lenses), in redshift sub-slices
+    z_lens_sub = np.array_split(z_lens, n_sub)
+    nz_lens_sub = np.array_split(nz_lens, n_sub)
+    if min([len(z_sub) for z_sub in z_lens_sub]) < 2:
         raise ValueError(
-            'Invalid power-spectrum model type '
-            + pk_gm_info['model_type']
+            f'n_sub={n_sub} too large for #nz_lens={len(z_lens)}, each'
+            + ' sub-slice needs at least two redshifts'
         )
 
-    # Galaxies (lenses)
+    # Distances and critical surface mass densities
+    dist_table = distances.get_distance_table(
+        cosmo,
+        z_max=max(np.max(z_lens), np.max(dndz_source[0])),
+    )
 
-    y = []
-    #n_sub = 20
-    n_sub = 5
-    #if len(z_lens) % n_sub != 0:
-        #raise ValueError(
-            #f'n_sub={n_sub} is not divider of #nz_lens={len(z_lens)}'
-        #)
-    z_lens_sub = np.array_split(z_lens, n_sub)
-    nz_lens_sub = np.array_split(nz_lens, n_sub)
-    bias_g_sub = np.array_split(bias_g, n_sub)
-
-    nz_lens_mean_sub = []
-    for idx in range(len(z_lens_sub)):
-        # MKDEBUG: Sometimes an CCL SPLINE error occurs.
-        # If n_sub is too large?
-        try:
-            tracer_g_sub = ccl.NumberCountsTracer(
+    # Angular scales of each sub-slice
+    z_lens_mean_sub = np.array([np.mean(z_sub) for z_sub in z_lens_sub])
+    d_ang_sub = dist_table.d_ang(z_lens_mean_sub)
+    theta_deg_sub = (
+        (r_Mpc[np.newaxis, :] / d_ang_sub[:, np.newaxis]) * units.radian
+    ).to('degree').value
+
+    if Delta_Sigma:
+        # Delta Sigma = gamma_t * (1 / Sigma_eff^{-1})
+        # Since Sigma_cr(z_s, z_l) diverges for z_s -> z_l,
+        # the term gamma_t * Sigma_cr is disfavoured
+        scale_sub = 1 / dist_table.sigma_crit_m1_eff(
+            z_lens_mean_sub,
+            dndz_source[0],
+            dndz_source[1],
+        )
+    else:
+        scale_sub = np.ones(n_sub)
+
+    # Mean n(z) of sub-slices
+    nz_lens_mean_sub = [np.mean(nz_sub) for nz_sub in nz_lens_sub]
+
+    if batched:
+        # Angular cross-power spectra of all sub-slices
+        def get_cls(ell):
+            return angular_cl_slices(
+                cosmo,
+                z_lens_sub,
+                nz_lens_sub,
+                tracer_l,
+                pk_gm,
+                ell,
+            )
+    else:
+        # The galaxy bias is part of the galaxy-matter power spectrum,
+        # leave tracer bias to unity here
+        tracer_g_sub = [
+            ccl.NumberCountsTracer(
                 cosmo,
                 False,
                 dndz=(z_lens_sub[idx], nz_lens_sub[idx]),
-                bias=(z_lens_sub[idx], bias_g_sub[idx]),
+                bias=(z_lens_sub[idx], np.ones_like(z_lens_sub[idx])),
             )
-        except:
-            print('Error while creating ccl.NumberCountsTracer')
-            print(cosmo.cosmo.status_message)
-            raise
+            for idx in range(n_sub)
+        ]
+
+        def get_cls(ell):
+            return np.array([
+                ccl.angular_cl(
+                    cosmo,
+                    tracer_g,
+                    tracer_l,
+                    ell,
+                    p_of_k_a=pk_gm,
+                    limber_integration_method='qag_quad'
+                )
+                for tracer_g in tracer_g_sub
+            ])
+
+    # Average of sub-slices
+    def get_y_tot(ell, cls_gG):
+        if batched and integr_method == 'FFTlog':
+            y = correlation_ng_fftlog(ell, cls_gG, theta_deg_sub)
+        else:
+            y = np.array([
+                ccl.correlation(
+                    cosmo,
+                    ell,
+                    cls_gG[idx],
+                    theta_deg_sub[idx],
+                    type='NG',
+                    method=integr_method,
+                )
+                for idx in range(n_sub)
+            ])
+
+        # Average weighted by n(z) of sub-slices
+        return np.average(
+            y * scale_sub[:, np.newaxis],
+            axis=0,
+            weights=nz_lens_mean_sub,
+        )
 
-        cls_gG_sub = ccl.angular_cl(
-            cosmo,
-            tracer_g_sub,
-            tracer_l,
-            ell,
-            p_of_k_a=pk_gm,
-            limber_integration_method='qag_quad'
+    ell, cls_gG = get_angular_cl(
+        get_cls,
+        get_y_tot,
+        ell,
+        ell_tol=ell_tol,
+        key=key_n_ell,
+    )
+    y_tot = get_y_tot(ell, cls_gG)
+
+    return y_tot
+
+
+def angular_cl_slices(
+    cosmo,
+    z_lens_sub,
+    nz_lens_sub,
+    tracer_l,
+    pk_gm,
+    ell,
+    n_z_interval=8,
+):
+    """Angular Cl Slices.
+
+    Angular galaxy-shear cross-power spectra of lens redshift sub-slices
+    in the Limber approximation, for unit galaxy bias. The lensing kernel
+    and galaxy-matter power spectrum are evaluated once on a common
+    redshift grid, which subdivides the redshift intervals of each
+    sub-slice. The spectra of all sub-slices are then weighted sums over
+    this grid.
+
+    Parameters
+    ----------
+    cosmo : pyccl.core.Cosmology
+        Cosmological parameters
+    z_lens_sub : list of numpy.array
+        redshifts of sub-slices, at least two per sub-slice
+    nz_lens_sub : list of numpy.array
+        lens redshift distribution of sub-slices, linearly interpolated
+        between the redshifts
+    tracer_l : pyccl.WeakLensingTracer
+        sources
+    pk_gm : pyccl.Pk2D
+        3D galaxy-matter power spectrum
+    ell : numpy.array
+        2D Fourier modes
+    n_z_interval : int, optional
+        number of grid points per redshift interval, default is 8
+
+    Returns
+    -------
+    numpy.array
+        angular cross-power spectra, with shape (n_sub, n_ell)
+
+    """
+    # Redshift grid and normalised n(z) trapezoidal integration weights
+    # of all sub-slices
+    frac = np.arange(n_z_interval) / n_z_interval
+    z_grid = []
+    weights = []
+    for z_sub, nz_sub in zip(z_lens_sub, nz_lens_sub):
+        z_fine = np.append(
+            (z_sub[:-1, np.newaxis] + np.diff(z_sub)[:, np.newaxis] * frac),
+            z_sub[-1],
         )
+        dz_fine = np.diff(z_fine)
+        w_fine = np.zeros(len(z_fine))
+        w_fine[:-1] += dz_fine / 2
+        w_fine[1:] += dz_fine / 2
+        w_fine *= np.interp(z_fine, z_sub, nz_sub)
+
+        z_grid.append(z_fine)
+        if np.sum(w_fine) > 0:
+            w_fine /= np.sum(w_fine)
+        weights.append(w_fine)
+    idx_start = np.cumsum([0] + [len(z_fine) for z_fine in z_grid[:-1]])
+    z_grid = np.concatenate(z_grid)
+    weights = np.concatenate(weights)
+
+    # Lensing kernel, ell-dependent factor, and galaxy-matter power
+    # spectrum at k = (ell + 1/2) / chi, shared by all sub-slices
+    a_grid = 1 / (1 + z_grid)
+    chi = ccl.comoving_radial_distance(cosmo, a_grid)
+    kernel_l = np.zeros(len(chi))
+    kernel_l[chi > 0] = tracer_l.get_kernel(chi[chi > 0])[0]
+    # The lensing prefactor sqrt((ell+2)! / (ell-2)!) comes with
+    # 1 / (ell + 1/2)^2 from the Poisson equation
+    f_ell = tracer_l.get_f_ell(ell)[0] / (ell + 0.5) ** 2
+
+    integrand = np.zeros((len(chi), len(ell)))
+    for idx in np.flatnonzero(kernel_l):
+        k = (ell + 0.5) / chi[idx]
+        integrand[idx] = (
+            weights[idx] * kernel_l[idx] / chi[idx] ** 2
+            * pk_gm.eval(k, a_grid[idx], cosmo)
+        )
+
+    return np.add.reduceat(integrand, idx_start, axis=0) * f_ell
+
+
+def correlation_ng_fftlog(ell, cls, theta_deg):
+    """Correlation NG FFTLog.
+
+    Tangential shear from angular galaxy-shear cross-power spectra,
+    gamma_t(theta) = int d ell ell / (2 pi) C(ell) J_2(ell theta). The
+    Hankel transforms of all spectra are computed together with FFTLog on
+    the ell grid of ccl.correlation, given by ``ccl.spline_params``.
+    As in ccl.correlation, the spectra are extrapolated as constant below
+    and as power law above the input modes.
+
+    Parameters
+    ----------
+    ell : numpy.array
+        2D Fourier modes, increasing
+    cls : numpy.array
+        angular power spectra, with shape (n_spec, n_ell)
+    theta_deg : numpy.array
+        angular scales in degrees, with shape (n_spec, n_theta)
+
+    Returns
+    -------
+    numpy.array
+        tangential shear, with shape (n_spec, n_theta)
+
+    """
+    n_fft = ccl.spline_params.N_ELL_CORR
+    log_ell_min = np.log(ccl.spline_params.ELL_MIN_CORR)
+    log_ell_max = np.log(ccl.spline_params.ELL_MAX_CORR)
+    log_ell_fft = np.linspace(log_ell_min, log_ell_max, n_fft)
+    dln = log_ell_fft[1] - log_ell_fft[0]
+
+    # Spectra on FFT grid. Interpolate and extrapolate in log-log if
+    # positive.
+    log_ell = np.log(ell)
+    cls_fft = np.zeros((len(cls), n_fft))
+    for idx, cls_spec in enumerate(cls):
+        if np.all(cls_spec > 0):
+            log_cls = np.log(cls_spec)
+            slope = (log_cls[-1] - log_cls[-2]) / (log_ell[-1] - log_ell[-2])
+            cls_fft[idx] = np.exp(
+                np.where(
+                    log_ell_fft > log_ell[-1],
+                    log_cls[-1] + slope * (log_ell_fft - log_ell[-1]),
+                    np.interp(log_ell_fft, log_ell, log_cls),
+                )
+            )
+        else:
+            cls_fft[idx] = np.interp(log_ell_fft, log_ell, cls_spec, right=0)
+
+    # Hankel transform of ell C(ell) / (2 pi) returns theta gamma_t(theta)
+    mu = 2
+    offset = fft.fhtoffset(dln, mu)
+    theta_fft = np.exp(offset - log_ell_fft[::-1])
+    gt_fft = fft.fht(
+        np.exp(log_ell_fft) * cls_fft / (2 * np.pi),
+        dln,
+        mu,
+        offset=offset,
+    ) / theta_fft
+
+    theta_rad = np.deg2rad(theta_deg)
+    return np.array([
+        np.interp(np.log(theta_rad[idx]), np.log(theta_fft), gt_fft[idx])
+        for idx in range(len(cls))
+    ])
+
+
+def check_ell_grid(
+    x,
+    cosmo,
+    dndz_lens,
+    dndz_source,
+    pk_gm_info,
+    physical=False,
+    Delta_Sigma=False,
+    integr_method='FFTlog',
+    ell_tol=ELL_TOL,
+):
+    """Check Ell Grid.
+
+    Validate the adaptive ell grid against the dense grid. Return the
+    maximum deviation of the prediction with ``ell='auto'`` from the one
+    with the dense grid, relative to the maximum absolute value of the
+    latter. For the requested tolerance this should be of order ell_tol
+    or smaller.
+
+    Parameters
+    ----------
+    x : array
+        Angular scales in degrees, or physical scales in Mpc if
+        physical is `True`
+    cosmo : pyccl.core.Cosmology
+        Cosmological parameters
+    dndz_lens : tuple of arrays
+        Lens redshift distribution (z, n(z))
+    dndz_source : tuple of arrays
+        Source redshift distribution (z, n(z))
+    pk_gm_info : dict
+        information about 3D galaxy-matter power spectrum
+    physical : bool, optional
+        physical scales if `True`, default is `False`
+    Delta_Sigma : bool, optional
+        excess surface mass density for physical scales if `True`,
+        default is `False`
+    integr_method : str, optional
+        Method of integration over the Bessel function times
+        the angular power spectrum, default is 'FFT_log'
+    ell_tol : float, optional
+        relative tolerance of the adaptive grid, default is ELL_TOL
+
+    Returns
+    -------
+    float
+        relative deviation
+
+    """
+    y = {}
+    for ell in ('auto', None):
+        if not physical:
+            y[ell], _, _ = gamma_t_theo(
+                x,
+                cosmo,
+                dndz_lens,
+                dndz_source,
+                pk_gm_info,
+                ell=ell,
+                integr_method=integr_method,
+                ell_tol=ell_tol,
+            )
+        else:
+            y[ell] = gamma_t_theo_phys(
+                x,
+                cosmo,
+                dndz_lens,
+                dndz_source,
+                pk_gm_info,
+                ell=ell,
+                integr_method=integr_method,
+                Delta_Sigma=Delta_Sigma,
+                ell_tol=ell_tol,
+            )
+
+    return np.max(np.abs(y['auto'] - y[None])) / np.max(np.abs(y[None]))
+
+
+def get_cosmo_kwargs(cosmo):
+    """Get Cosmo Kwargs.
+
+    Return arguments to create a copy of a cosmology.
+
+    Parameters
+    ----------
+    cosmo : pyccl.core.Cosmology
+        Cosmological parameters
+
+    Returns
+    -------
+    dict
+        parameters and configuration
+
+    """
+    if hasattr(cosmo, 'to_dict'):
+        # pyccl >= 3
+        return cosmo.to_dict()
+
+    kwargs = dict(cosmo._params_init_kwargs)
+    kwargs.update(getattr(cosmo, '_config_init_kwargs', {}))
+
+    return kwargs
+
+
+def predict_theory(
+    params,
+    x,
+    cosmo,
+    dndz_lens,
+    dndz_source,
+    physical=False,
+    Delta_Sigma=False,
+    **kwargs,
+):
+    """Predict Theory.
 
-        a_lens = 1 / (1 + np.mean(z_lens_sub[idx]))
-        d_ang = cosmo.angular_diameter_distance(a_lens)
-        theta_rad = (r_Mpc / d_ang) * units.radian
-        theta_deg = theta_rad.to('degree')
-        print('MKDEBUG a d r_Mpc theta_deg theta_amin', a_lens, d_ang, r_Mpc[0], theta_deg[0], theta_deg[0] * 60)
+    Return tangential shear or excess surface mass density for parameter
+    values. The galaxy-matter power spectrum is the HOD model if
+    'log10_Mmin' is a parameter, and the linear-bias model otherwise.
+    Other parameters are cosmological, and replace the values of the
+    input cosmology.
 
-        # Tangential shear
-        y_sub = ccl.correlation(
+    Parameters
+    ----------
+    params : dict
+        parameter values
+    x : numpy.array
+        Angular scales in degrees, or physical scales in Mpc if
+        physical is `True`
+    cosmo : pyccl.core.Cosmology
+        Cosmological parameters
+    dndz_lens : tuple of arrays
+        Lens redshift distribution (z, n(z))
+    dndz_source : tuple of arrays
+        Source redshift distribution (z, n(z))
+    physical : bool, optional
+        physical scales if `True`, default is `False`
+    Delta_Sigma : bool, optional
+        excess surface mass density for physical scales if `True`,
+        default is `False`
+    kwargs : dict
+        additional arguments to :func:`gamma_t_theo` or
+        :func:`gamma_t_theo_phys`
+
+    Raises
+    ------
+    ValueError
+        if neither 'log10_Mmin' nor 'bias_1' is a parameter
+
+    Returns
+    -------
+    numpy.array
+        prediction at input scales
+
+    """
+    params = dict(params)
+
+    pk_gm_info = {}
+    if 'log10_Mmin' in params:
+        pk_gm_info['model_type'] = 'HOD'
+        pk_gm_info['log10_Mmin'] = params.pop('log10_Mmin')
+    elif 'bias_1' in params:
+        pk_gm_info['model_type'] = 'linear_bias'
+        pk_gm_info['bias_1'] = params.pop('bias_1')
+    else:
+        raise ValueError('Parameters need to contain log10_Mmin or bias_1')
+
+    if params:
+        cosmo_kwargs = get_cosmo_kwargs(cosmo)
+        cosmo_kwargs.update(params)
+        cosmo = ccl.Cosmology(**cosmo_kwargs)
+
+    if not physical:
+        y, _, _ = gamma_t_theo(
+            x,
             cosmo,
-            ell,
-            cls_gG_sub,
-            theta_deg,
-            type='NG',
-            method=integr_method,
+            dndz_lens,
+            dndz_source,
+            pk_gm_info,
+            **kwargs,
+        )
+    else:
+        y = gamma_t_theo_phys(
+            x,
+            cosmo,
+            dndz_lens,
+            dndz_source,
+            pk_gm_info,
+            Delta_Sigma=Delta_Sigma,
+            **kwargs,
         )
 
-        if Delta_Sigma:
-            sigma_cr_m1_eff = cs_util.cosmo.sigma_crit_m1_eff(
-                np.mean(z_lens_sub[idx]),
-                dndz_source[0],
-                dndz_source[1],
-                cosmo,
-                d_lens=d_ang,
+    return y
+
+
+class GammaTEmulator(object):
+    """Gamma T Emulator.
+
+    This class emulates the tangential shear or excess surface mass
+    density as function of parameters, for given cosmology and redshift
+    distributions. Predictions on a training grid of parameter values are
+    compressed by principal component analysis (PCA), in log if all are
+    positive. The PCA coefficients are interpolated over the parameter
+    grid, and the reconstructed prediction with a cubic spline in log
+    scale. Use :func:`build_emulator` to compute the training grid.
+
+    Parameters
+    ----------
+    param_grid : dict
+        increasing grid values for each parameter name
+    x : numpy.array
+        scales of the training predictions, increasing
+    y : numpy.array
+        training predictions, with shape of the parameter grid followed
+        by the length of x
+    n_pca : int, optional
+        number of principal components; default is ``None``, for which
+        the smallest number with reconstruction error below pca_tol is
+        used
+    pca_tol : float, optional
+        maximum reconstruction error of the training predictions,
+        relative to their maximum absolute value, default is 1e-4
+    method : str, optional
+        interpolation method over the parameter grid, 'linear' or
+        'cubic' (at least four values per parameter), default is 'cubic'
+    physical : bool, optional
+        scales are physical in Mpc if `True`, in degrees otherwise;
+        default is `False`
+    Delta_Sigma : bool, optional
+        predictions are excess surface mass densities if `True`,
+        default is `False`
+
+    Raises
+    ------
+    ValueError
+        if shapes of parameter grid and predictions do not match, or
+        the interpolation method is invalid
+
+    """
+
+    def __init__(
+        self,
+        param_grid,
+        x,
+        y,
+        n_pca=None,
+        pca_tol=1e-4,
+        method='cubic',
+        physical=False,
+        Delta_Sigma=False,
+    ):
+        self.param_names = list(param_grid)
+        self._grids = [
+            np.asarray(param_grid[name], dtype=float)
+            for name in self.param_names
+        ]
+        self.x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+
+        shape = tuple(len(grid) for grid in self._grids)
+        if y.shape != shape + (len(self.x),):
+            raise ValueError(
+                f'Shape of predictions {y.shape} does not match parameter'
+                + f' grid {shape} and scales ({len(self.x)},)'
+            )
+        if method not in ('linear', 'cubic'):
+            raise ValueError(f'Invalid interpolation method {method}')
+        if method == 'cubic' and min(shape) < 4:
+            raise ValueError(
+                'Cubic interpolation needs at least four values per'
+                + ' parameter'
             )
-            # Delta Sigma = gamma_t * (1 / Sigma_eff^{-1})
-            # Since Sigma_cr(z_s, z_l) diverges for z_s -> z_l,
-            # the term gamma_t * Sigma_cr is disfavoured
-            y_sub *= 1 / sigma_cr_m1_eff.value
 
-        # Mean n(z) of sub-slice
-        nz_lens_mean_sub.append(np.mean(nz_lens_sub[idx]))
+        self.physical = physical
+        self.Delta_Sigma = Delta_Sigma
+        self._method = method
+
+        # Maximum relative error at validation points, if checked
+        self.error = None
+
+        # PCA of (log) training predictions
+        y = y.reshape(-1, len(self.x))
+        self._log = bool(np.all(y > 0))
+        if self._log:
+            y = np.log(y)
+        self._mean = np.mean(y, axis=0)
+        _, _, v_t = np.linalg.svd(y - self._mean, full_matrices=False)
+
+        if n_pca is None:
+            for n_pca in range(1, len(v_t) + 1):
+                self._set_pca(y, v_t[:n_pca], shape)
+                if self.pca_error < pca_tol:
+                    break
+        else:
+            self._set_pca(y, v_t[:n_pca], shape)
+
+    def _set_pca(self, y, components, shape):
+        """Set PCA.
+
+        Set principal components, the interpolator of their coefficients,
+        and the reconstruction error of the training predictions.
+
+        """
+        self._components = components
+        coeffs = (y - self._mean) @ components.T
+        self._set_interpolator(coeffs.reshape(shape + (len(components),)))
+
+        y_rec = self._mean + coeffs @ components
+        if self._log:
+            y, y_rec = np.exp(y), np.exp(y_rec)
+        self.pca_error = np.max(np.abs(y_rec - y)) / np.max(np.abs(y))
+
+    def _set_interpolator(self, coeffs):
+        """Set Interpolator.
+
+        Set interpolator of PCA coefficients over the parameter grid.
+
+        """
+        self._coeffs = coeffs
+        self._interp = RegularGridInterpolator(
+            self._grids,
+            coeffs,
+            method=self._method,
+        )
+
+    @property
+    def n_pca(self):
+        """Return number of principal components."""
+        return len(self._components)
+
+    @property
+    def param_ranges(self):
+        """Return ranges of parameters."""
+        return {
+            name: (float(grid[0]), float(grid[-1]))
+            for name, grid in zip(self.param_names, self._grids)
+        }
+
+    def predict(self, params, x=None):
+        """Predict.
+
+        Return emulated prediction.
+
+        Parameters
+        ----------
+        params : dict or lmfit.Parameters
+            parameter values, for all parameters of the emulator
+        x : numpy.array, optional
+            scales, within the range of the training scales; default is
+            ``None``, for the training scales
+
+        Raises
+        ------
+        ValueError
+            if a parameter or scale is outside of the training range
+
+        Returns
+        -------
+        numpy.array
+            prediction
+
+        """
+        point = []
+        for name, grid in zip(self.param_names, self._grids):
+            value = float(params[name])
+            if value < grid[0] or value > grid[-1]:
+                raise ValueError(
+                    f'Parameter {name}={value} outside of emulator range'
+                    + f' [{grid[0]}, {grid[-1]}]'
+                )
+            point.append(value)
+
+        coeffs = self._interp(point)[0]
+        y = self._mean + coeffs @ self._components
+
+        if x is not None:
+            x = np.asarray(x, dtype=float)
+            if np.min(x) < self.x[0] or np.max(x) > self.x[-1]:
+                raise ValueError(
+                    'Scales outside of emulator range'
+                    + f' [{self.x[0]}, {self.x[-1]}]'
+                )
+            y = CubicSpline(np.log(self.x), y)(np.log(x))
+
+        if self._log:
+            y = np.exp(y)
+
+        return y
+
+    def save(self, path):
+        """Save.
+
+        Write emulator to file in numpy ``.npz`` format.
+
+        Parameters
+        ----------
+        path : str
+            output path
+
+        """
+        info = {
+            'param_names': self.param_names,
+            'method': self._method,
+            'log': self._log,
+            'physical': self.physical,
+            'Delta_Sigma': self.Delta_Sigma,
+            'pca_error': self.pca_error,
+            'error': self.error,
+        }
+        arrays = {
+            f'grid_{idx}': grid for idx, grid in enumerate(self._grids)
+        }
+        np.savez(
+            path,
+            info=json.dumps(info),
+            x=self.x,
+            mean=self._mean,
+            components=self._components,
+            coeffs=self._coeffs,
+            **arrays,
+        )
 
-        y.append(y_sub)
+    @classmethod
+    def read(cls, path):
+        """Read.
+
+        Read emulator written by :meth:`save`.
+
+        Parameters
+        ----------
+        path : str
+            input path
+
+        Returns
+        -------
+        GammaTEmulator
+            emulator
+
+        """
+        with np.load(path, allow_pickle=False) as npz:
+            info = json.loads(str(npz['info']))
+
+            emulator = cls.__new__(cls)
+            emulator.param_names = info['param_names']
+            emulator._grids = [
+                npz[f'grid_{idx}']
+                for idx in range(len(info['param_names']))
+            ]
+            emulator.x = npz['x']
+            emulator._mean = npz['mean']
+            emulator._components = npz['components']
+            coeffs = npz['coeffs']
+
+        emulator._method = info['method']
+        emulator._log = info['log']
+        emulator.physical = info['physical']
+        emulator.Delta_Sigma = info['Delta_Sigma']
+        emulator.pca_error = info['pca_error']
+        emulator.error = info['error']
+        emulator._set_interpolator(coeffs)
+
+        return emulator
+
+
+def build_emulator(
+    param_grid,
+    x,
+    cosmo,
+    dndz_lens,
+    dndz_source,
+    physical=False,
+    Delta_Sigma=False,
+    n_pca=None,
+    pca_tol=1e-4,
+    method='cubic',
+    n_check=4,
+    seed=6121975,
+    verbose=False,
+    **kwargs,
+):
+    """Build Emulator.
 
-    # Average weighted by n(z) of sub-slices
-    y_tot = np.average(y, axis=0, weights=nz_lens_mean_sub)
+    Compute predictions on a grid of parameter values, and return their
+    emulator. The emulator error is estimated at the centres of n_check
+    random grid cells, where the interpolation error is largest.
 
-    return y_tot
+    Parameters
+    ----------
+    param_grid : dict
+        increasing grid values for each parameter name, see
+        :func:`predict_theory`
+    x : numpy.array
+        scales, see :func:`predict_theory`
+    cosmo : pyccl.core.Cosmology
+        Cosmological parameters
+    dndz_lens : tuple of arrays
+        Lens redshift distribution (z, n(z))
+    dndz_source : tuple of arrays
+        Source redshift distribution (z, n(z))
+    physical : bool, optional
+        physical scales if `True`, default is `False`
+    Delta_Sigma : bool, optional
+        excess surface mass density for physical scales if `True`,
+        default is `False`
+    n_pca : int, optional
+        number of principal components, see :class:`GammaTEmulator`
+    pca_tol : float, optional
+        PCA tolerance, see :class:`GammaTEmulator`; default is 1e-4
+    method : str, optional
+        interpolation method, see :class:`GammaTEmulator`; default is
+        'cubic'
+    n_check : int, optional
+        number of validation points, default is 4
+    seed : int, optional
+        random seed for validation points
+    verbose : bool, optional
+        verbose output if `True`, default is `False`
+    kwargs : dict
+        additional arguments to :func:`predict_theory`
+
+    Returns
+    -------
+    GammaTEmulator
+        emulator
+
+    """
+    names = list(param_grid)
+    grids = [np.asarray(param_grid[name], dtype=float) for name in names]
+    shape = tuple(len(grid) for grid in grids)
+
+    if verbose:
+        print(f'Computing {np.prod(shape)} training predictions...')
+    y = np.zeros(shape + (len(x),))
+    for idx in np.ndindex(*shape):
+        params = {
+            name: grid[jdx] for name, grid, jdx in zip(names, grids, idx)
+        }
+        y[idx] = predict_theory(
+            params,
+            x,
+            cosmo,
+            dndz_lens,
+            dndz_source,
+            physical=physical,
+            Delta_Sigma=Delta_Sigma,
+            **kwargs,
+        )
+
+    emulator = GammaTEmulator(
+        param_grid,
+        x,
+        y,
+        n_pca=n_pca,
+        pca_tol=pca_tol,
+        method=method,
+        physical=physical,
+        Delta_Sigma=Delta_Sigma,
+    )
+    if verbose:
+        print(
+            f'Using {emulator.n_pca} principal components, reconstruction'
+            + f' error {emulator.pca_error:.2g}'
+        )
+
+    if n_check > 0:
+        rng = np.random.default_rng(seed)
+        params_check = []
+        for _ in range(n_check):
+            params = {}
+            for name, grid in zip(names, grids):
+                jdx = rng.integers(len(grid) - 1)
+                params[name] = (grid[jdx] + grid[jdx + 1]) / 2
+            params_check.append(params)
+
+        emulator.error = check_emulator(
+            emulator,
+            params_check,
+            cosmo,
+            dndz_lens,
+            dndz_source,
+            **kwargs,
+        )
+        if verbose:
+            print(f'Emulator error {emulator.error:.2g}')
+
+    return emulator
+
+
+def check_emulator(
+    emulator,
+    params_check,
+    cosmo,
+    dndz_lens,
+    dndz_source,
+    **kwargs,
+):
+    """Check Emulator.
+
+    Return the maximum deviation of emulated from computed predictions,
+    relative to the maximum absolute value of the latter.
+
+    Parameters
+    ----------
+    emulator : GammaTEmulator
+        emulator
+    params_check : list of dict
+        parameter values
+    cosmo : pyccl.core.Cosmology
+        Cosmological parameters
+    dndz_lens : tuple of arrays
+        Lens redshift distribution (z, n(z))
+    dndz_source : tuple of arrays
+        Source redshift distribution (z, n(z))
+    kwargs : dict
+        additional arguments to :func:`predict_theory`
+
+    Returns
+    -------
+    float
+        relative deviation
+
+    """
+    error = 0
+    for params in params_check:
+        y = predict_theory(
+            params,
+            emulator.x,
+            cosmo,
+            dndz_lens,
+            dndz_source,
+            physical=emulator.physical,
+            Delta_Sigma=emulator.Delta_Sigma,
+            **kwargs,
+        )
+        y_emu = emulator.predict(params)
+        error = max(error, np.max(np.abs(y_emu - y)) / np.max(np.abs(y)))
+
+    return error
 
 
 def pk_gm_theo_IA(
@@ -536,12 +1923,11 @@ def pk_gm_theo_IA(
     ptt_IA_NLA = pt.PTIntrinsicAlignmentTracer(c1 = (z, c1))
 
     # Power spectrum pre-computation
-    ptc = pt.PTCalculator(
-        with_NC=True,
-        with_IA=True,
+    ptc = get_pt_calculator(
         log10k_min=log10k_min,
         log10k_max=log10k_max,
         nk_per_decade=nk_per_decade,
+        with_IA=True,
     )
 
     # 3D galaxy - dark-matter cross power spectrum